@@ -0,0 +1,415 @@
+"""
+    Offline benchmark of the twitchscrapper html extraction, replays the saved
+    Twitch.tv pages on the fixtures folder without network
+
+    Record new pages with 'record_html' on config-twitchscrapper.json, then
+    python benchscrapper.py
+
+    With '-s' the data sources (Selenium and GraphQL) are compared side by side
+    against a local stub server that serves the fixtures
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from bs4 import BeautifulSoup
+
+import twitchscrapper
+from twitchscrapper import (close_pool, data_source, get_href_handler,
+                            parse_directory_html, parse_user_html)
+
+HOME = os.path.normpath(  # The script directory + cxfreeze compatibility
+    os.path.dirname(
+        sys.executable if getattr(sys, 'frozen', False) else __file__))
+
+FIXTURESPATH = os.path.join(HOME, "fixtures")
+
+# Fields expected on each kind of page
+
+DIRECTORY_FIELDS = ['user', 'image', 'status', 'viewers']
+
+USER_FIELDS = [
+    'status', 'twitter', 'instagram', 'facebook', 'youtube', 'discord',
+    'viewers', 'total_views', 'followers', 'following', 'videos_count', 'tags'
+]
+
+
+def legacy_parse_user_html(htmlsource, user):
+    """
+        The user page extraction before the single pass engine, one parse for
+        the page plus one for each social network.
+    """
+
+    soup = BeautifulSoup(htmlsource, 'html.parser')
+
+    status = soup.find('span', {'data-a-target': 'stream-title', 'title': True})
+    status = status['title'] if status else False
+
+    def count(a, b, c=None):
+        try:
+            stat = soup.find(*a).find(*b)
+            stat = stat.find(*c) if c else stat
+            return int("".join([i for i in stat.text if i.isdigit()]))
+        except (AttributeError, ValueError):
+            return -1
+
+    def tw_stat(target):
+        return count(('div', {'class': 'tw-stat', 'data-a-target': target}),
+                     ('span', {'data-a-target': 'tw-stat-value'}))
+
+    def header(target):
+        return count(('a', {'data-a-target': target}),
+                     ('div', {'class': 'channel-header__item-count'}),
+                     ('span', ))
+
+    try:
+        tags = soup.find('div', {'class': 'tw-card-body'}).find(
+            'div', {'class': 'tw-flex'}).find_all("p")
+        tags = [i.text for i in tags]
+    except AttributeError:
+        tags = []
+
+    return {
+        'user': user,
+        'status': status,
+        'twitter': get_href_handler(htmlsource, "twitter.com/"),
+        'instagram': get_href_handler(htmlsource, "instagram.com/"),
+        'facebook': get_href_handler(htmlsource, "facebook.com/"),
+        'youtube': get_href_handler(
+            htmlsource, "youtube.com/", fullhref=True),
+        'discord': get_href_handler(htmlsource, "discord.gg/"),
+        'viewers': tw_stat('channel-viewers-count'),
+        'total_views': tw_stat('total-views-count'),
+        'followers': header('followers-channel-header-item'),
+        'following': header('following-channel-header-item'),
+        'videos_count': header('videos-channel-header-item'),
+        'tags': tags,
+        'time': time.time()
+    }
+
+
+def bench(func, args, repeat=20):
+    """
+        Return the best time in milliseconds of 'repeat' calls to func(*args).
+    """
+
+    best = float('inf')
+    for _ in range(repeat):
+        delta = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - delta)
+
+    return best * 1000
+
+
+def extracted(value):
+    """
+        Return True if the scrapper found the value, False, -1 and empty lists
+        are used when it didn't.
+    """
+
+    return value not in (False, -1, [], None, "")
+
+
+def success_rate(kind, data):
+    """
+        Return the fraction of the expected fields extracted from the parsed
+        directory (list of streams) or user (dictionary) data.
+    """
+
+    if kind == 'directory':
+        found = [extracted(i[f]) for i in data for f in DIRECTORY_FIELDS]
+    else:
+        found = [extracted(data[f]) for f in USER_FIELDS]
+
+    return sum(found) / len(found) if found else 0
+
+
+def replay(fixture, repeat=20):
+    """
+        Return a dictionary with the parse time, peak memory and success rate of
+        the fixture parsed with its twitchscrapper parser.
+
+        'directory.overwatch-en.1528000000.html' -> parse_directory_html
+        'user.xqcow.1528000000.html' -> parse_user_html
+    """
+
+    name = os.path.basename(fixture)
+    kind, page = name.split('.')[:2]
+
+    with open(fixture, 'r', encoding='utf-8') as f:
+        html = f.read()
+
+    if kind == 'directory':
+        parse, args = parse_directory_html, (html, )
+    else:
+        parse, args = parse_user_html, (html, page)
+
+    tracemalloc.start()
+    data = parse(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'fixture': name,
+        'kind': kind,
+        'size_kb': round(len(html) / 1024),
+        'parse_ms': round(bench(parse, args, repeat), 2),
+        'peak_kb': round(peak / 1024),
+        'success': round(success_rate(kind, data), 2)
+    }
+
+
+def compare_legacy(fixture, repeat=20):
+    """
+        Print the user page extraction time before and after the single pass
+        engine for each available parser.
+    """
+
+    with open(fixture, 'r', encoding='utf-8') as f:
+        html = f.read()
+    user = os.path.basename(fixture).split('.')[1]
+
+    parsers = ['html.parser']
+    if twitchscrapper.HTMLPARSER != 'html.parser':
+        parsers.append(twitchscrapper.HTMLPARSER)
+
+    default = twitchscrapper.HTMLPARSER
+    print(f"\n{os.path.basename(fixture)} ({len(html) // 1024} KB)")
+
+    for parser in parsers:
+        twitchscrapper.HTMLPARSER = parser
+
+        legacy = legacy_parse_user_html(html, user)
+        single = parse_user_html(html, user)
+        legacy.pop('time')
+        single.pop('time')
+        same = "same data" if legacy == single else "DIFFERENT data"
+
+        legacyms = bench(legacy_parse_user_html, (html, user), repeat)
+        singlems = bench(parse_user_html, (html, user), repeat)
+
+        print(f"  {parser:<12} legacy {legacyms:8.2f} ms"
+              f"  single pass {singlems:8.2f} ms"
+              f"  x{legacyms / singlems:.1f}  ({same})")
+
+    twitchscrapper.HTMLPARSER = default
+
+
+def find_fixture(fixtures, kind, name, ext):
+    """
+        Return the path of the '<kind>.<name>.<ext>' or
+        '<kind>.<name>.<timestamp>.<ext>' fixture, None if there isn't one.
+    """
+
+    found = glob.glob(os.path.join(fixtures, f"{kind}.{name}.{ext}"))
+    found += glob.glob(os.path.join(fixtures, f"{kind}.{name}.*.{ext}"))
+
+    return sorted(found)[-1] if found else None
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+        Twitch.tv stand-in serving the fixtures, the html pages on GET
+        '/directory/game/<game>' and '/<user>', and the GraphQL answers on POST
+        '/gql' from the 'gql.directory.<game>-<language>.json' and
+        'gql.user.<user>.json' fixtures.
+    """
+
+    fixtures = FIXTURESPATH
+
+    def reply(self, path, contenttype):
+        if not path:
+            self.send_error(404)
+            return
+
+        with open(path, 'rb') as f:
+            body = f.read()
+
+        self.send_response(200)
+        self.send_header('Content-Type', contenttype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].strip('/').split('/')
+        if parts[:2] == ['directory', 'game'] and len(parts) > 2:
+            path = find_fixture(self.fixtures, 'directory',
+                                f"{parts[2].lower()}-*", 'html')
+        else:
+            path = find_fixture(self.fixtures, 'user', parts[-1], 'html')
+
+        self.reply(path, 'text/html; charset=utf-8')
+
+    def do_POST(self):
+        size = int(self.headers.get('Content-Length', 0))
+        variables = json.loads(self.rfile.read(size))['variables']
+
+        if 'login' in variables:
+            path = find_fixture(self.fixtures, 'gql.user', variables['login'],
+                                'json')
+        else:
+            path = find_fixture(self.fixtures, 'gql.directory',
+                                f"{variables['name'].lower()}-*", 'json')
+
+        self.reply(path, 'application/json')
+
+    def log_message(self, format, *args):  # Quiet
+        pass
+
+
+def without_time(data):
+    """
+        Return the scrapped data without the 'time' fields, to compare it.
+    """
+
+    if isinstance(data, list):
+        return [without_time(i) for i in data]
+    if isinstance(data, dict):
+        return {k: v for k, v in data.items() if k != 'time'}
+
+    return data
+
+
+def compare_sources(fixtures, repeat=5):
+    """
+        Print the directory and user data time of each data source against a
+        local stub server with the fixtures, and if their data is the same.
+    """
+
+    StubHandler.fixtures = fixtures
+    server = HTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    # GraphQL calls go to the stub, only in memory
+
+    twitchscrapper.CONFIG.setdefault('gql', {})['url'] = f"{base}/gql"
+
+    games = glob.glob(os.path.join(fixtures, "gql.directory.*.json"))
+    users = glob.glob(os.path.join(fixtures, "gql.user.*.json"))
+    if not games or not users:
+        print(f"\nNo gql.directory.* and gql.user.* fixtures on '{fixtures}'")
+        server.shutdown()
+        return
+
+    game = os.path.basename(games[0]).split('.')[2].split('-')[0]
+    user = os.path.basename(users[0]).split('.')[2]
+    directoryurl = f"{base}/directory/game/{game}"
+    userurl = f"{base}/{user}"
+
+    print(f"\nData sources against {base} ({game}, {user})\n")
+    print(f"{'source':<10} {'directory ms':>13} {'user ms':>10}  data")
+
+    first = None
+    for source in ['gql', 'selenium']:
+        directory_data, user_data, _ = data_source(source)
+        try:  # The language menu isn't clicked, the stub doesn't filter
+            data = [directory_data(directoryurl, None), user_data(userurl)]
+            directoryms = bench(directory_data, (directoryurl, None), repeat)
+            userms = bench(user_data, (userurl, ), repeat)
+        except Exception as e:
+            print(f"{source:<10} unavailable: {str(e).strip()}")
+            continue
+
+        if first is None:
+            first = (source, without_time(data))
+            same = "reference"
+        elif without_time(data) == first[1]:
+            same = f"same as {first[0]}"
+        else:
+            same = f"DIFFERENT from {first[0]}"
+        if False in data:
+            same = "failed"
+
+        print(f"{source:<10} {directoryms:>13.2f} {userms:>10.2f}  {same}")
+
+    close_pool()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+
+    # Command line args
+
+    PARSER = argparse.ArgumentParser(
+        description="Offline benchmark of the twitchscrapper html extraction")
+    PARSER.add_argument(
+        "-f",
+        "--fixtures",
+        help="folder with the recorded html pages, 'fixtures' default",
+        default=FIXTURESPATH,
+        type=str)
+    PARSER.add_argument(
+        "-r",
+        "--repeat",
+        help="parses per fixture, the best time is reported, 20 default",
+        default=20,
+        type=int)
+    PARSER.add_argument(
+        "-m",
+        "--min-success",
+        help="exit with error if a fixture success rate is below, 0 default",
+        default=0,
+        type=float)
+    PARSER.add_argument(
+        "-o",
+        "--output",
+        help="also save the report as json on this file",
+        type=str)
+    PARSER.add_argument(
+        "-l",
+        "--legacy",
+        help="compare the user pages with the extraction before single pass",
+        action="store_true")
+    PARSER.add_argument(
+        "-s",
+        "--sources",
+        help="compare the data sources against a local stub server",
+        action="store_true")
+    ARGS = PARSER.parse_args()
+
+    FIXTURES = sorted(glob.glob(os.path.join(ARGS.fixtures, "*.html")))
+    if not FIXTURES:
+        print(f"No fixtures on '{ARGS.fixtures}'")
+        sys.exit(1)
+
+    # Replay
+
+    print(f"Parser: {twitchscrapper.HTMLPARSER}\n")
+    print(f"{'fixture':<44} {'KB':>6} {'parse ms':>9} {'peak KB':>8} "
+          f"{'success':>8}")
+
+    REPORT = []
+    for fixture in FIXTURES:
+        result = replay(fixture, ARGS.repeat)
+        REPORT.append(result)
+        print(f"{result['fixture']:<44} {result['size_kb']:>6} "
+              f"{result['parse_ms']:>9.2f} {result['peak_kb']:>8} "
+              f"{result['success']:>8.0%}")
+
+    if ARGS.output:
+        with open(ARGS.output, 'w') as f:
+            json.dump({'parser': twitchscrapper.HTMLPARSER, 'report': REPORT}, f)
+
+    if ARGS.legacy:
+        for fixture in FIXTURES:
+            if os.path.basename(fixture).startswith('user.'):
+                compare_legacy(fixture, ARGS.repeat)
+
+    if ARGS.sources:
+        compare_sources(ARGS.fixtures, min(ARGS.repeat, 5))
+
+    FAILED = [i for i in REPORT if i['success'] < ARGS.min_success]
+    for i in FAILED:
+        print(f"\nBelow {ARGS.min_success:.0%}: {i['fixture']}")
+
+    sys.exit(1 if FAILED else 0)
@@ -0,0 +1,122 @@
+"""
+    Cold start benchmark of owbot, the time until 'owbot.py -h' exits for the
+    script and the frozen executable, and the modules loaded at startup
+
+    python benchstartup.py
+    python benchstartup.py -b dist/owbot.exe
+"""
+
+import argparse
+import glob
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HOME = os.path.normpath(  # The script directory + cxfreeze compatibility
+    os.path.dirname(
+        sys.executable if getattr(sys, 'frozen', False) else __file__))
+
+# Modules owbot should only load when a scrape begins
+HEAVY = [
+    'selenium', 'bs4', 'lxml', 'http.client', 'http.server', 'twitchscrapper',
+    'twitchgql', 'imagecache', 'scrapcache', 'ranking', 'numpy'
+]
+
+LOADED_JS = ("import sys; sys.argv = ['owbot.py']; import owbot; "
+             f"print(','.join(m for m in {HEAVY!r} if m in sys.modules))")
+
+
+def run_ms(command, cwd, repeat):
+    """
+        Return the [min, median] milliseconds of 'repeat' runs of the command
+        until it exits.
+    """
+
+    times = []
+    for _ in range(repeat):
+        delta = time.perf_counter()
+        subprocess.run(
+            command,
+            cwd=cwd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=False)
+        times.append((time.perf_counter() - delta) * 1000)
+
+    return [min(times), statistics.median(times)]
+
+
+def sandbox(binary=None):
+    """
+        Return a temporary folder with a copy of the scripts (and the frozen
+        binary), so the config and database files created on startup don't
+        touch the real ones.
+    """
+
+    folder = tempfile.mkdtemp(prefix="owbot-startup-")
+    for script in glob.glob(os.path.join(HOME, "*.py")):
+        shutil.copy(script, folder)
+    if binary:
+        shutil.copy(binary, folder)
+
+    return folder
+
+
+if __name__ == "__main__":
+
+    PARSER = argparse.ArgumentParser(
+        description="Cold start benchmark of owbot, script and executable")
+    PARSER.add_argument(
+        "-r",
+        "--repeat",
+        help="runs per command, the min and median are reported, 10 default",
+        default=10,
+        type=int)
+    PARSER.add_argument(
+        "-b",
+        "--binary",
+        help="frozen executable to measure too, e.g. dist/owbot.exe",
+        type=str)
+    ARGS = PARSER.parse_args()
+
+    FOLDER = sandbox(ARGS.binary)
+    PYTHON = sys.executable
+
+    COMMANDS = [
+        ("python (baseline)", [PYTHON, "-c", "pass"]),
+        ("owbot.py -h", [PYTHON, "owbot.py", "-h"]),
+        ("first scrape imports",
+         [PYTHON, "-c", "import twitchscrapper, imagecache"]),
+    ]
+    if ARGS.binary:
+        BINARY = os.path.join(FOLDER, os.path.basename(ARGS.binary))
+        COMMANDS.append((f"{os.path.basename(ARGS.binary)} -h", [BINARY, "-h"]))
+
+    try:
+        subprocess.run(  # Create the config files and databases first
+            [PYTHON, "owbot.py", "-h"],
+            cwd=FOLDER,
+            stdout=subprocess.DEVNULL,
+            check=False)
+
+        print(f"{'command':<28} {'min ms':>8} {'median ms':>10}")
+        for name, command in COMMANDS:
+            low, median = run_ms(command, FOLDER, ARGS.repeat)
+            print(f"{name:<28} {low:>8.1f} {median:>10.1f}")
+
+        LOADED = subprocess.run(
+            [PYTHON, "-c", LOADED_JS],
+            cwd=FOLDER,
+            capture_output=True,
+            text=True,
+            check=False).stdout.strip()
+        print(f"\nScrapping modules loaded on startup: {LOADED or 'none'}")
+
+    finally:
+        shutil.rmtree(FOLDER, ignore_errors=True)
+
+    sys.exit(1 if LOADED else 0)
@@ -0,0 +1,238 @@
+"""
+    Fuzzy matching of Twitter handles to Twitch user names, used to keep only
+    the streamer own accounts from the ones found on the channel panels
+"""
+
+import functools
+import re
+import time
+
+# Affixes of any game, those of one game (e.g. 'ow' for Overwatch) go on the
+# target 'affixes' because they cut real names of other games ('shadow')
+AFFIXES = ('ttv', 'tv', 'twitch', 'yt', 'live', 'gaming', 'games', 'plays',
+           'official', 'real', 'its', 'the')
+
+NOISE = re.compile(r'[\W_\d]+')
+
+THRESHOLD = 0.6  # Minimum similarity to consider a handle from the user
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize(name, affixes=()):
+    """
+        Return the name lower case without underscores, digits and the common
+        affixes like 'ttv' or 'official', e.g. 'TTV_Kephrii92' -> 'kephrii',
+        plus the extra 'affixes' tuple of the target. Affixes are kept when
+        removing them leaves less than 3 letters.
+    """
+
+    name = NOISE.sub('', name.lower())
+    affixes = sorted(AFFIXES + tuple(affixes), key=len,
+                     reverse=True)  # Longest first, 'ttv' before 'tv'
+
+    changed = True
+    while changed:
+        changed = False
+        for affix in affixes:
+            if name.startswith(affix) and len(name) - len(affix) >= 3:
+                name = name[len(affix):]
+                changed = True
+            elif name.endswith(affix) and len(name) - len(affix) >= 3:
+                name = name[:-len(affix)]
+                changed = True
+
+    return name
+
+
+def bounded_distance(a, b, bound):
+    """
+        Return the Levenshtein distance between 'a' and 'b', or bound + 1 as
+        soon as it's known to be greater than 'bound'.
+    """
+
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    if len(a) > len(b):
+        a, b = b, a
+
+    previous = list(range(len(a) + 1))
+    for j, cb in enumerate(b, 1):
+        current = [j]
+        for i, ca in enumerate(a, 1):
+            current.append(
+                min(previous[i] + 1, current[i - 1] + 1,
+                    previous[i - 1] + (ca != cb)))
+        if min(current) > bound:
+            return bound + 1
+        previous = current
+
+    return previous[-1]
+
+
+def similarity(user, handle, threshold=THRESHOLD, affixes=()):
+    """
+        Return the similarity between 0 and 1 of the normalized names. A name
+        contained on the other one counts as a full match, otherwise it's
+        1 - edit distance / longest length, giving up with 0 as soon as the
+        distance can't reach the 'threshold'.
+    """
+
+    a, b = normalize(user, affixes), normalize(handle, affixes)
+    if not a or not b:
+        return 0
+    if a == b:
+        return 1
+
+    shorter, longer = sorted([a, b], key=len)
+    if len(shorter) >= 3 and shorter in longer:
+        return 1
+
+    size = len(longer)
+    bound = int(size * (1 - threshold))
+    distance = bounded_distance(a, b, bound)
+    if distance > bound:
+        return 0
+
+    return 1 - distance / size
+
+
+@functools.lru_cache(maxsize=65536)
+def match(user, handle, threshold=THRESHOLD, affixes=()):
+    """
+        Return True if the Twitter 'handle' looks like the Twitch 'user'.
+        Memoized per pair, the same panels are seen every cycle.
+    """
+
+    return similarity(user, handle, threshold, affixes) >= threshold
+
+
+def filter_handles(user, handles, threshold=THRESHOLD, affixes=()):
+    """
+        Return the handles that look like the user, in the same order. The
+        'affixes' of the target are stripped too, as a tuple.
+    """
+
+    affixes = tuple(affixes)
+    return [i for i in handles if match(user, i, threshold, affixes)]
+
+
+# Twitch user, Twitter handle found on the panels, is it the user account?
+LABELLED = [
+    ('xqcow', 'xqc', True),
+    ('xqcow', 'xqcow1', True),
+    ('xqcow', 'overwatch', False),
+    ('xqcow', 'owleague', False),
+    ('xqcow', 'gfuel', False),
+    ('kephrii', 'kephrii_', True),
+    ('kephrii', 'ttv_kephrii', True),
+    ('kephrii', 'razer', False),
+    ('kephrii', 'dallasfuel', False),
+    ('shroud', 'shroud', True),
+    ('shroud', 'bearhug', False),
+    ('timthetatman', 'timthetatman', True),
+    ('timthetatman', 'elcrazy87', False),
+    ('summit1g', 'summit1g', True),
+    ('summit1g', 'sixpackjt', False),
+    ('sypherpk', 'sypher_pk', True),
+    ('sypherpk', 'sypherpkgaming', True),
+    ('sypherpk', 'logitechg', False),
+    ('a_seagull', 'a_seagull', True),
+    ('a_seagull', 'seagull', True),
+    ('a_seagull', 'fgtvofficial', False),
+    ('emongg', 'emongg', True),
+    ('emongg', 'emonggofficial', True),
+    ('emongg', 'monkeymaxx', False),
+    ('jayne', 'jaynetv', True),
+    ('jayne', 'jaaane', True),
+    ('jayne', 'jayneowl', True),
+    ('jayne', 'janetwitch', True),
+    ('jayne', 'twitch', False),
+    ('jayne', 'bliizzard', False),
+    ('harbleu', 'harbleu', True),
+    ('harbleu', 'harbleutv', True),
+    ('harbleu', 'harbl3u', True),
+    ('harbleu', 'bleu', True),
+    ('harbleu', 'houstonoutlaws', False),
+    ('harbleu', 'herble', False),
+    ('mickie', 'mickienotmickey', True),
+    ('mickie', 'mickey', True),
+    ('mickie', 'playoverwatch', False),
+    ('mickie', 'philly_fusion', False),
+    ('chipsa', 'chipsahoy', True),
+    ('chipsa', 'chaps', False),
+    ('chipsa', 'snipesa', False),
+    ('mlghwaa', 'mlg_hwaa', True),
+    ('mlghwaa', 'hwaa', True),
+    ('mlghwaa', 'mlg', False),
+    ('mlghwaa', 'majorleaguegaming', False),
+    ('seagull', 'cloud9', False),
+    ('seagull', 'seagullowl', True),
+    ('dafran', 'dafranb', True),
+    ('dafran', 'dafrantwitch', True),
+    ('dafran', 'francedota', False),
+    ('dafran', 'dafrankaren', True),
+    ('shadow', 'shadow_tv', True),
+    ('shadow', 'shadmusic', False),
+    ('arrow', 'arrowyt', True),
+    ('arrow', 'arrival', False),
+    ('window', 'windmill', False),
+]
+
+
+def accuracy(rule):
+    """
+        Return the labelled pairs ratio where 'rule(user, handle)' is right.
+    """
+
+    right = sum(rule(u, h) == label for u, h, label in LABELLED)
+    return right / len(LABELLED)
+
+
+def timing(rule, rounds):
+    """
+        Return the microseconds per pair of 'rule' over the labelled pairs.
+    """
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for u, h, _label in LABELLED:
+            rule(u, h)
+    elapsed = time.perf_counter() - start
+
+    return elapsed / (rounds * len(LABELLED)) * 1e6
+
+
+if __name__ == '__main__':
+
+    import argparse
+    from difflib import SequenceMatcher
+
+    PARSER = argparse.ArgumentParser(
+        description=
+        "Speed and accuracy of the handle matching vs SequenceMatcher > 0.4.")
+    PARSER.add_argument(
+        '-r',
+        '--rounds',
+        help="rounds over the labelled pairs, default 2000",
+        type=int,
+        default=2000)
+    ARGS = PARSER.parse_args()
+
+    RULES = {
+        'sequencematcher': lambda u, h: SequenceMatcher(None, h, u).ratio() > 0.4,
+        'similarity': lambda u, h: similarity(u, h) >= THRESHOLD,
+        'match (memoized)': match
+    }
+
+    print(f"{len(LABELLED)} labelled pairs, {ARGS.rounds} rounds\n")
+    for name, rule in RULES.items():
+        print(f"{name:>18}: {accuracy(rule):.1%} right, "
+              f"{timing(rule, ARGS.rounds):.2f} us/pair")
+
+    print("\nMistakes:")
+    for u, h, label in LABELLED:
+        old = RULES['sequencematcher'](u, h)
+        new = match(u, h)
+        if old != label or new != label:
+            print(f"  {u} / {h}: expected {label}, "
+                  f"sequencematcher {old}, match {new}")
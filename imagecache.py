@@ -0,0 +1,204 @@
+"""
+    Image downloads with keep-alive connections, timeouts and retries, saved by
+    content hash to reuse them across days, with a size bounded LRU eviction
+"""
+
+import hashlib
+import http.client
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlparse
+
+TIMEOUT = 10  # Seconds per request
+
+RETRIES = 3  # Attempts per image
+
+WORKERS = 4  # Images downloaded at the same time
+
+CONNECTIONS = threading.local()  # Keep-alive connections per thread and host
+
+PREFETCHED = {}  # {url: future} downloads started by prefetch()
+PREFETCHEDLOCK = threading.Lock()
+
+EXECUTOR = ThreadPoolExecutor(max_workers=WORKERS)
+
+
+def connection(scheme, host):
+    """
+        Return the open connection of this thread to the host, a new one if
+        there isn't one yet.
+    """
+
+    pool = getattr(CONNECTIONS, 'pool', None)
+    if pool is None:
+        pool = CONNECTIONS.pool = {}
+
+    if (scheme, host) not in pool:
+        kind = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        pool[(scheme, host)] = kind(host, timeout=TIMEOUT)
+
+    return pool[(scheme, host)]
+
+
+def drop_connection(scheme, host):
+    """
+        Close and forget the connection of this thread to the host.
+    """
+
+    pool = getattr(CONNECTIONS, 'pool', {})
+    conn = pool.pop((scheme, host), None)
+    if conn:
+        conn.close()
+
+
+def fetch_bytes(url, retries=RETRIES, redirects=3):
+    """
+        Return the content of the url, retrying with a growing pause on errors,
+        False if all the attempts failed.
+    """
+
+    for attempt in range(retries):
+        parsed = urlparse(url)
+        path = parsed.path + (f"?{parsed.query}" if parsed.query else "")
+
+        try:
+            conn = connection(parsed.scheme, parsed.netloc)
+            conn.request("GET", path, headers={'Connection': 'keep-alive'})
+            response = conn.getresponse()
+            data = response.read()  # Always read to reuse the connection
+
+            if response.status in (301, 302, 303, 307, 308) and redirects:
+                location = urljoin(url, response.getheader('Location'))
+                return fetch_bytes(location, retries, redirects - 1)
+
+            if response.status == 200:
+                return data
+
+            print(f"Error {response.status} downloading: {url}")
+            if response.status == 404:
+                return False
+
+        except (OSError, http.client.HTTPException) as e:
+            drop_connection(parsed.scheme, parsed.netloc)
+            print(f"Error downloading: {url}\n{e}".strip())
+
+        time.sleep(attempt + 1)
+
+    return False
+
+
+def store(data, url, imagespath):
+    """
+        Save the data as '<imagespath>/<hash[:2]>/<hash>.<ext>' and return the
+        path, if the same content was already saved only its access time is
+        updated.
+    """
+
+    digest = hashlib.sha256(data).hexdigest()
+    ext = os.path.splitext(urlparse(url).path)[1] or ".jpg"
+
+    folder = os.path.join(imagespath, digest[:2])
+    if not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+
+    path = os.path.join(folder, f"{digest}{ext}")
+    if os.path.exists(path):
+        os.utime(path)  # Recently used
+        return path
+
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+    return path
+
+
+def fetch_image(url, imagespath):
+    """
+        Download the image and return its content addressed path, False if the
+        download failed.
+    """
+
+    data = fetch_bytes(url)
+    return store(data, url, imagespath) if data else False
+
+
+def prefetch(urls, imagespath):
+    """
+        Start downloading the images in background, get_image() returns them
+        when they are ready.
+    """
+
+    with PREFETCHEDLOCK:
+        for url in urls:
+            if url and url not in PREFETCHED:
+                PREFETCHED[url] = EXECUTOR.submit(fetch_image, url, imagespath)
+
+
+def get_image(url, imagespath):
+    """
+        Return the path of the image, waiting for it if it was prefetched or
+        downloading it now. False if the download failed.
+    """
+
+    with PREFETCHEDLOCK:
+        future = PREFETCHED.pop(url, None)
+
+    path = future.result() if future else False
+    return path if path else fetch_image(url, imagespath)
+
+
+def forget_prefetched():
+    """
+        Cancel the prefetched images not started and forget the rest, so the
+        next cycle downloads fresh thumbnails.
+    """
+
+    with PREFETCHEDLOCK:
+        for future in PREFETCHED.values():
+            future.cancel()
+        PREFETCHED.clear()
+
+
+def evict(imagespath, maxbytes, keep=()):
+    """
+        Delete the least recently used images until the folder is below
+        'maxbytes', never the paths in 'keep' (e.g. tweets not published yet).
+        Downloads still being written ('.tmp') are skipped. Return the count of
+        deleted files.
+    """
+
+    keep = {os.path.abspath(i) for i in keep if i}
+
+    files = []
+    total = 0
+    for root, _, names in os.walk(imagespath):
+        for name in names:
+            if name.endswith('.tmp'):  # A prefetch still downloading
+                continue
+            path = os.path.join(root, name)
+            try:
+                info = os.stat(path)
+            except FileNotFoundError:  # Replaced or deleted meanwhile
+                continue
+            total += info.st_size
+            files.append((info.st_mtime, info.st_size, path))
+
+    deleted = 0
+    for _, size, path in sorted(files):
+        if total <= maxbytes:
+            break
+        if os.path.abspath(path) in keep:
+            continue
+
+        try:
+            os.remove(path)
+            deleted += 1
+        except FileNotFoundError:  # Deleted meanwhile
+            pass
+        total -= size
+
+    return deleted
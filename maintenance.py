@@ -0,0 +1,385 @@
+"""
+    Compaction and retention of the data/ and images/ trees: the json dumps
+    and delta logs of each finished day are rolled into one gzip
+    line-delimited archive with an offset index, repeated error dumps are
+    removed and old data is deleted
+
+    python maintenance.py
+    python maintenance.py --retention 90
+    python maintenance.py --read 20180603 directory.overwatch-en.1528000000.json
+    python maintenance.py --check
+"""
+
+import argparse
+import datetime
+import glob
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+HOME = os.path.normpath(  # The script directory + cxfreeze compatibility
+    os.path.dirname(
+        sys.executable if getattr(sys, 'frozen', False) else __file__))
+
+DATAPATH = os.path.join(HOME, "data")
+
+IMAGESPATH = os.path.join(HOME, "images")
+
+ERRORS = "errors.json"  # Summary of the error dumps removed as repeated
+
+ERROR_AGE = 60  # Seconds before an error dump is old enough to dedupe
+
+
+def archive_paths(datapath, day):
+    """
+        Return the (archive, index) paths of the day, e.g. 'YYYYMMDD.jsonl.gz'
+        and 'YYYYMMDD.index.json'.
+    """
+
+    return (os.path.join(datapath, f"{day}.jsonl.gz"),
+            os.path.join(datapath, f"{day}.index.json"))
+
+
+def load_index(indexpath):
+    """
+        Return the archive index {name: [offset, length]}, empty if there isn't
+        one.
+    """
+
+    try:
+        with open(indexpath, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def read_member(archive, offset, length):
+    """
+        Return the line decompressed from the gzip member on the offset of the
+        open archive.
+    """
+
+    archive.seek(offset)
+    return gzip.decompress(archive.read(length))
+
+
+def read_archived(datapath, day, name):
+    """
+        Return the data of the json file 'name' rolled into the day archive,
+        decompressing only its line. None if it isn't there.
+    """
+
+    archivepath, indexpath = archive_paths(datapath, day)
+    index = load_index(indexpath)
+    if name not in index:
+        return None
+
+    with open(archivepath, 'rb') as f:
+        return json.loads(read_member(f, *index[name]))['data']
+
+
+def iter_archive(archivepath):
+    """
+        Yield (name, data) for each json file rolled into the archive. The
+        archive is also readable as a whole by gzip and zcat.
+    """
+
+    with gzip.open(archivepath, 'rt', encoding='utf-8') as f:
+        for line in f:
+            line = json.loads(line)
+            yield line['name'], line['data']
+
+
+def roll_day(datapath, day):
+    """
+        Roll the json files and jsonl logs (as a list of their lines) of the
+        day folder into the day archive, one gzip member per file so each one
+        can be read alone from the index offsets. Files already on an archive
+        from a previous run are kept. The folder is deleted when it's empty.
+        Return the count of files rolled.
+    """
+
+    daypath = os.path.join(datapath, day)
+    archivepath, indexpath = archive_paths(datapath, day)
+
+    dumps = sorted(glob.glob(os.path.join(daypath, "*.json")))
+    dumps += sorted(glob.glob(os.path.join(daypath, "*.jsonl")))
+    if not dumps:
+        return 0
+
+    oldindex = load_index(indexpath)
+    index = {}
+
+    with open(f"{archivepath}.tmp", 'wb') as out:
+
+        if oldindex:  # Members of the previous archive, copied as they are
+            with open(archivepath, 'rb') as old:
+                for name, (offset, length) in oldindex.items():
+                    old.seek(offset)
+                    index[name] = [out.tell(), length]
+                    out.write(old.read(length))
+
+        rolled = []
+        for dump in dumps:
+            name = os.path.basename(dump)
+            try:
+                with open(dump, 'r') as f:
+                    if dump.endswith('.jsonl'):
+                        data = [json.loads(l) for l in f if l.strip()]
+                    else:
+                        data = json.load(f)
+            except (IOError, ValueError):
+                print(f"Ignored: {dump}")
+                continue
+
+            line = json.dumps({'name': name, 'data': data}) + "\n"
+            member = gzip.compress(line.encode('utf-8'))
+            index[name] = [out.tell(), len(member)]
+            out.write(member)
+            rolled.append(dump)
+
+        out.flush()
+        os.fsync(out.fileno())
+
+    with open(f"{indexpath}.tmp", 'w') as f:
+        json.dump(index, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(f"{archivepath}.tmp", archivepath)
+    os.replace(f"{indexpath}.tmp", indexpath)
+
+    for dump in rolled:  # Only after the archive is safe on disk
+        os.remove(dump)
+
+    if not os.listdir(daypath):
+        os.rmdir(daypath)
+
+    return len(rolled)
+
+
+def roll_days(datapath=DATAPATH, today=None):
+    """
+        Roll every day folder before 'today' (YYYYMMDD) into its archive.
+        Return a dictionary with the files rolled per day.
+    """
+
+    today = today or datetime.date.today().strftime("%Y%m%d")
+
+    rolled = {}
+    for daypath in sorted(glob.glob(os.path.join(datapath, "[0-9]" * 8))):
+        day = os.path.basename(daypath)
+        if day < today and os.path.isdir(daypath):
+            rolled[day] = roll_day(datapath, day)
+
+    return rolled
+
+
+def data_shape(data):
+    """
+        Return the shape of the json data, its keys and the types of the values
+        without the values, e.g. {'status': 'bool', 'viewers': 'int', 'links':
+        'list'}, so the time, viewer counts and links of each dump don't tell
+        repeated errors apart.
+    """
+
+    if isinstance(data, dict):
+        return {k: data_shape(v) for k, v in data.items()}
+    return type(data).__name__
+
+
+def error_digest(base):
+    """
+        Return the hash of an error dump, the '.txt' message and the shape of
+        the '.json' data (the raw file if it isn't json).
+    """
+
+    digest = hashlib.sha256()
+    for ext in ['.txt', '.json']:
+        try:
+            with open(f"{base}{ext}", 'rb') as f:
+                raw = f.read()
+        except IOError:
+            continue
+        if ext == '.json':
+            try:
+                raw = json.dumps(
+                    data_shape(json.loads(raw)), sort_keys=True).encode()
+            except ValueError:
+                pass
+        digest.update(raw)
+
+    return digest.hexdigest()
+
+
+def dedupe_errors(datapath=DATAPATH, now=None):
+    """
+        Keep only the oldest 'error.<ts>.json/.txt' pair of each repeated
+        error, counting the ones removed on the errors.json summary. Return the
+        count of pairs removed.
+    """
+
+    now = time.time() if now is None else now
+
+    summarypath = os.path.join(datapath, ERRORS)
+    summary = load_index(summarypath)  # {hash: {'file', 'count', 'last'}}
+
+    bases = set()
+    for dump in glob.glob(os.path.join(datapath, "error.*.*")):
+        base, ext = os.path.splitext(dump)
+        if (ext in ('.json', '.txt') and
+                now - os.path.getmtime(dump) > ERROR_AGE):
+            bases.add(base)
+
+    def stamp(base):
+        digits = base.rsplit('.', 1)[-1]
+        return int(digits) if digits.isdigit() else 0
+
+    def exists(name):
+        return any(
+            os.path.exists(os.path.join(datapath, f"{name}{ext}"))
+            for ext in ['.txt', '.json'])
+
+    removed = 0
+    for base in sorted(bases, key=stamp):
+        digest = error_digest(base)
+        name = os.path.basename(base)
+        kept = summary.get(digest)
+
+        if not kept or not exists(kept['file']):  # The first one
+            summary[digest] = {'file': name, 'count': 1, 'last': stamp(base)}
+
+        elif kept['file'] != name:  # A repeated one
+            for ext in ['.txt', '.json']:
+                if os.path.exists(f"{base}{ext}"):
+                    os.remove(f"{base}{ext}")
+            kept['count'] += 1
+            kept['last'] = stamp(base)
+            removed += 1
+
+    if bases:
+        with open(f"{summarypath}.tmp", 'w') as f:
+            json.dump(summary, f)
+        os.replace(f"{summarypath}.tmp", summarypath)
+
+    return removed
+
+
+def apply_retention(days,
+                    datapath=DATAPATH,
+                    imagespath=IMAGESPATH,
+                    now=None):
+    """
+        Delete the day archives and folders, error dumps and dated image
+        folders (before the content addressed cache) older than 'days', 0
+        keeps everything. Return the count of paths deleted.
+    """
+
+    if days <= 0:
+        return 0
+
+    now = time.time() if now is None else now
+    cutoff = datetime.date.fromtimestamp(now - days * 86400).strftime("%Y%m%d")
+
+    deleted = 0
+
+    dated = glob.glob(os.path.join(datapath, "[0-9]" * 8 + "*"))
+    dated += glob.glob(os.path.join(imagespath, "[0-9]" * 8))
+    for path in dated:
+        if os.path.basename(path)[:8] >= cutoff:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+        deleted += 1
+
+    for dump in glob.glob(os.path.join(datapath, "error.*.*")):
+        if now - os.path.getmtime(dump) > days * 86400:
+            os.remove(dump)
+            deleted += 1
+
+    return deleted
+
+
+def maintain(datapath=DATAPATH, imagespath=IMAGESPATH, retention=0):
+    """
+        Run every maintenance task, return a dictionary with what was done.
+    """
+
+    delta = time.time()
+
+    rolled = roll_days(datapath)
+    errors = dedupe_errors(datapath)
+    deleted = apply_retention(retention, datapath, imagespath)
+
+    return {
+        'days_rolled': len([day for day in rolled if rolled[day]]),
+        'files_rolled': sum(rolled.values()),
+        'errors_removed': errors,
+        'deleted': deleted,
+        'seconds': round(time.time() - delta, 2)
+    }
+
+
+if __name__ == "__main__":
+
+    PARSER = argparse.ArgumentParser(
+        description="Compaction and retention of the data and images folders")
+    PARSER.add_argument(
+        "-r",
+        "--retention",
+        help="days of data to keep, 0 default keeps everything",
+        default=0,
+        type=int)
+    PARSER.add_argument(
+        "--read",
+        help="print a json file from a day archive",
+        nargs=2,
+        metavar=('DAY', 'NAME'))
+    PARSER.add_argument(
+        "--check",
+        help="check that repeated error dumps are collapsed",
+        action='store_true')
+    ARGS = PARSER.parse_args()
+
+    if ARGS.read:
+        print(json.dumps(read_archived(DATAPATH, *ARGS.read), indent=1))
+
+    elif ARGS.check:  # Error dumps written the way owbot does
+
+        import random
+        import tempfile
+
+        FOLDER = tempfile.mkdtemp(prefix="owbot-maintenance-")
+        FAILURES = [("'bool' object has no attribute 'replace'", False)] * 3
+        FAILURES += [("'NoneType' object is not subscriptable", None)]
+
+        for NOW, (ERROR, STATUS) in enumerate(FAILURES, 1528000000):
+            USERDATA = {
+                'user': random.choice(['xqcow', 'seagull', 'emongg']),
+                'status': STATUS,
+                'viewers': random.randint(100, 30000),
+                'followers': random.randint(1000, 900000),
+                'links': ['https://twitter.com/x'] * random.randint(0, 3),
+                'time': time.time() + random.random()
+            }
+            with open(os.path.join(FOLDER, f"error.{NOW}.json"), 'w') as f:
+                json.dump(USERDATA, f)
+            with open(os.path.join(FOLDER, f"error.{NOW}.txt"), 'w') as f:
+                f.write(f"\nError:\n{ERROR}")
+
+        REMOVED = dedupe_errors(FOLDER, time.time() + ERROR_AGE + 1)
+        LEFT = sorted(glob.glob(os.path.join(FOLDER, "error.*.txt")))
+        print(f"Error dumps removed: {REMOVED}, left: {len(LEFT)}, "
+              f"{'ok' if REMOVED == 2 and len(LEFT) == 2 else 'FAILED'}")
+
+        shutil.rmtree(FOLDER, ignore_errors=True)
+        sys.exit(0 if REMOVED == 2 and len(LEFT) == 2 else 1)
+
+    else:
+        print(maintain(retention=ARGS.retention))
@@ -0,0 +1,317 @@
+"""
+    Latency histograms, counters and gauges of the cycle stages and scrapper
+    phases, exported in the Prometheus text format and as a per cycle json
+    trace
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:  # Optional, to measure the Chrome processes memory
+    import psutil
+except ImportError:
+    psutil = None
+
+BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]  # Seconds
+
+# {(name, labels): value}, labels are sorted (label, value) tuples
+COUNTERS = {}
+GAUGES = {}
+HISTOGRAMS = {}  # {(name, labels): {'buckets': [counts], 'sum': s, 'count': n}}
+HELP = {}  # {name: text}
+METRICSLOCK = threading.Lock()
+
+TRACE = []  # Spans of the current cycle, check start_trace()
+TRACELOCK = threading.Lock()
+
+
+def metric_key(name, labels):
+    """
+        Return the dictionary key of the metric with those labels.
+    """
+
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+def describe(name, text):
+    """
+        Set the '# HELP' text of the metric.
+    """
+
+    HELP[name] = text
+
+
+def count(name, value=1, **labels):
+    """
+        Add 'value' to the counter.
+    """
+
+    key = metric_key(name, labels)
+    with METRICSLOCK:
+        COUNTERS[key] = COUNTERS.get(key, 0) + value
+
+
+def gauge(name, value, **labels):
+    """
+        Set the gauge to 'value'.
+    """
+
+    with METRICSLOCK:
+        GAUGES[metric_key(name, labels)] = value
+
+
+def record(name, seconds, start=None, result='ok', **labels):
+    """
+        Add the seconds to the histogram, and a span to the cycle trace.
+    """
+
+    key = metric_key(name, labels)
+    with METRICSLOCK:
+        histogram = HISTOGRAMS.setdefault(
+            key, {
+                'buckets': [0] * len(BUCKETS),
+                'sum': 0,
+                'count': 0
+            })
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram['buckets'][i] += 1
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+
+    start = time.time() - seconds if start is None else start
+    with TRACELOCK:
+        TRACE.append({
+            'name': name,
+            'labels': dict(key[1]),
+            'start': round(start, 3),
+            'seconds': round(seconds, 3),
+            'result': result,
+            'thread': threading.current_thread().name
+        })
+
+
+@contextmanager
+def timed(name, **labels):
+    """
+        Context manager that records the block seconds on the '<name>_seconds'
+        histogram, and counts it on '<name>_total' with result="ok" or
+        result="error" if it raised.
+    """
+
+    start = time.time()
+    result = 'error'
+    try:
+        yield
+        result = 'ok'
+    finally:
+        record(
+            f"{name}_seconds",
+            time.time() - start,
+            start=start,
+            result=result,
+            **labels)
+        count(f"{name}_total", result=result, **labels)
+
+
+def start_trace():
+    """
+        Forget the spans of the previous cycle.
+    """
+
+    with TRACELOCK:
+        TRACE.clear()
+
+
+def dump_trace(path, **extra):
+    """
+        Save the spans of the current cycle as json on 'path', with the 'extra'
+        fields (e.g. the cycle number).
+    """
+
+    with TRACELOCK:
+        spans = sorted(TRACE, key=lambda span: span['start'])
+
+    with open(path, 'w') as f:
+        json.dump(dict(extra, spans=spans), f)
+
+
+def take_metrics():
+    """
+        Return and forget the counters, gauges, histograms and spans recorded
+        so far, e.g. on a scrapper worker process to merge_metrics() them on
+        owbot.
+    """
+
+    with METRICSLOCK:
+        taken = {
+            'counters': dict(COUNTERS),
+            'gauges': dict(GAUGES),
+            'histograms': dict(HISTOGRAMS)
+        }
+        COUNTERS.clear()
+        GAUGES.clear()
+        HISTOGRAMS.clear()
+
+    with TRACELOCK:
+        taken['trace'] = list(TRACE)
+        TRACE.clear()
+
+    return taken
+
+
+def merge_metrics(taken):
+    """
+        Add the metrics from take_metrics() to the ones of this process.
+    """
+
+    with METRICSLOCK:
+        for key, value in taken['counters'].items():
+            COUNTERS[key] = COUNTERS.get(key, 0) + value
+        GAUGES.update(taken['gauges'])
+        for key, other in taken['histograms'].items():
+            histogram = HISTOGRAMS.setdefault(
+                key, {
+                    'buckets': [0] * len(BUCKETS),
+                    'sum': 0,
+                    'count': 0
+                })
+            histogram['buckets'] = [
+                a + b for a, b in zip(histogram['buckets'], other['buckets'])
+            ]
+            histogram['sum'] += other['sum']
+            histogram['count'] += other['count']
+
+    with TRACELOCK:
+        TRACE.extend(taken['trace'])
+
+
+def browser_rss():
+    """
+        Return the resident memory bytes of the Chrome and chromedriver
+        processes launched by this one, None without psutil.
+    """
+
+    if psutil is None:
+        return None
+
+    total = 0
+    try:
+        children = psutil.Process().children(recursive=True)
+    except psutil.Error:
+        return None
+
+    for child in children:
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:  # Already gone
+            pass
+
+    return total
+
+
+def labels_text(labels, extra=()):
+    """
+        Return the labels as '{k="v",...}', empty without labels.
+    """
+
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ""
+
+    escaped = [(k, v.replace('\\', '\\\\').replace('"', '\\"'))
+               for k, v in labels]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def prometheus_text():
+    """
+        Return every metric in the Prometheus text exposition format.
+    """
+
+    with METRICSLOCK:
+        counters = dict(COUNTERS)
+        gauges = dict(GAUGES)
+        histograms = {
+            k: dict(v, buckets=list(v['buckets']))
+            for k, v in HISTOGRAMS.items()
+        }
+
+    lines = []
+    for kind, metrics in [('counter', counters), ('gauge', gauges),
+                          ('histogram', histograms)]:
+        for name in sorted({name for name, _ in metrics}):
+            if name in HELP:
+                lines.append(f"# HELP {name} {HELP[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+            for key in sorted(k for k in metrics if k[0] == name):
+                labels = key[1]
+                if kind != 'histogram':
+                    lines.append(f"{name}{labels_text(labels)} {metrics[key]}")
+                    continue
+
+                histogram = metrics[key]
+                for bound, counted in zip(BUCKETS, histogram['buckets']):
+                    lines.append(f"{name}_bucket"
+                                 f"{labels_text(labels, [('le', str(bound))])}"
+                                 f" {counted}")
+                lines.append(f"{name}_bucket"
+                             f"{labels_text(labels, [('le', '+Inf')])}"
+                             f" {histogram['count']}")
+                lines.append(f"{name}_sum{labels_text(labels)} "
+                             f"{round(histogram['sum'], 6)}")
+                lines.append(f"{name}_count{labels_text(labels)} "
+                             f"{histogram['count']}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path):
+    """
+        Save prometheus_text() on 'path' atomically, for the node_exporter
+        textfile collector.
+    """
+
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        f.write(prometheus_text())
+    os.replace(tmp, path)
+
+
+def serve(port, host=''):
+    """
+        Serve the '/metrics' endpoint on 'port' from a daemon thread, return
+        the server.
+    """
+
+    # Here, http.server is slow to import and only needed with a port
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        """
+            Answers '/metrics' with prometheus_text().
+        """
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+
+            body = prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # Quiet
+            pass
+
+    server = HTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
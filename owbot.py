@@ -7,16 +7,33 @@
 import argparse
 import datetime
 import json
+import multiprocessing
 import os
 import re
-import shutil
+import signal
 import sys
 import threading
 import time
-from difflib import SequenceMatcher
-from urllib.request import urlopen
-
-from twitchscrapper import get_directory_data, get_user_data
+from urllib.parse import quote
+
+from handlematch import filter_handles
+from maintenance import maintain
+from metrics import (browser_rss, count, dump_trace, gauge, serve,
+                     start_trace, timed, write_prometheus)
+from qbotqueue import DEFAULTS as QUEUE_DEFAULTS
+from qbotqueue import backlog, enqueue, export, load_qbot, queued_images
+from registry import Registry
+from retries import Retries
+from scheduler import Scheduler
+from snapshotdiff import SnapshotLog, changes
+from statestore import atomic_json_dump, load_json, migrate_json, open_state
+from timeseries import (ingest_directory, ingest_user, latest_users,
+                        open_snapshots)
+from viewerstats import load_stats, observe, open_stats
+
+# The scrapping stack (twitchscrapper with Selenium, BeautifulSoup and
+# scrapcache, imagecache with http.client, and ranking with NumPy) is imported
+# when a cycle begins, not at startup
 
 # Paths
 
@@ -31,18 +48,18 @@ DATAPATH = os.path.join(HOME, "data")
 # Files
 
 CONFIGJSON = os.path.join(HOME, "config-owbot.json")
-try:
-    with open(CONFIGJSON, 'r') as f:
-        CONFIG = json.load(f)
-except (IOError, ValueError):
-    CONFIG = {'timer': -1, 'promoted': {}}
-    with open(CONFIGJSON, 'w') as f:
-        json.dump(CONFIG, f)
+CONFIG = load_json(CONFIGJSON, {})
+if not CONFIG:
+    CONFIG = {'next_run': {}}
+    atomic_json_dump(CONFIG, CONFIGJSON)
 
 QBOTJSON = os.path.join(HOME, "qbot.json")
-try:
-    QBOT = json.load(open(QBOTJSON, 'r'))
-except (IOError, ValueError):
+try:  # Qbot owns the file, never renamed if it's unreadable
+    QBOT = load_qbot(QBOTJSON)
+except ValueError:
+    print(f"Unreadable Qbot json {QBOTJSON}, left as it is")
+    QBOT = None
+if not QBOT:
     QBOT = {
         'options': {
             'refresh_schedule': True
@@ -70,6 +87,53 @@ except (IOError, ValueError):
         f"{h:02}:{m:02}" for h in range(0, 24) for m in range(0, 60, 15)
     ]
 
+# Targets, each directory (game + language) with its own Qbot json and ban
+# time, '-b' is used for targets without ban
+
+TARGET = {'game': 'Overwatch', 'language': 'en', 'qbot': 'qbot.json'}
+
+if 'targets' not in CONFIG:
+    CONFIG['targets'] = [TARGET]
+    atomic_json_dump(CONFIG, CONFIGJSON)
+
+
+def target_name(target):
+    """
+        Return the target name, 'game-language' if it doesn't have one.
+    """
+
+    return target.get('name', f"{target['game']}-{target['language']}".lower())
+
+
+# Promoted registry and tweets queue per target, imported from the json files
+# the first time, the queue is exported to the target Qbot json
+
+STATEDB = os.path.join(HOME, "owbot.db")
+STATE = open_state(STATEDB)
+if migrate_json(STATE, CONFIG, QBOT, target_name(CONFIG['targets'][0])):
+    CONFIG.pop('promoted', None)
+    atomic_json_dump(CONFIG, CONFIGJSON)
+
+open_stats(STATE)  # Viewers statistics of every streamer seen
+
+# Backoff and circuit breakers per failure class, 'retry' on the config
+# overrides the policies
+
+RETRIES = Retries(STATE, CONFIG.get('retry', {}))
+
+# Tweets queue limits, 'max_backlog' messages waiting on a Qbot json stop the
+# scrapping for that target and 'cap' pending messages are kept at most
+
+QUEUE = dict(QUEUE_DEFAULTS, **CONFIG.get('queue', {}))
+
+# Directory and user snapshots indexed by (user, time)
+
+SNAPSHOTS = open_snapshots(os.path.join(DATAPATH, "snapshots.db"))
+
+# Directory snapshots saved as deltas on data/YYYYMMDD/directory.<target>.jsonl
+
+DIRECTORYLOG = SnapshotLog(DATAPATH, CONFIG.get('keyframe', 24))
+
 
 def str2seconds(strtime):
     """
@@ -163,8 +227,118 @@ def todaystr():
     return f"{today.year}{today.month:02}{today.day:02}"
 
 
+def load_targets(ban):
+    """
+        Return the config targets ready to use, with 'name', 'url', 'qbotjson',
+        'ban' in seconds ('ban' str by default) and 'affixes' as a tuple.
+    """
+
+    targets = []
+    for target in CONFIG['targets']:
+        target = dict(TARGET, **target)
+        target['name'] = target_name(target)
+        target['url'] = f"https://www.twitch.tv/directory/game/{quote(target['game'])}"
+        target['qbotjson'] = os.path.join(HOME, target['qbot'])
+        target['ban'] = str2seconds(target.get('ban', ban))
+        target['affixes'] = tuple(target.get('affixes', ()))
+        targets.append(target)
+
+    return targets
+
+
+def scrap_directories(targets, tail=0, history=None):
+    """
+        Return a dictionary with the directory data of each target, scrapped at
+        the same time, and dump them on the daily data folder. False for the
+        targets that failed.
+
+        With 'tail' the directories are scrolled down up to that many streams,
+        or until one has less than 'min_viewers' (config).
+
+        If 'history' is a dictionary the viewers statistics of the streamers,
+        as they were before this scrape, are saved on it for the ranking.
+    """
+
+    from twitchscrapper import get_directories_data, warm_up
+
+    pages = [(target['url'], target['language']) for target in targets]
+    with timed('owbot_stage', stage='directories'):
+        warm_up()  # Chrome is already running for the first page
+        results = get_directories_data(
+            pages,
+            increase_image=200,
+            limit=tail,
+            min_viewers=CONFIG.get('min_viewers', 0) if tail else 0)
+
+    directories = {}
+    for target, directory in zip(targets, results):
+
+        directories[target['name']] = directory
+        if directory is False:
+            print(f"Error scraping: {target['url']} ({target['language']})")
+            continue
+
+        print(f"Scrapped: {target['url']} ({target['language']})")
+
+        # Only the changes since the previous snapshot are saved, with a
+        # full keyframe from time to time
+
+        with timed('owbot_stage', stage='dump'):
+            delta = DIRECTORYLOG.write(target['name'], directory)
+            if delta is not None:
+                counts = changes(delta)
+                print(f"Changes: {counts}")
+                for kind, n in counts.items():
+                    count('owbot_stream_changes_total', n, kind=kind)
+
+            ingest_directory(SNAPSHOTS, directory)
+            if history is not None:
+                history.update(
+                    load_stats(STATE, [
+                        entry['user'] for entry in directory
+                        if entry['user'] not in history
+                    ]))
+            observe(STATE, [(entry['user'], entry['viewers'], entry['time'])
+                            for entry in directory])
+
+    return directories
+
+
+def export_metrics(cycle):
+    """
+        Update the driver pool, scrapper cache and browser memory gauges, save
+        the metrics on 'metrics.prom' and the cycle spans as 'trace.<ts>.json'
+        on the daily data folder. Return the trace path.
+    """
+
+    from scrapcache import cache_stats
+    from twitchscrapper import pool_stats
+
+    for stat, value in pool_stats().items():
+        gauge('owbot_driver_pool', value, stat=stat)
+    for stat, value in cache_stats().items():
+        gauge('owbot_scrapper_cache', value, stat=stat)
+
+    rss = browser_rss()
+    if rss is not None:
+        gauge('owbot_browser_rss_bytes', rss)
+
+    write_prometheus(os.path.join(DATAPATH, "metrics.prom"))
+
+    tracepath = os.path.join(DATAPATH, todaystr())
+    if not os.path.exists(tracepath):
+        os.makedirs(tracepath)
+
+    tracefile = os.path.join(tracepath, f"trace.{round(time.time())}.json")
+    dump_trace(tracefile, cycle=cycle)
+
+    return tracefile
+
+
 if __name__ == "__main__":
 
+    multiprocessing.freeze_support()  # Scrapper workers on the executable
+
     DELTA = time.time()
     print("owbot v0.1")
 
@@ -198,6 +372,27 @@ if __name__ == "__main__":
         "--now",
         help="starts immediately, ignoring the saved cycle delay",
         action="store_true")
+    PARSER.add_argument(
+        "-d",
+        "--snapshot",
+        help=
+        "wait time between directory snapshots without promoting, '0' default to only snapshot on each cycle",
+        default="0",
+        type=str)
+    PARSER.add_argument(
+        "-k",
+        "--top",
+        help=
+        "user pages scrapped at the same time from the top of the directory, 1 default",
+        default=1,
+        type=int)
+    PARSER.add_argument(
+        "-t",
+        "--tail",
+        help=
+        "streams collected per directory scrolling down the page, 0 default to only read the first page",
+        default=0,
+        type=int)
     ARGS = PARSER.parse_args()
 
     # TODO DANGEROUS code: All new options need to be here or they will be ignored
@@ -206,135 +401,283 @@ if __name__ == "__main__":
         PARSER.print_usage()
         PARSER.exit()
 
-    # Thread to detect input commands and stop the repeat cycle
+    TARGETS = load_targets(ARGS.ban)
 
-    REPEAT = True
+    # Promoted registry of each target in memory, users never promoted are
+    # forgotten after 'forget' (config) without being seen
 
-    def bot_commands():
+    REGISTRY = {
+        target['name']: Registry(STATE, target['name'], target['ban'],
+                                 str2seconds(CONFIG.get('forget', '7d')))
+        for target in TARGETS
+    }
+
+    # Prometheus '/metrics' endpoint, they are saved on data/metrics.prom
+    # anyway after each cycle
+
+    if CONFIG.get('metrics_port', 0) > 0:
+        serve(CONFIG['metrics_port'])
+        print(f"Metrics on http://localhost:{CONFIG['metrics_port']}/metrics")
+
+    # Tweets queued before a crash but not on the Qbot json yet
+
+    for target in TARGETS:
+        export(STATE, target['name'], target['qbotjson'], QBOT,
+               QUEUE['max_backlog'])
+
+    # Scheduled jobs
+
+    DELAY = str2seconds(ARGS.wait)
+    SNAPSHOT = str2seconds(ARGS.snapshot)
+
+    COUNT = 0
+
+    def promote():
         """
-            Input detection thread.
+            Scrap the directory of every target and queue a tweet about the top
+            streamer not banned on each one. Return the seconds to retry sooner
+            if something failed, from the retry policies, or until the next
+            probe if a circuit breaker is open.
         """
-        global REPEAT
-        while REPEAT:
-            text = input()
-            if text.strip().lower() == "q":  # Quit
-                REPEAT = False
+        global COUNT
+
+        from imagecache import evict, forget_prefetched
+        from scrapcache import cache_stats
+        from scrapworkers import worker_stats
+        from twitchscrapper import page_stats, phase_stats, pool_stats
+
+        COUNT += 1
+        print(f"\n\n#{COUNT}")
+
+        start_trace()
+
+        # After repeated failures scrapping stops until a probe after the
+        # breaker cooldown
+
+        BLOCKED = [
+            kind for kind in ['directory', 'parse'] if not RETRIES.allow(kind)
+        ]
+        if BLOCKED:
+            WAIT = max(RETRIES.remaining(kind) for kind in BLOCKED)
+            print(f"\nCircuit open after repeated '{', '.join(BLOCKED)}' "
+                  f"failures, probing again in {seconds2str(WAIT)}")
+            count('owbot_cycles_total', result='blocked')
+            return WAIT
+
+        # Targets with a full Qbot backlog aren't scrapped, Qbot needs to
+        # post first
+
+        READY = []
+        for target in TARGETS:
+            export(STATE, target['name'], target['qbotjson'], QBOT,
+                   QUEUE['max_backlog'])
+            WAITING = backlog(STATE, target['name'], target['qbotjson'], QBOT)
+            gauge('owbot_queue_backlog', WAITING, target=target['name'])
+            if 0 < QUEUE['max_backlog'] <= WAITING:
+                print(f"\n[{target['name']}] skipped, {WAITING} messages "
+                      f"waiting for Qbot on {target['qbotjson']}")
+                count('owbot_backpressure_total', target=target['name'])
+            else:
+                READY.append(target)
 
-    THREAD = threading.Thread(target=bot_commands)
-    THREAD.daemon = True
-    THREAD.start()
+        if not READY:
+            count('owbot_cycles_total', result='backpressure')
+            return None
 
-    # Repeat cycle
+        # Prepare a tweet of the top Twitch.tv streamer
 
-    DELAY = str2seconds(ARGS.wait)
-    BAN = str2seconds(ARGS.ban)
+        print("\nScrapping data...")
 
-    TIMER = CONFIG['timer'] if not ARGS.now else DELAY
-    TIMER = DELAY if TIMER < 0 else TIMER  # First time is -1 by default
-    TIMER = DELAY if TIMER > DELAY else TIMER  # 2nd while below at least once
+        HISTORY = {}
+        DIRECTORIES = scrap_directories(READY, ARGS.tail, HISTORY)
+
+        # Streamers on several directories share the page and are promoted
+        # only once per cycle, the failure classes that 'failed' or were 'ok'
+        # go to the retry policies, the ranking uses the viewers 'history'
+        # from before this cycle
+
+        CYCLE = {
+            'history': HISTORY,
+            'pages': {},
+            'saved': set(),
+            'promoted': set(),
+            'failed': set(),
+            'ok': set()
+        }
+
+        for target in READY:
+            if DIRECTORIES[target['name']] is False:
+                CYCLE['failed'].add('directory')
+                continue
 
-    COUNT = 0
+            if not DIRECTORIES[target['name']]:  # Loaded but without streams
+                print(f"\nNo streams found on [{target['name']}]")
+                CYCLE['failed'].add('parse')
+                continue
 
-    while REPEAT:
+            print(f"\n[{target['name']}]")
+            promote_target(target, DIRECTORIES[target['name']], CYCLE)
 
-        # Repeat timer
+        if 'directory' not in CYCLE['failed']:  # Every target loaded
+            CYCLE['ok'].add('directory')
 
-        REPEAT = False if DELAY <= 0 else REPEAT
-        if REPEAT and TIMER <= DELAY:
-            print()
+        # Images, the ones still queued on Qbot are kept
 
-        while REPEAT and TIMER <= DELAY:
-            COUNTDOWN = seconds2str(DELAY - TIMER)
-            COUNTDOWN = f" ({COUNTDOWN})... "
-            sys.stdout.write(f"\r'q' + enter to quit{COUNTDOWN}")
-            sys.stdout.flush()
+        forget_prefetched()
 
-            TIMER += 1
-            CONFIG['timer'] = TIMER
-            time.sleep(1)
+        with timed('owbot_stage', stage='evict'):
+            try:  # Without knowing what Qbot still needs nothing is deleted
+                QUEUED = queued_images(STATE) + [
+                    message.get('image') for target in TARGETS
+                    for message in (load_qbot(target['qbotjson']) or {}).get(
+                        'messages', [])
+                ]
+                MAXBYTES = CONFIG.get('images_max_mb', 500) * 1024 * 1024
+                DELETED = evict(IMAGESPATH, MAXBYTES, keep=QUEUED)
+            except ValueError:
+                DELETED = 0
+        if DELETED:
+            print(f"\nImages deleted: {DELETED}")
 
-        with open(CONFIGJSON, 'w') as f:
-            json.dump(CONFIG, f)
+        # Chrome drivers reused from the pool
 
-        if REPEAT:
-            TIMER = 0
-            COUNT += 1
-            print(f"\n\n#{COUNT}")
-        else:
-            sys.exit(0)
+        print(f"\nDriver pool: {pool_stats()}")
+        print(f"Page phases: {phase_stats()}")
+        print(f"Pages: {page_stats()}")
+        print(f"Scrapper cache: {cache_stats()}")
+        print(f"Workers: {worker_stats()}")
 
-        # Prepare a tweet of the top Twitch.tv streamer
+        # Each failure class counts once per cycle
 
-        print("\nScrapping data...")
+        # The backoff is saved anyway, a single run ('-w 0') doesn't retry
+        # but the next one respects the breakers
 
-        DIRURL = "https://www.twitch.tv/directory/game/Overwatch"
-        try:
-            DIRECTORY = get_directory_data(
-                DIRURL, language="en", increase_image=200)
-            print(f"Scrapped: {DIRURL}")
-        except Exception as e:
-            print(f"Error scraping: {DIRURL}\n{e}".strip())
-            TIMER = DELAY - 30
-            continue
+        retry = RETRIES.settle(CYCLE['failed'], CYCLE['ok'])
+        if retry and DELAY <= retry:  # The next cycle is sooner, or never
+            retry = None
+
+        for kind in CYCLE['failed']:
+            count('owbot_failures_total', kind=kind)
+        for kind, (breaker, failures) in RETRIES.breakers().items():
+            gauge('owbot_breaker_open', int(breaker != 'closed'), kind=kind)
+        print(f"Retries: {RETRIES.breakers()}")
+        if retry:
+            print(f"Retrying in {seconds2str(retry)}")
+
+        # Metrics and stages trace of this cycle
 
-        # Dump directory
+        count('owbot_cycles_total', result='retry' if retry else 'ok')
+        print(f"Trace: {export_metrics(COUNT)}")
 
-        DIRPATH = os.path.join(DATAPATH, todaystr())
-        if not os.path.exists(DIRPATH):
-            os.makedirs(DIRPATH)
+        return retry
 
-        DUMP_DIR = os.path.join(DIRPATH,
-                                f"directory.{round(time.time())}.json")
-        with open(DUMP_DIR, 'w') as f:
-            json.dump(DIRECTORY, f)
+    def promote_target(target, DIRECTORY, CYCLE):
+        """
+            Queue a tweet about the top streamer of the target directory not
+            banned nor promoted on this cycle. The failure classes that failed
+            or worked are added to the CYCLE 'failed' and 'ok' sets.
+        """
 
-        # Top Overwatch Twitch streamer
+        from imagecache import get_image, prefetch
+        from ranking import rank
+        from twitchscrapper import get_users_data
 
-        for entry in DIRECTORY:
+        # Top Twitch streamer
 
-            user = entry['user']
-            user_image = entry['image']
+        # Registry setup
 
-            # Registry setup
+        REGISTERED = REGISTRY[target['name']]
+        REGISTERED.seen([entry['user'] for entry in DIRECTORY])
 
-            CONFIG['promoted'] = CONFIG.get('promoted', {})
-            CONFIG['promoted'][user] = CONFIG['promoted'].get(
-                user, {
-                    'count': 0,
-                    'max_viewers': 0,
-                    'min_viewers': 0,
-                    'mean_viewers': 0,
-                    'found': time.time(),
-                    'last_promo': 0
-                })
+        def banned(user):
+            """
+                Return True if the user was promoted recently, or on this cycle
+                by another target.
+            """
 
             # Avoid spamming users
 
-            if time.time() - CONFIG['promoted'][user]['last_promo'] < BAN:
-                continue
+            return REGISTERED.banned(user) or user in CYCLE['promoted']
+
+        # Streamers not banned ranked by their score, only the best
+        # 'candidates' (config) user pages are scrapped
+
+        RANKING = CONFIG.get('ranking', {})
+        USERS_ALLOWED = set(
+            REGISTERED.allowed(entry['user'] for entry in DIRECTORY))
+        ALLOWED = [
+            entry for entry in DIRECTORY if entry['user'] in USERS_ALLOWED and
+            entry['user'] not in CYCLE['promoted']
+        ]
+        NAMES = [entry['user'] for entry in ALLOWED]
+        PROMOS = REGISTERED.last_promos(NAMES)
+
+        with timed('owbot_stage', stage='ranking'):
+            RANKED = rank(ALLOWED, CYCLE['history'], PROMOS,
+                          latest_users(SNAPSHOTS, NAMES),
+                          RANKING.get('weights'))
+        RANKED = RANKED[:RANKING.get('candidates', 10)]
+        print("Ranking: " + ", ".join(
+            f"{entry['user']} ({score})" for entry, score in RANKED[:5]))
+
+        def candidates():
+            """
+                Yield the user url of the best ranked streamers still not
+                banned.
+            """
+            for entry, _ in RANKED:
+                if not banned(entry['user']):
+                    yield f"https://www.twitch.tv/{entry['user']}"
+
+        IMAGES = {entry['user']: entry['image'] for entry in DIRECTORY}
+
+        # The first candidates images are downloaded while the pages load
+
+        prefetch([entry['image'] for entry, _ in RANKED][:max(ARGS.top, 2)],
+                 IMAGESPATH)
+        USERS = get_users_data(
+            candidates(), top=ARGS.top, cache=CYCLE['pages'])
+
+        while True:
+
+            with timed('owbot_stage', stage='user_page'):
+                url, userdata = next(USERS, (None, None))
+            if url is None:
+                break
+
+            user = url.split('/')[-1]
+            user_image = IMAGES[user]
 
             # Data
 
-            url = f"https://www.twitch.tv/{user}"
-            userdata = get_user_data(url)
             if userdata:
                 print(f"Scrapped: {url}")
             else:
                 print(f"Error scrapping: {url}")
 
-                TIMER = DELAY - 30
+                CYCLE['failed'].add('user_page')
                 continue
 
-            # Dump user
+            CYCLE['ok'].add('user_page')
+
+            # Dump user, once per cycle
 
-            USERPATH = os.path.join(DATAPATH, todaystr())
-            if not os.path.exists(USERPATH):
-                os.makedirs(USERPATH)
+            if user not in CYCLE['saved']:
+                CYCLE['saved'].add(user)
 
-            DUMP_USER = os.path.join(USERPATH,
-                                     f"{user}.{round(time.time())}.json")
-            with open(DUMP_USER, 'w') as f:
-                json.dump(userdata, f)
+                with timed('owbot_stage', stage='dump'):
+                    USERPATH = os.path.join(DATAPATH, todaystr())
+                    if not os.path.exists(USERPATH):
+                        os.makedirs(USERPATH)
+
+                    DUMP_USER = os.path.join(
+                        USERPATH, f"{user}.{round(time.time())}.json")
+                    with open(DUMP_USER, 'w') as f:
+                        json.dump(userdata, f)
+
+                    ingest_user(SNAPSHOTS, userdata)
+                    observe(STATE,
+                            [(user, userdata['viewers'], userdata['time'])])
 
             # Data
 
@@ -354,7 +697,7 @@ if __name__ == "__main__":
                 with open(error_name, 'w') as f:
                     f.write(error)
 
-                TIMER = DELAY - 30
+                CYCLE['failed'].add('parse')
                 continue
 
             try:
@@ -374,22 +717,22 @@ if __name__ == "__main__":
                 with open(error_name, 'w') as f:
                     f.write(error)
 
-                TIMER = DELAY - 30
+                CYCLE['failed'].add('parse')
                 continue
 
+            CYCLE['ok'].add('parse')
+
             # Viewers
 
             viewers = f"({userdata['viewers']} viewers)"
 
             # Tags from twitter accounts, if more than one only those kind of
-            # similar to the user name
+            # similar to the user name, without the target 'affixes'
 
             twitters = userdata['twitter']
             if len(twitters) > 1:
-                twitters = [
-                    i for i in twitters
-                    if SequenceMatcher(None, i, user).ratio() > 0.4
-                ]
+                twitters = filter_handles(user, twitters,
+                                          affixes=target['affixes'])
 
             tags = " ".join([f"#{i}" for i in twitters])
 
@@ -398,14 +741,17 @@ if __name__ == "__main__":
             imageurl = user_image
             print(f"Image url: {imageurl}")
 
-            imagepath = os.path.join(IMAGESPATH, todaystr())
-            if not os.path.exists(imagepath):
-                os.makedirs(imagepath)
+            with timed('owbot_stage', stage='image'):
+                imagefile = get_image(imageurl, IMAGESPATH)
+            if not imagefile:
+                print(f"Error downloading: {imageurl}")
 
-            imagefile = os.path.join(imagepath, os.path.basename(imageurl))
-            with urlopen(imageurl) as r, open(imagefile, 'wb') as f:
-                shutil.copyfileobj(r, f)
-                print(f"Downloaded: {imagefile}")
+                CYCLE['failed'].add('image')
+                continue
+
+            CYCLE['ok'].add('image')
+
+            print(f"Downloaded: {imagefile}")
 
             # Queue tweet in Qbot
 
@@ -413,41 +759,139 @@ if __name__ == "__main__":
                 'text': f"{status} {viewers} {url} {tags}".strip(),
                 'image': imagefile
             }
-            QBOT['messages'].append(tweet)
-            with open(QBOTJSON, 'w') as f:
-                json.dump(QBOT, f)
-                print(f"Tweet: {tweet['text']}")
-                print(f"Queued on Qbot: {QBOTJSON}")
+            with timed('owbot_stage', stage='queue'):
+                enqueue(STATE, target['name'], tweet, user, QUEUE['cap'])
+                exported = export(STATE, target['name'], target['qbotjson'],
+                                  QBOT, QUEUE['max_backlog'])
+            count('owbot_promotions_total', target=target['name'])
+            print(f"Tweet: {tweet['text']}")
+            if exported:
+                print(f"Queued on Qbot: {target['qbotjson']}")
+            else:
+                print("Queued on owbot.db until Qbot has room")
 
             # Register
 
-            CONFIG['promoted'][user]['count'] += 1
-            CONFIG['promoted'][user]['last_promo'] = time.time()
+            CYCLE['promoted'].add(user)
+            REGISTERED.promoted(user, userdata['viewers'])  # Viewers and ban
 
-            # Viewers
+            # Just one, the current top player
+            break
 
-            nowviewers = userdata['viewers']
+        USERS.close()  # Cancel the pages still loading
 
-            maxviewers = CONFIG['promoted'][user]['max_viewers']
-            CONFIG['promoted'][user]['max_viewers'] = max(
-                nowviewers, maxviewers)
+    def snapshot():
+        """
+            Scrap and dump the directory, without promoting anyone.
+        """
 
-            minviewers = CONFIG['promoted'][user]['min_viewers']
-            minviewers = nowviewers if minviewers < 1 else minviewers
-            CONFIG['promoted'][user]['min_viewers'] = min(
-                nowviewers, minviewers)
+        if RETRIES.remaining('directory') or RETRIES.remaining('parse'):
+            print("\n\nDirectory snapshot skipped, circuit open")
+            return
 
-            meanviewers = CONFIG['promoted'][user]['mean_viewers']
-            meanviewers = nowviewers if meanviewers < 1 else meanviewers
-            meanviewers = (meanviewers + nowviewers) / 2
-            CONFIG['promoted'][user]['mean_viewers'] = round(meanviewers)
+        print("\n\nDirectory snapshot...")
+        start_trace()
+        scrap_directories(TARGETS, ARGS.tail)
+        export_metrics(COUNT)
 
-            with open(CONFIGJSON, 'w') as f:
-                json.dump(CONFIG, f)
+    MAINTENANCE = CONFIG.get('maintenance', {})
+    MAINTENANCE_LOCK = threading.Lock()
 
-            # Just one, the current top player
-            break
+    def maintenance():
+        """
+            Roll the finished days of data/ into gzip archives, dedupe the error
+            dumps and delete what is older than 'retention_days', on a thread
+            so the scrapping isn't delayed.
+        """
+
+        def run():
+            if not MAINTENANCE_LOCK.acquire(blocking=False):  # Still running
+                return
+            try:
+                summary = maintain(DATAPATH, IMAGESPATH,
+                                   MAINTENANCE.get('retention_days', 0))
+                print(f"\n\nMaintenance: {summary}")
+            except OSError as err:
+                print(f"\n\nMaintenance failed: {err}")
+            finally:
+                MAINTENANCE_LOCK.release()
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    # Next runs are saved as timestamps to survive restarts, the promotion is
+    # due now if the bot was offline longer than the remaining wait
+
+    def save_next_runs(nextruns):
+        """
+            Save the next run of each job on the config.
+        """
+        CONFIG['next_run'] = nextruns
+        atomic_json_dump(CONFIG, CONFIGJSON)
+
+    def show_next_run(name, due):
+        """
+            Show the next job and the time left.
+        """
+        left = seconds2str(due - time.time())
+        nextrun = datetime.datetime.fromtimestamp(due).strftime("%H:%M:%S")
+        sys.stdout.write(f"\n'q' + enter to quit, 'n' + enter to run now "
+                         f"(next '{name}' at {nextrun}, {left})... ")
+        sys.stdout.flush()
+
+    NEXTRUN = CONFIG.get('next_run', {})
+    if 'timer' in CONFIG:  # Before timestamps the countdown was saved
+        if CONFIG['timer'] >= 0:
+            NEXTRUN['promote'] = time.time() + max(DELAY - CONFIG['timer'], 0)
+        del CONFIG['timer']
+
+    FIRST = NEXTRUN.get('promote', time.time() + DELAY)
+    FIRST = min(FIRST, time.time() + DELAY)
+    FIRST = time.time() if ARGS.now or DELAY <= 0 else FIRST
+
+    SCHEDULER = Scheduler(onsave=save_next_runs)
+    SCHEDULER.add('promote', promote, DELAY, FIRST)
+    if SNAPSHOT > 0:
+        SCHEDULER.add('snapshot', snapshot, SNAPSHOT,
+                      NEXTRUN.get('snapshot', time.time()))
+    if DELAY > 0 and MAINTENANCE.get('interval', 86400) > 0:  # Not on -w 0
+        SCHEDULER.add('maintenance', maintenance,
+                      MAINTENANCE.get('interval', 86400),
+                      NEXTRUN.get('maintenance', time.time()))
+
+    # Thread to detect input commands, they wake up the scheduler
+
+    def bot_commands():
+        """
+            Input detection thread.
+        """
+        while SCHEDULER.running:
+            try:
+                text = input().strip().lower()
+            except EOFError:  # Without console
+                return
+            if text == "q":  # Quit
+                SCHEDULER.stop()
+            elif text == "n":  # Run now
+                SCHEDULER.run_now()
+
+    THREAD = threading.Thread(target=bot_commands)
+    THREAD.daemon = True
+    THREAD.start()
+
+    # A SIGTERM (e.g. from a service manager) exits like Ctrl+C, the drivers
+    # and worker processes are closed on the way out
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        SCHEDULER.run(onwait=show_next_run)
+    finally:
+        save_next_runs(SCHEDULER.next_runs())
 
-    # The end
+        # The end
+        if 'twitchscrapper' in sys.modules:  # Only if something was scrapped
+            sys.modules['twitchscrapper'].close_pool()
     print(f"\nDone! ({round(time.time() - DELTA)}s)")
     time.sleep(1)
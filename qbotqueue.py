@@ -0,0 +1,252 @@
+"""
+    Tweets queue between owbot and Qbot: messages are appended to owbot.db and
+    exported in one write to the target Qbot json only while its backlog has
+    room, repeated messages about the same streamer are collapsed into the
+    newest, and an offset file shows what Qbot already posted
+"""
+
+import copy
+import json
+import os
+import time
+
+from statestore import atomic_json_dump, load_json
+
+DEFAULTS = {
+    'max_backlog': 24,  # Messages waiting on a Qbot json before scrapping stops
+    'cap': 100  # Messages pending on owbot.db, the oldest are dropped
+}
+
+# Message states, the 'exported' column
+PENDING, EXPORTED, POSTED, COLLAPSED, DROPPED = 0, 1, 2, 3, 4
+
+# Twitter tokens of a new Qbot json, each target posts on its own account
+TOKENS = {
+    'consumer_key': 'find',
+    'consumer_secret': 'them',
+    'oauth_token': 'on',
+    'oauth_secret': 'apps.twitter.com'
+}
+
+
+def offset_path(qbotjson):
+    """
+        Return the path of the consumer offset file of the Qbot json, e.g.
+        'qbot.offset.json' for 'qbot.json'.
+    """
+
+    return f"{os.path.splitext(qbotjson)[0]}.offset.json"
+
+
+def enqueue(db, target, tweet, user=None, cap=DEFAULTS['cap']):
+    """
+        Append the tweet {'text', 'image'} about the user to the target queue,
+        return its id. Pending messages about the same user are collapsed into
+        this one and the oldest pending over the 'cap' are dropped.
+    """
+
+    with db:
+        if user:
+            db.execute(
+                "UPDATE messages SET exported = ? WHERE target = ? AND "
+                "user = ? AND exported = ?", (COLLAPSED, target, user, PENDING))
+
+        cursor = db.execute(
+            "INSERT INTO messages (target, user, text, image, queued) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (target, user, tweet['text'], tweet.get('image'), time.time()))
+
+        db.execute(
+            "UPDATE messages SET exported = ? WHERE id IN (SELECT id FROM "
+            "messages WHERE target = ? AND exported = ? ORDER BY id DESC "
+            "LIMIT -1 OFFSET ?)", (DROPPED, target, PENDING, max(cap, 1)))
+
+    return cursor.lastrowid
+
+
+def load_qbot(qbotjson, retry=0.5):
+    """
+        Return the Qbot json data, None if the file doesn't exist. The file
+        belongs to Qbot and it's never renamed nor recreated here, a read that
+        catches it half written is retried once after 'retry' seconds and then
+        ValueError is raised.
+    """
+
+    for attempt in range(2):
+        try:
+            with open(qbotjson, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            if attempt:
+                raise
+            time.sleep(retry)
+
+
+def read_qbot(qbotjson, default, target):
+    """
+        Return the Qbot json data, ValueError if it can't be read (check
+        load_qbot()). If the file doesn't exist, a copy of 'default' without
+        messages, with placeholder TOKENS and the target as the schedule name,
+        so it never posts on the account of another target.
+    """
+
+    qbot = load_qbot(qbotjson)
+    if qbot is None:
+        qbot = copy.deepcopy(default)
+        qbot['twitter_tokens'] = dict(TOKENS)
+        qbot.setdefault('schedule', {})['name'] = target
+        qbot['messages'] = []
+    qbot['messages'] = qbot.get('messages', [])
+
+    return qbot
+
+
+def message_key(message):
+    """
+        Return the key that identifies a message on the Qbot json.
+    """
+
+    image = message['image'] if 'image' in message.keys() else None
+    return (message['text'], image)
+
+
+def sync(db, target, qbot, qbotjson):
+    """
+        Mark as posted the exported messages that Qbot already removed from its
+        json data, and save the consumer offset file. Return the offset.
+    """
+
+    waiting = {message_key(m) for m in qbot['messages']}
+    exported = db.execute(
+        "SELECT id, text, image FROM messages WHERE target = ? AND "
+        "exported = ?", (target, EXPORTED)).fetchall()
+
+    posted = [(POSTED, row['id']) for row in exported
+              if message_key(row) not in waiting]
+    if posted:
+        with db:
+            db.executemany("UPDATE messages SET exported = ? WHERE id = ?",
+                           posted)
+
+    counts = dict(
+        db.execute(
+            "SELECT exported, COUNT(*) FROM messages WHERE target = ? "
+            "GROUP BY exported", (target, )).fetchall())
+    last = dict(
+        db.execute(
+            "SELECT exported, MAX(id) FROM messages WHERE target = ? "
+            "GROUP BY exported", (target, )).fetchall())
+
+    offset = {
+        'target': target,
+        'exported': max(last.get(EXPORTED) or 0, last.get(POSTED) or 0),
+        'posted': last.get(POSTED) or 0,
+        'posted_total': counts.get(POSTED, 0),
+        'backlog': len(qbot['messages']),
+        'pending': counts.get(PENDING, 0),
+        'collapsed': counts.get(COLLAPSED, 0),
+        'dropped': counts.get(DROPPED, 0),
+        'time': round(time.time())
+    }
+    atomic_json_dump(offset, offset_path(qbotjson))
+
+    return offset
+
+
+def backlog(db, target, qbotjson, default):
+    """
+        Return the count of messages of the target waiting on its Qbot json and
+        pending on owbot.db, after a sync(). Only the pending ones if the
+        Qbot json can't be read.
+    """
+
+    try:
+        qbot = read_qbot(qbotjson, default, target)
+    except ValueError:
+        return db.execute(
+            "SELECT COUNT(*) FROM messages WHERE target = ? AND exported = ?",
+            (target, PENDING)).fetchone()[0]
+
+    offset = sync(db, target, qbot, qbotjson)
+    return offset['backlog'] + offset['pending']
+
+
+def export(db, target, qbotjson, default, max_backlog=DEFAULTS['max_backlog']):
+    """
+        Move the pending messages of the target to its Qbot json, in one write
+        and only while the json has less than 'max_backlog' messages. Messages
+        about the same users still waiting on the json are replaced by the new
+        ones. Return the count of messages exported, 0 when the Qbot json
+        can't be read, it's left as it is until the next cycle.
+    """
+
+    try:
+        qbot = read_qbot(qbotjson, default, target)
+    except ValueError:
+        print(f"Unreadable Qbot json {qbotjson}, not exported this cycle")
+        return 0
+
+    sync(db, target, qbot, qbotjson)
+
+    room = max(max_backlog - len(qbot['messages']), 0) if max_backlog > 0 else -1
+    pending = db.execute(
+        "SELECT id, user, text, image FROM messages WHERE target = ? AND "
+        "exported = ? ORDER BY id LIMIT ?", (target, PENDING, room)).fetchall()
+    if not pending:
+        return 0
+
+    users = [row['user'] for row in pending if row['user']]
+    marks = ", ".join(["?"] * len(users))
+    replaced = db.execute(
+        f"SELECT id, text, image FROM messages WHERE target = ? AND "
+        f"exported = ? AND user IN ({marks})",
+        [target, EXPORTED] + users).fetchall() if users else []
+
+    collapsed = {message_key(row) for row in replaced}
+    qbot['messages'] = [
+        m for m in qbot['messages'] if message_key(m) not in collapsed
+    ]
+    qbot['messages'] += [{
+        'text': row['text'],
+        'image': row['image']
+    } for row in pending]
+    if not os.path.exists(qbotjson):
+        print(f"New Qbot json {qbotjson}, fill its 'twitter_tokens' so Qbot "
+              f"posts the tweets of '{target}'")
+    atomic_json_dump(qbot, qbotjson)
+
+    with db:
+        db.executemany("UPDATE messages SET exported = ? WHERE id = ?",
+                       [(COLLAPSED, row['id']) for row in replaced] +
+                       [(EXPORTED, row['id']) for row in pending])
+
+    sync(db, target, qbot, qbotjson)
+
+    return len(pending)
+
+
+def queued_images(db):
+    """
+        Return the images of the messages pending or waiting on a Qbot json.
+    """
+
+    return [
+        row['image'] for row in db.execute(
+            "SELECT image FROM messages WHERE exported IN (?, ?) AND "
+            "image IS NOT NULL", (PENDING, EXPORTED))
+    ]
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    PARSER = argparse.ArgumentParser(
+        description="Show the consumer offset of each Qbot json")
+    PARSER.add_argument("qbot", help="Qbot json files", nargs='+')
+    ARGS = PARSER.parse_args()
+
+    for QBOTJSON in ARGS.qbot:
+        print(json.dumps(load_json(offset_path(QBOTJSON), {}), indent=1))
@@ -0,0 +1,279 @@
+"""
+    Promoted registry of a target in memory, only the users promoted as
+    compact records with __slots__ keyed by interned names, bans checked on a
+    set kept by a heap of ban expirations, and users never promoted forgotten
+    from owbot.db after a while without being seen
+
+    python registry.py
+    python registry.py -n 100000
+"""
+
+import heapq
+import sys
+import time
+
+from statestore import (PROMOTED_FIELDS, forget_unseen, get_promoted,
+                        register_seen, update_promoted)
+
+FORGET = 7 * 86400  # Seconds unseen before a user never promoted is forgotten
+
+EVICT_EVERY = 3600  # Seconds between the deletes of the forgotten users
+
+
+class Record:
+    """
+        Registry record of a promoted user, the PROMOTED_FIELDS.
+    """
+
+    __slots__ = PROMOTED_FIELDS
+
+    def __init__(self, found, count=0, max_viewers=0, min_viewers=0,
+                 mean_viewers=0, last_promo=0):
+        self.count = count
+        self.max_viewers = max_viewers
+        self.min_viewers = min_viewers
+        self.mean_viewers = mean_viewers
+        self.found = found
+        self.last_promo = last_promo
+
+
+class Registry:
+    """
+        Registry of the users seen on a target directory, written through to
+        the 'promoted' table. Users promoted less than 'ban' seconds ago are
+        banned, users never promoted and not seen for 'forget' seconds are
+        deleted.
+    """
+
+    def __init__(self, db, target, ban, forget=FORGET):
+        """
+            Load the records of the users promoted on the target.
+        """
+
+        self.db = db
+        self.target = target
+        self.ban = ban
+        self.forget = forget
+        self.evicted = 0  # Last time the forgotten users were deleted
+
+        self.records = {}  # {user: Record} of the users promoted
+        self.bans = {}  # {user: ban expiration} of the users banned
+        self.expirations = []  # Heap of (ban expiration, user)
+
+        rows = db.execute(
+            "SELECT * FROM promoted WHERE target = ? AND count > 0", (target, ))
+        for row in rows:
+            user = sys.intern(row['user'])
+            self.records[user] = Record(**{k: row[k] for k in PROMOTED_FIELDS})
+            self.banish(user, row['last_promo'])
+
+    def __len__(self):
+        return len(self.records)
+
+    def banish(self, user, last_promo):
+        """
+            Ban the user until 'ban' seconds after the promotion.
+        """
+
+        expiration = last_promo + self.ban
+        if expiration > time.time():
+            self.bans[user] = expiration
+            heapq.heappush(self.expirations, (expiration, user))
+
+    def expire(self, now=None):
+        """
+            Lift the bans already expired, the earliest first.
+        """
+
+        now = time.time() if now is None else now
+
+        while self.expirations and self.expirations[0][0] <= now:
+            expiration, user = heapq.heappop(self.expirations)
+            if self.bans.get(user) == expiration:  # Not banned again later
+                del self.bans[user]
+
+    def banned(self, user, now=None):
+        """
+            Return True if the user was promoted less than 'ban' seconds ago.
+        """
+
+        self.expire(now)
+        return user in self.bans
+
+    def allowed(self, users, now=None):
+        """
+            Return the users not banned, in the same order.
+        """
+
+        self.expire(now)
+        bans = self.bans
+        return [user for user in users if user not in bans]
+
+    def seen(self, users, now=None):
+        """
+            Register the users seen on the directory. Once in a while the ones
+            never promoted that weren't seen for 'forget' seconds are deleted.
+        """
+
+        now = time.time() if now is None else now
+
+        register_seen(self.db, self.target, users, now)
+
+        if now - self.evicted >= EVICT_EVERY:
+            self.evicted = now
+            forgotten = forget_unseen(self.db, self.target, now - self.forget)
+            if forgotten:
+                print(f"Registry [{self.target}]: {forgotten} users forgotten")
+
+    def last_promos(self, users):
+        """
+            Return a dictionary with the last promotion timestamp of each user,
+            0 for users never promoted.
+        """
+
+        records = self.records
+        return {
+            user: records[user].last_promo if user in records else 0
+            for user in users
+        }
+
+    def promoted(self, user, viewers, now=None):
+        """
+            Count a promotion of the user with its current viewers, updating
+            the viewers max, min and running mean, and ban it.
+        """
+
+        now = time.time() if now is None else now
+
+        user = sys.intern(user)
+        record = self.records.get(user)
+        if record is None:
+            found = get_promoted(self.db, self.target, user)
+            found = found['found'] if found else None
+            if not found:
+                register_seen(self.db, self.target, [user], now)
+            record = self.records[user] = Record(found or now)
+
+        record.max_viewers = max(viewers, record.max_viewers)
+        record.min_viewers = min(
+            viewers, record.min_viewers if record.min_viewers >= 1 else viewers)
+        record.mean_viewers = round(record.mean_viewers +
+                                    (viewers - record.mean_viewers) /
+                                    (record.count + 1))
+        record.count += 1
+        record.last_promo = now
+
+        self.banish(user, now)
+
+        update_promoted(self.db, self.target, user,
+                        **{k: getattr(record, k) for k in PROMOTED_FIELDS})
+
+
+if __name__ == "__main__":
+
+    import argparse
+    import json
+    import os
+    import random
+    import tempfile
+    import tracemalloc
+
+    from statestore import open_state
+
+    PARSER = argparse.ArgumentParser(
+        description="Memory per 100k users of the registry and ban check time")
+    PARSER.add_argument(
+        "-n",
+        "--users",
+        help="users seen on the registry, 100000 default",
+        type=int,
+        default=100000)
+    PARSER.add_argument(
+        "-p",
+        "--promoted",
+        help="fraction of the users promoted, 0.01 default",
+        type=float,
+        default=0.01)
+    ARGS = PARSER.parse_args()
+
+    NOW = time.time()
+    NAMES = [f"streamer_{i:07}" for i in range(ARGS.users)]
+    PROMOS = {
+        name: NOW - random.uniform(0, 14 * 86400)
+        for name in random.sample(NAMES, int(ARGS.users * ARGS.promoted))
+    }
+
+    def measure(build):
+        """
+            Return the object built and the MB allocated per 100k users.
+        """
+        tracemalloc.start()
+        built = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return built, size / 1024 / 1024 * 100000 / ARGS.users
+
+    # Every user seen as a dictionary, the registry on the config json before
+    # owbot.db
+
+    CONFIGJSON = json.dumps({
+        name: {
+            'count': 1 if name in PROMOS else 0,
+            'max_viewers': 0,
+            'min_viewers': 0,
+            'mean_viewers': 0,
+            'found': NOW,
+            'last_promo': PROMOS.get(name, 0)
+        }
+        for name in NAMES
+    })
+    CONFIG, DICTS = measure(lambda: json.loads(CONFIGJSON))
+
+    _, SLOTS = measure(lambda: [Record(NOW, 1) for _ in NAMES])
+
+    FOLDER = tempfile.mkdtemp(prefix="owbot-registry-")
+    DB = open_state(os.path.join(FOLDER, "owbot.db"))
+    register_seen(DB, 'bench', NAMES, NOW)
+    for NAME, PROMO in PROMOS.items():
+        update_promoted(DB, 'bench', NAME, count=1, last_promo=PROMO)
+
+    REGISTRY, LOADED = measure(lambda: Registry(DB, 'bench', 7 * 86400))
+
+    # A directory of 1000 streams checked 100 times, per user
+
+    DIRECTORY = random.sample(NAMES, min(ARGS.users, 1000))
+
+    DELTA = time.perf_counter()
+    for _ in range(100):
+        ALLOWED = REGISTRY.allowed(DIRECTORY)
+    HEAP = (time.perf_counter() - DELTA) / (100 * len(DIRECTORY)) * 1e9
+
+    DELTA = time.perf_counter()
+    for _ in range(100):
+        ALLOWED = [user for user in DIRECTORY if not REGISTRY.banned(user)]
+    ONE = (time.perf_counter() - DELTA) / (100 * len(DIRECTORY)) * 1e9
+
+    DELTA = time.perf_counter()
+    for _ in range(100):
+        ALLOWED = [
+            user for user in DIRECTORY
+            if time.time() - CONFIG.get(user, {'last_promo': 0})['last_promo']
+            >= 7 * 86400
+        ]
+    ARITHMETIC = (time.perf_counter() - DELTA) / (100 * len(DIRECTORY)) * 1e9
+
+    print(f"{ARGS.users} users seen, {len(PROMOS)} promoted, "
+          f"{len(REGISTRY.bans)} banned\n")
+    print("MB per 100k users")
+    print(f"  config dict of dicts, every user  {DICTS:>8.1f}")
+    print(f"  __slots__ records, every user     {SLOTS:>8.1f}")
+    print(f"  Registry, only the promoted       {LOADED:>8.1f}")
+    print("\nns per ban check")
+    print(f"  last promo arithmetic             {ARITHMETIC:>8.0f}")
+    print(f"  Registry.banned, one by one       {ONE:>8.0f}")
+    print(f"  Registry.allowed, the directory   {HEAP:>8.0f}")
+
+    DB.close()
+    for FILE in os.listdir(FOLDER):
+        os.remove(os.path.join(FOLDER, FILE))
+    os.rmdir(FOLDER)
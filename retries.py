@@ -0,0 +1,224 @@
+"""
+    Retry policies per failure class, exponential backoff with jitter and a
+    circuit breaker that stops scrapping after repeated failures, probing again
+    after a cooldown (half-open), with its state saved on SQLite
+"""
+
+import json
+import random
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS retry_state (
+    kind TEXT PRIMARY KEY,
+    state TEXT NOT NULL
+);
+"""
+
+# Failure classes, a 'threshold' of consecutive failures opens the breaker,
+# 0 never
+POLICIES = {
+    'directory': {  # Directory page not loaded (Chrome, network, Twitch down)
+        'base': 30,
+        'factor': 2,
+        'cap': 1800,
+        'jitter': 0.2,
+        'threshold': 8,
+        'cooldown': 1800
+    },
+    'parse': {  # Page loaded without the data (Twitch markup changed)
+        'base': 60,
+        'factor': 2,
+        'cap': 3600,
+        'jitter': 0.2,
+        'threshold': 4,
+        'cooldown': 3600
+    },
+    'user_page': {  # User page not loaded
+        'base': 30,
+        'factor': 2,
+        'cap': 900,
+        'jitter': 0.2,
+        'threshold': 0,
+        'cooldown': 0
+    },
+    'image': {  # Image download failed
+        'base': 30,
+        'factor': 2,
+        'cap': 900,
+        'jitter': 0.2,
+        'threshold': 0,
+        'cooldown': 0
+    }
+}
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+def new_state():
+    """
+        Return the state of a failure class without failures.
+    """
+
+    return {'failures': 0, 'breaker': CLOSED, 'opened': 0, 'trips': 0}
+
+
+class Retries:
+    """
+        Backoff and circuit breaker state of each failure class, saved on the
+        'retry_state' table of the SQLite connection after each change.
+    """
+
+    def __init__(self, db, policies=None):
+        """
+            'policies' {kind: {...}} override the POLICIES values.
+        """
+
+        self.db = db
+        self.lock = threading.Lock()
+
+        policies = policies or {}
+        self.policies = {
+            kind: dict(POLICIES.get(kind, POLICIES['user_page']),
+                       **policies.get(kind, {}))
+            for kind in set(POLICIES) | set(policies)
+        }
+
+        db.executescript(SCHEMA)
+        self.states = {
+            kind: json.loads(state)
+            for kind, state in db.execute(
+                "SELECT kind, state FROM retry_state")
+        }
+
+    def state(self, kind):
+        """
+            Return the state of the failure class.
+        """
+
+        return self.states.setdefault(kind, new_state())
+
+    def save(self, kind):
+        """
+            Save the state of the failure class.
+        """
+
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO retry_state (kind, state) "
+                "VALUES (?, ?)", (kind, json.dumps(self.state(kind))))
+
+    def backoff(self, kind, failures):
+        """
+            Return the seconds to wait after that many consecutive failures,
+            base * factor ^ (failures - 1) up to the cap, +/- jitter.
+        """
+
+        policy = self.policies[kind]
+        delay = policy['base'] * policy['factor']**max(failures - 1, 0)
+        delay = min(delay, policy['cap'])
+        jitter = policy['jitter']
+
+        return round(delay * random.uniform(1 - jitter, 1 + jitter))
+
+    def allow(self, kind, now=None):
+        """
+            Return True if the breaker of the failure class lets the work run.
+            An open breaker turns half-open after its cooldown, letting one
+            probe run.
+        """
+
+        now = time.time() if now is None else now
+
+        with self.lock:
+            state = self.state(kind)
+            if state['breaker'] != OPEN:
+                return True
+
+            if now - state['opened'] < self.policies[kind]['cooldown']:
+                return False
+
+            state['breaker'] = HALF_OPEN
+            self.save(kind)
+            return True
+
+    def remaining(self, kind, now=None):
+        """
+            Return the seconds until an open breaker lets a probe run, 0 if it
+            isn't open.
+        """
+
+        now = time.time() if now is None else now
+
+        with self.lock:
+            state = self.state(kind)
+            if state['breaker'] != OPEN:
+                return 0
+            return max(state['opened'] + self.policies[kind]['cooldown'] - now,
+                       0)
+
+    def success(self, kind):
+        """
+            Forget the failures of the class and close its breaker.
+        """
+
+        with self.lock:
+            state = self.state(kind)
+            if state['failures'] or state['breaker'] != CLOSED:
+                self.states[kind] = new_state()
+                self.save(kind)
+
+    def failure(self, kind, now=None):
+        """
+            Count a failure of the class, opening the breaker after 'threshold'
+            consecutive ones or when the half-open probe failed. Return the
+            seconds to wait before retrying.
+        """
+
+        now = time.time() if now is None else now
+
+        with self.lock:
+            policy = self.policies[kind]
+            state = self.state(kind)
+            state['failures'] += 1
+
+            tripped = state['breaker'] == HALF_OPEN or (
+                policy['threshold'] and
+                state['failures'] >= policy['threshold'])
+            if tripped:
+                state['breaker'] = OPEN
+                state['opened'] = now
+                state['trips'] += 1
+
+            self.save(kind)
+
+            if tripped:
+                return policy['cooldown']
+            return self.backoff(kind, state['failures'])
+
+    def settle(self, failed, succeeded):
+        """
+            Count once the failure classes that 'failed' on a cycle and never
+            'succeeded' on it, and the success of the others. Return the
+            longest wait of the failures, None if there weren't any.
+        """
+
+        for kind in set(succeeded):
+            self.success(kind)
+
+        delays = [self.failure(kind) for kind in set(failed) - set(succeeded)]
+
+        return max(delays) if delays else None
+
+    def breakers(self):
+        """
+            Return a dictionary with the breaker and consecutive failures of
+            each class, e.g. {'parse': ('open', 4)}.
+        """
+
+        with self.lock:
+            return {
+                kind: (state['breaker'], state['failures'])
+                for kind, state in sorted(self.states.items())
+            }
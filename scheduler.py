@@ -0,0 +1,107 @@
+"""
+    Event driven job scheduler, sleeps until the next job is due and wakes up
+    immediately on commands
+"""
+
+import threading
+import time
+
+
+class Scheduler:
+    """
+        Runs jobs on their own intervals from a single thread. The next run of
+        each job is an absolute timestamp, so it can be saved and restored.
+    """
+
+    def __init__(self, onsave=None):
+        """
+            'onsave' is called with next_runs() each time they change.
+        """
+
+        self.jobs = {}  # {name: {'func': f, 'interval': seconds, 'next': ts}}
+        self.onsave = onsave
+        self.running = True
+        self.wake = threading.Event()
+        self.lock = threading.Lock()
+
+    def add(self, name, func, interval, first=None):
+        """
+            Add the job 'func' to run every 'interval' seconds, the first time
+            at the 'first' timestamp (now + interval by default). An interval
+            of 0 or less runs it only once.
+
+            'func' can return seconds to run again after them instead of the
+            interval, e.g. to retry a failure sooner, ignored when it runs only
+            once.
+        """
+
+        with self.lock:
+            self.jobs[name] = {
+                'func': func,
+                'interval': interval,
+                'next': first if first is not None else
+                time.time() + max(interval, 0)
+            }
+        self.wake.set()
+
+    def run_now(self, name=None):
+        """
+            Make the job 'name', or all the jobs, due now.
+        """
+
+        with self.lock:
+            for job in [self.jobs[name]] if name else self.jobs.values():
+                job['next'] = time.time()
+        self.wake.set()
+
+    def stop(self):
+        """
+            Stop the scheduler, after the job running if any.
+        """
+
+        self.running = False
+        self.wake.set()
+
+    def next_runs(self):
+        """
+            Return a dictionary with the next run timestamp of each job.
+        """
+
+        with self.lock:
+            return {name: job['next'] for name, job in self.jobs.items()}
+
+    def run(self, onwait=None):
+        """
+            Run the jobs when they are due until stop() is called or there
+            aren't more jobs. 'onwait' is called with the name and timestamp of
+            the next job each time the scheduler goes to sleep.
+        """
+
+        while self.running:
+
+            self.wake.clear()
+
+            with self.lock:
+                if not self.jobs:
+                    break
+                name = min(self.jobs, key=lambda k: self.jobs[k]['next'])
+                job = self.jobs[name]
+
+            wait = job['next'] - time.time()
+            if wait > 0:
+                if onwait:
+                    onwait(name, job['next'])
+                self.wake.wait(wait)
+                continue
+
+            again = job['func']()
+
+            with self.lock:
+                if job['interval'] <= 0:
+                    self.jobs.pop(name, None)
+                else:
+                    again = job['interval'] if again is None else again
+                    job['next'] = time.time() + again
+
+            if self.onsave:
+                self.onsave(self.next_runs())
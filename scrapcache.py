@@ -0,0 +1,171 @@
+"""
+    Short lived cache for the scrapper results, with stale-while-revalidate,
+    negative caching of failed pages and optional persistence on disk
+"""
+
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+
+DEFAULTS = {
+    'ttl': 300,  # Seconds a result is fresh
+    'stale': 600,  # Seconds after 'ttl' a result is used while refreshing
+    'negative': 20,  # Seconds a failed page (False) isn't tried again
+    'path': ''  # Json file to keep the results between runs, '' disabled
+}
+
+CACHE = {}  # {key: {'value': result, 'time': timestamp}}
+CACHELOCK = threading.Lock()
+
+STATS = {'hits': 0, 'stale': 0, 'negative': 0, 'misses': 0, 'refreshes': 0}
+
+REFRESHING = set()  # Keys being refreshed in background
+
+LOADED = []  # Paths already loaded from disk
+
+
+def cache_stats():
+    """
+        Return a dictionary with the hits (fresh, stale and negative), misses
+        and background refreshes counts, plus the hit rate.
+    """
+
+    with CACHELOCK:
+        stats = dict(STATS)
+
+    hits = stats['hits'] + stats['stale'] + stats['negative']
+    total = hits + stats['misses']
+    stats['hit_rate'] = round(hits / total, 2) if total else 0
+
+    return stats
+
+
+def load(path):
+    """
+        Load the results saved on the json path, once.
+    """
+
+    if not path or path in LOADED:
+        return
+    LOADED.append(path)
+
+    try:
+        with open(path, 'r') as f:
+            saved = json.load(f)
+    except (IOError, ValueError):
+        return
+
+    with CACHELOCK:
+        for key, entry in saved.items():
+            CACHE.setdefault(key, entry)
+
+
+def save(path, expire):
+    """
+        Save the results not older than 'expire' seconds on the json path.
+    """
+
+    if not path:
+        return
+
+    now = time.time()
+    with CACHELOCK:
+        saved = {
+            k: v
+            for k, v in CACHE.items() if v['value'] and now - v['time'] < expire
+        }
+
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(saved, f)
+    os.replace(tmp, path)
+
+
+def cached(settings):
+    """
+        Decorator to cache the results of a scrapper function by its arguments,
+        'settings' is a function that returns the DEFAULTS keys to use. A
+        'cancel' argument is not part of the key, and results of cancelled
+        calls are not saved.
+    """
+
+    def decorator(func):
+
+        signature = inspect.signature(func)
+        cancellable = 'cancel' in signature.parameters
+
+        def call(key, arguments, cancel=None):
+            """
+                Call the function and save the result.
+            """
+            if cancellable:
+                value = func(**arguments, cancel=cancel)
+            else:
+                value = func(**arguments)
+
+            if not (cancel and cancel.is_set()):
+                with CACHELOCK:
+                    CACHE[key] = {'value': value, 'time': time.time()}
+
+                config = dict(DEFAULTS, **settings())
+                save(config['path'], config['ttl'] + config['stale'])
+
+            return value
+
+        def refresh(key, arguments):
+            """
+                Background refresh of a stale result.
+            """
+            try:
+                call(key, arguments)
+            except Exception as e:
+                print(f"Error refreshing {func.__name__}:\n{e}".strip())
+            finally:
+                with CACHELOCK:
+                    REFRESHING.discard(key)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+
+            config = dict(DEFAULTS, **settings())
+            load(config['path'])
+
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+            cancel = arguments.pop('cancel', None)
+            key = json.dumps([func.__name__, arguments], sort_keys=True)
+
+            with CACHELOCK:
+                entry = CACHE.get(key)
+                age = time.time() - entry['time'] if entry else None
+
+                if entry and entry['value'] is False:
+                    if age < config['negative']:
+                        STATS['negative'] += 1
+                        return False
+
+                elif entry and age < config['ttl']:
+                    STATS['hits'] += 1
+                    return entry['value']
+
+                elif entry and age < config['ttl'] + config['stale']:
+                    STATS['stale'] += 1
+                    if key not in REFRESHING:
+                        REFRESHING.add(key)
+                        STATS['refreshes'] += 1
+                        threading.Thread(
+                            target=refresh, args=(key, arguments),
+                            daemon=True).start()
+                    return entry['value']
+
+                STATS['misses'] += 1
+
+            return call(key, arguments, cancel)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,726 @@
+"""
+    Supervised scrapper worker processes, each job runs on a worker with a wall
+    clock timeout and the worker is restarted with its whole process tree
+    (chromedriver and Chrome) killed when it hangs, dies or goes over the
+    memory limit. Generator jobs stream their items back, and a cancel event
+    reaches the job on the worker. A watchdog thread restarts dead workers,
+    kills the browsers orphaned by them and reports the memory and CPU of each
+    one, with psutil or /proc
+"""
+
+import importlib
+import multiprocessing
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+try:  # Optional, to measure the workers and find orphaned browsers, /proc
+    # is read instead on Linux
+    import psutil
+except ImportError:
+    psutil = None
+
+from metrics import count, gauge
+
+DEFAULTS = {
+    'processes': 2,  # Worker processes, 0 scraps on owbot threads instead
+    'job_timeout': 120,  # Seconds before a job is abandoned, the worker killed
+    'max_rss_mb': 1500,  # Memory of a worker and its browsers before a restart
+    'watchdog': 10  # Seconds between the watchdog checks
+}
+
+# Environment variable set on the workers, inherited by their chromedriver and
+# Chrome processes, with the owbot pid
+MARKER = 'OWBOT_WORKER_OF'
+
+BROWSERS = ['chrome', 'chromium']  # Process names of the orphans to kill
+
+SUPERVISOR = None
+SUPERVISORLOCK = threading.Lock()
+
+CANCEL = None  # Cancel event of the job running on this worker process
+
+
+class WorkerError(Exception):
+    """
+        A job raised an exception on the worker process.
+    """
+
+
+def reap_zombies():
+    """
+        Wait for the children of this process that already exited, so they
+        don't stay as zombies. Return how many. Only on POSIX.
+    """
+
+    if not hasattr(os, 'WNOHANG'):
+        return 0
+
+    reaped = 0
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            break
+        reaped += 1
+
+    return reaped
+
+
+def job_cancel():
+    """
+        Return the cancel event of the job running on this worker process, set
+        when the caller of the job cancels it. None outside a worker.
+    """
+
+    return CANCEL
+
+
+def kill_children():
+    """
+        Kill the descendants of this process still alive, e.g. the browsers of
+        a job interrupted before it quit its driver.
+    """
+
+    if psutil:
+        for child in psutil.Process().children(recursive=True):
+            try:
+                child.kill()
+            except psutil.Error:
+                pass
+        return
+
+    table = proc_table()
+    for child in descendants(table, os.getpid()) if table else []:
+        try:
+            os.kill(child, signal.SIGKILL)
+        except OSError:  # Already gone
+            pass
+
+
+def worker_main(conn, parent, cancel, cleanup=None, warmup=None):
+    """
+        Worker process loop, runs each (module, function, args, stream) job
+        received on the connection and sends back ('ok', result) or ('error',
+        message). Stream jobs return a generator, each item is sent as ('item',
+        item) until it ends or the 'cancel' event is set. None stops it. The
+        children that exited are reaped while it waits.
+
+        The 'warmup' (module, function) job runs first, e.g. to launch its
+        drivers before the first page. However it stops, None, owbot gone or a
+        SIGTERM, the 'cleanup' job runs last and the browsers left are killed.
+    """
+
+    global CANCEL
+
+    CANCEL = cancel
+    os.environ[MARKER] = str(parent)
+    if hasattr(os, 'setpgrp'):  # Its own process group, killed as a whole
+        os.setpgrp()
+
+    # multiprocessing terminates the workers on Ctrl+C or a crash of owbot
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        if warmup:
+            module, function = warmup
+            try:
+                getattr(importlib.import_module(module), function)()
+            except Exception as e:  # The jobs will fail on their own
+                print(f"Worker warm up failed: {type(e).__name__}: {e}")
+        worker_loop(conn, cancel)
+    finally:
+        try:
+            if cleanup:
+                module, function = cleanup
+                getattr(importlib.import_module(module), function)()
+        finally:
+            kill_children()
+
+
+def worker_loop(conn, cancel):
+    """
+        Run the jobs received on the connection until None or owbot is gone,
+        check worker_main().
+    """
+
+    while True:
+        try:
+            if not conn.poll(5):
+                reap_zombies()
+                continue
+            job = conn.recv()
+        except (EOFError, OSError):  # owbot is gone
+            break
+
+        if job is None:
+            break
+
+        module, function, args, stream = job
+        try:
+            result = getattr(importlib.import_module(module), function)(*args)
+            if stream:
+                try:
+                    for item in result:
+                        conn.send(('item', item))
+                        if cancel.is_set():
+                            break
+                finally:
+                    result.close()
+                result = None
+            conn.send(('ok', result))
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {e}"))
+
+        reap_zombies()
+
+
+def proc_table():
+    """
+        Return {pid: (ppid, name, rss bytes, cpu seconds)} of every process
+        read from /proc, empty without /proc. The Linux fallback of psutil.
+    """
+
+    if not os.path.isdir('/proc'):
+        return {}
+
+    pagesize = os.sysconf('SC_PAGE_SIZE')
+    ticks = os.sysconf('SC_CLK_TCK')
+
+    table = {}
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat", 'r') as f:
+                stat = f.read()
+        except OSError:  # Already gone
+            continue
+        # The name is between parentheses and can have spaces, the fields
+        # after it start on the state, then ppid, utime (12th) and stime
+        name = stat[stat.find('(') + 1:stat.rfind(')')]
+        fields = stat[stat.rfind(')') + 2:].split()
+        table[int(pid)] = (int(fields[1]), name, int(fields[21]) * pagesize,
+                           (int(fields[11]) + int(fields[12])) / ticks)
+
+    return table
+
+
+def descendants(table, pid):
+    """
+        Return the pids of the descendants of the process on the proc_table().
+    """
+
+    children = {}
+    for child, (ppid, _, _, _) in table.items():
+        children.setdefault(ppid, []).append(child)
+
+    found = []
+    pending = [pid]
+    while pending:
+        for child in children.get(pending.pop(), []):
+            found.append(child)
+            pending.append(child)
+
+    return found
+
+
+def kill_group(pid):
+    """
+        Kill what is left of the process group of a worker, its browsers
+        included even if the worker is gone. Only on POSIX.
+    """
+
+    if hasattr(os, 'killpg'):
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except OSError:  # Nothing left
+            pass
+
+
+def kill_tree(pid):
+    """
+        Kill the process and all its descendants, its chromedriver and Chrome
+        processes.
+    """
+
+    if psutil:
+        try:
+            parent = psutil.Process(pid)
+            tree = parent.children(recursive=True) + [parent]
+        except psutil.Error:
+            tree = []
+        for process in tree:
+            try:
+                process.kill()
+            except psutil.Error:
+                pass
+        psutil.wait_procs(tree, timeout=5)
+
+    elif hasattr(os, 'killpg'):
+        table = proc_table()
+        for process in [pid] + descendants(table, pid) if table else []:
+            try:
+                os.kill(process, signal.SIGKILL)
+            except OSError:  # Already gone
+                pass
+
+    if hasattr(os, 'killpg'):  # The rest of its process group
+        kill_group(pid)
+    elif not psutil:
+        subprocess.run(['taskkill', '/T', '/F', '/PID', str(pid)],
+                       stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL,
+                       check=False)
+
+
+def tree_usage(pid):
+    """
+        Return the (rss bytes, cpu seconds, processes) of the process and its
+        descendants, Nones without psutil nor /proc.
+    """
+
+    if psutil is None:
+        table = proc_table()
+        if not table:
+            return None, None, None
+        tree = [p for p in [pid] + descendants(table, pid) if p in table]
+        return (sum(table[p][2] for p in tree), sum(table[p][3] for p in tree),
+                len(tree))
+
+    rss, cpu, processes = 0, 0, 0
+    try:
+        parent = psutil.Process(pid)
+        tree = [parent] + parent.children(recursive=True)
+    except psutil.Error:
+        return 0, 0, 0
+
+    for process in tree:
+        try:
+            rss += process.memory_info().rss
+            times = process.cpu_times()
+            cpu += times.user + times.system
+            processes += 1
+        except psutil.Error:  # Already gone
+            pass
+
+    return rss, cpu, processes
+
+
+def pid_exists(pid):
+    """
+        Return True if a process with the pid is running.
+    """
+
+    if psutil:
+        return psutil.pid_exists(pid)
+
+    try:  # Only POSIX, on Windows os.kill terminates the process
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # Someone else's
+        pass
+
+    return True
+
+
+def abandoned(owner, parents, workers):
+    """
+        Return True if a browser marked with the 'owner' owbot pid, with the
+        'parents' pids above it, was left behind by a worker of this process
+        that is gone, or by an owbot that isn't running anymore.
+    """
+
+    if owner is None:
+        return False
+
+    if owner == str(os.getpid()):
+        return not set(workers) & set(parents)
+
+    return owner.isdigit() and not pid_exists(int(owner))
+
+
+def kill_orphans(workers):
+    """
+        Kill the browser processes abandoned by the workers of this process, or
+        by the workers of an owbot that didn't quit them (check abandoned()).
+        Return how many.
+    """
+
+    killed = 0
+
+    if psutil is None:
+        table = proc_table()
+        for pid, (ppid, name, _, _) in table.items():
+            if not any(browser in name.lower() for browser in BROWSERS):
+                continue
+            try:
+                with open(f"/proc/{pid}/environ", 'rb') as f:
+                    environ = dict(
+                        entry.decode(errors='replace').partition('=')[::2]
+                        for entry in f.read().split(b'\0') if entry)
+                parents = []
+                while ppid in table and ppid not in parents:
+                    parents.append(ppid)
+                    ppid = table[ppid][0]
+                if not abandoned(environ.get(MARKER), parents, workers):
+                    continue
+                os.kill(pid, signal.SIGKILL)
+                killed += 1
+            except OSError:  # Gone, or not ours to read
+                pass
+        return killed
+
+    for process in psutil.process_iter(['name']):
+        name = (process.info['name'] or '').lower()
+        if not any(browser in name for browser in BROWSERS):
+            continue
+        try:
+            owner = process.environ().get(MARKER)
+            parents = [p.pid for p in process.parents()]
+            if not abandoned(owner, parents, workers):
+                continue
+            process.kill()
+            killed += 1
+        except psutil.Error:  # Gone, or not ours to read
+            pass
+
+    return killed
+
+
+class Worker:
+    """
+        A worker process and its connection, with its usage counters.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.cancel = None  # Event set to cancel the job running
+        self.lock = threading.Lock()  # Held while a job runs
+        self.jobs = 0
+        self.timeouts = 0
+        self.restarts = 0
+        self.busy = 0  # Time the current job started, 0 idle
+
+
+class Supervisor:
+    """
+        Pool of worker processes that runs jobs with a timeout and a memory
+        limit, plus the watchdog thread.
+    """
+
+    def __init__(self, settings=None, cleanup=None, warmup=None):
+        """
+            'settings' override the DEFAULTS. 'cleanup' is a (module, function)
+            job each worker runs before stopping, e.g. to quit its drivers, and
+            'warmup' one it runs each time it starts, e.g. to launch them.
+        """
+
+        self.settings = dict(DEFAULTS, **(settings or {}))
+        self.cleanup = cleanup
+        self.warmup = warmup
+        self.context = multiprocessing.get_context('spawn')
+        self.running = True
+
+        if psutil is None and not os.path.isdir('/proc'):
+            print("Without psutil the workers 'max_rss_mb' limit and the "
+                  "orphaned browsers check are off")
+
+        self.workers = [
+            Worker(i) for i in range(max(1, self.settings['processes']))
+        ]
+        self.idle = queue.Queue()
+        for worker in self.workers:
+            self.start(worker)
+            self.idle.put(worker)
+
+        self.watchdog = threading.Thread(target=self.watch, daemon=True)
+        self.watchdog.start()
+
+    def start(self, worker):
+        """
+            Launch the worker process.
+        """
+
+        conn, child = self.context.Pipe()
+        worker.cancel = self.context.Event()
+        worker.process = self.context.Process(
+            target=worker_main,
+            args=(child, os.getpid(), worker.cancel, self.cleanup,
+                  self.warmup),
+            daemon=True)
+        worker.process.start()
+        child.close()
+        worker.conn = conn
+
+    def kill(self, worker):
+        """
+            Kill the worker process tree, or what is left of it if the worker
+            already exited.
+        """
+
+        if worker.process.exitcode is None:
+            kill_tree(worker.process.pid)
+        else:  # Its pid could belong to another process now
+            kill_group(worker.process.pid)
+        worker.process.join(5)
+        worker.conn.close()
+
+    def restart(self, worker, reason):
+        """
+            Kill the worker process tree and launch it again.
+        """
+
+        print(f"Worker {worker.index} restarted ({reason})")
+        count('owbot_worker_restarts_total', reason=reason)
+
+        worker.restarts += 1
+        self.kill(worker)
+        self.start(worker)
+
+    def over_limit(self, worker):
+        """
+            Return True if the worker and its browsers use more memory than
+            'max_rss_mb'.
+        """
+
+        rss, _, _ = tree_usage(worker.process.pid)
+        return bool(rss) and rss > self.settings['max_rss_mb'] * 1024 * 1024
+
+    def request(self, worker, job, cancel=None):
+        """
+            Send the job to the worker and return its first answer, check
+            receive().
+        """
+
+        try:
+            worker.conn.send(job)
+        except (EOFError, OSError):
+            return 'died', None
+
+        return self.receive(worker, cancel)
+
+    def receive(self, worker, cancel=None):
+        """
+            Return the next (status, result) from the worker, ('timeout', None)
+            after 'job_timeout' seconds or ('died', None) if it's gone. The
+            'cancel' event, when set meanwhile, is passed on to the worker.
+        """
+
+        deadline = time.time() + self.settings['job_timeout']
+
+        try:
+            while True:
+                if cancel and cancel.is_set():
+                    worker.cancel.set()
+                left = deadline - time.time()
+                if left <= 0:
+                    return 'timeout', None
+                if worker.conn.poll(min(left, 0.5) if cancel else left):
+                    return worker.conn.recv()
+        except (EOFError, OSError):
+            return 'died', None
+
+    def finish(self, worker, status, function, args):
+        """
+            Count the job that ended with 'status' on the worker, restarting it
+            if the job timed out, the worker died or went over the memory
+            limit.
+        """
+
+        worker.busy = 0
+        worker.jobs += 1
+
+        if status == 'timeout':
+            worker.timeouts += 1
+            print(f"Worker {worker.index} timed out after "
+                  f"{self.settings['job_timeout']}s on {function}{args[:1]}")
+        if status in ('timeout', 'died'):
+            self.restart(worker, status)
+        elif self.over_limit(worker):
+            self.restart(worker, 'rss')
+
+    def run(self, module, function, *args, cancel=None):
+        """
+            Return the result of module.function(*args) run on the next idle
+            worker. False if it didn't finish after 'job_timeout' seconds or
+            the worker died, the worker is restarted. Exceptions on the worker
+            are raised as WorkerError. If the 'cancel' event is set, the job
+            gets it from job_cancel().
+        """
+
+        worker = self.idle.get()
+
+        try:
+            with worker.lock:
+                worker.busy = time.time()
+                worker.cancel.clear()
+                status, result = self.request(
+                    worker, (module, function, args, False), cancel)
+                self.finish(worker, status, function, args)
+        finally:
+            self.idle.put(worker)
+
+        if status in ('timeout', 'died'):
+            return False
+
+        if status == 'error':
+            raise WorkerError(result)
+
+        return result
+
+    def stream(self, module, function, *args, cancel=None):
+        """
+            Yield each item of the generator module.function(*args) run on the
+            next idle worker, as soon as the worker sends it, until it ends or
+            an item takes more than 'job_timeout' seconds. Closing this
+            generator, or setting the 'cancel' event, stops the job on the
+            worker. Exceptions on the worker are raised as WorkerError.
+        """
+
+        worker = self.idle.get()
+        status, result = 'died', None
+
+        try:
+            with worker.lock:
+                worker.busy = time.time()
+                worker.cancel.clear()
+                try:
+                    status, result = self.request(
+                        worker, (module, function, args, True), cancel)
+                    while status == 'item':
+                        yield result
+                        status, result = self.receive(worker, cancel)
+                finally:
+                    if status == 'item':  # Closed while the job goes on
+                        worker.cancel.set()
+                    while status == 'item':
+                        status, result = self.receive(worker)
+                    self.finish(worker, status, function, args)
+        finally:
+            self.idle.put(worker)
+
+        if status == 'error':
+            raise WorkerError(result)
+
+    def watch(self):
+        """
+            Watchdog loop, restarts the idle workers that died or went over the
+            memory limit, kills the orphaned browsers and updates the usage
+            gauges of each worker.
+        """
+
+        while self.running:
+            time.sleep(self.settings['watchdog'])
+
+            for worker in self.workers:
+                if not worker.lock.acquire(blocking=False):  # Running a job
+                    continue
+                try:
+                    if not self.running:
+                        break
+                    if not worker.process.is_alive():
+                        self.restart(worker, 'died')
+                    elif self.over_limit(worker):
+                        self.restart(worker, 'rss')
+                finally:
+                    worker.lock.release()
+
+            killed = kill_orphans([w.process.pid for w in self.workers])
+            if killed:
+                print(f"Orphaned browser processes killed: {killed}")
+                count('owbot_orphans_killed_total', killed)
+
+            for usage in self.stats():
+                if usage['rss_mb'] is not None:
+                    gauge('owbot_worker_rss_bytes',
+                          usage['rss_mb'] * 1024 * 1024,
+                          worker=usage['worker'])
+                    gauge('owbot_worker_processes',
+                          usage['processes'],
+                          worker=usage['worker'])
+
+    def stats(self):
+        """
+            Return the usage of each worker, pid, jobs, timeouts and restarts
+            counts, plus memory MB, CPU seconds and processes of the worker
+            with its browsers (None without psutil nor /proc).
+        """
+
+        stats = []
+        for worker in self.workers:
+            rss, cpu, processes = tree_usage(worker.process.pid)
+            stats.append({
+                'worker': worker.index,
+                'pid': worker.process.pid,
+                'jobs': worker.jobs,
+                'timeouts': worker.timeouts,
+                'restarts': worker.restarts,
+                'busy': round(time.time() - worker.busy) if worker.busy else 0,
+                'rss_mb': round(rss / 1024 / 1024) if rss is not None else None,
+                'cpu_s': round(cpu, 1) if cpu is not None else None,
+                'processes': processes
+            })
+
+        return stats
+
+    def stop(self):
+        """
+            Stop every worker, after its 'cleanup' job, killing the ones that
+            don't exit.
+        """
+
+        self.running = False
+
+        for worker in self.workers:
+            with worker.lock:
+                try:
+                    worker.conn.send(None)
+                except (EOFError, OSError):
+                    pass
+                worker.process.join(30)
+                self.kill(worker)
+
+
+def supervisor(settings=None, cleanup=None, warmup=None):
+    """
+        Return the supervisor of this process, started the first time.
+    """
+
+    global SUPERVISOR
+
+    with SUPERVISORLOCK:
+        if SUPERVISOR is None:
+            SUPERVISOR = Supervisor(settings, cleanup, warmup)
+        return SUPERVISOR
+
+
+def shutdown():
+    """
+        Stop the workers, if they were started.
+    """
+
+    global SUPERVISOR
+
+    with SUPERVISORLOCK:
+        if SUPERVISOR is not None:
+            SUPERVISOR.stop()
+            SUPERVISOR = None
+
+
+def worker_stats():
+    """
+        Return the usage of each worker, empty if they weren't started.
+    """
+
+    with SUPERVISORLOCK:
+        return SUPERVISOR.stats() if SUPERVISOR else []
@@ -0,0 +1,304 @@
+"""
+    Change detection between consecutive directory snapshots, each scrape is
+    saved as the streams that started, ended or changed (title, rank, viewers,
+    image) since the previous one, with a full keyframe on each new day and
+    every KEYFRAME deltas, on data/YYYYMMDD/directory.<target>.jsonl
+
+    python snapshotdiff.py overwatch-en
+    python snapshotdiff.py overwatch-en --at "2018-06-03 14:00"
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+
+HOME = os.path.normpath(  # The script directory + cxfreeze compatibility
+    os.path.dirname(
+        sys.executable if getattr(sys, 'frozen', False) else __file__))
+
+DATAPATH = os.path.join(HOME, "data")
+
+KEYFRAME = 24  # Deltas between full snapshots
+
+IGNORED = ['user', 'time']  # Fields not compared, 'time' is the record time
+
+
+def index(directory):
+    """
+        Return the streams of a directory snapshot as {user: entry}, the entry
+        with its 'rank' on the page and without 'time'. Streams without user
+        are skipped and only the first of a repeated user is kept.
+    """
+
+    streams = {}
+    for rank, entry in enumerate(directory, 1):
+        user = entry.get('user')
+        if user and user not in streams:
+            streams[user] = {k: v for k, v in entry.items() if k != 'time'}
+            streams[user]['rank'] = rank
+
+    return streams
+
+
+def diff(previous, current):
+    """
+        Return the delta between two indexed snapshots (index()), a dictionary
+        with the 'started' entries, the 'ended' users and the fields 'changed'
+        per user, e.g. {'xqcow': {'status': 'New title', 'rank': 2}}.
+    """
+
+    started = [current[u] for u in current if u not in previous]
+    ended = [u for u in previous if u not in current]
+
+    changed = {}
+    for user, entry in current.items():
+        old = previous.get(user)
+        if old is None:
+            continue
+        fields = {
+            k: v
+            for k, v in entry.items()
+            if k not in IGNORED and old.get(k) != v
+        }
+        fields.update({k: None for k in old if k not in entry})
+        if fields:
+            changed[user] = fields
+
+    return {'started': started, 'ended': ended, 'changed': changed}
+
+
+def apply(streams, delta):
+    """
+        Return the indexed snapshot that results from applying the delta to
+        the previous one.
+    """
+
+    ended = set(delta['ended'])
+    streams = {u: dict(e) for u, e in streams.items() if u not in ended}
+
+    for entry in delta['started']:
+        streams[entry['user']] = dict(entry)
+
+    for user, fields in delta['changed'].items():
+        entry = streams[user]
+        for k, v in fields.items():
+            if v is None:
+                entry.pop(k, None)
+            else:
+                entry[k] = v
+
+    return streams
+
+
+def rebuild(streams, when):
+    """
+        Return the indexed snapshot as a get_directory_data list, in rank order
+        and with the record time on each stream.
+    """
+
+    directory = []
+    for entry in sorted(streams.values(), key=lambda e: e['rank']):
+        entry = {k: v for k, v in entry.items() if k != 'rank'}
+        entry['time'] = when
+        directory.append(entry)
+
+    return directory
+
+
+def changes(delta):
+    """
+        Return the count of each kind of change on the delta, e.g.
+        {'started': 3, 'ended': 2, 'title': 1, 'rank': 12, 'viewers': 40}.
+    """
+
+    counts = {
+        'started': len(delta['started']),
+        'ended': len(delta['ended']),
+        'title': 0,
+        'rank': 0,
+        'viewers': 0
+    }
+    for fields in delta['changed'].values():
+        counts['title'] += 'status' in fields
+        counts['rank'] += 'rank' in fields
+        counts['viewers'] += 'viewers' in fields
+
+    return counts
+
+
+def iter_snapshots(records):
+    """
+        Yield (time, streams) for each record of a delta log, each one indexed
+        (index()). Deltas before the first keyframe are skipped.
+    """
+
+    streams = None
+    for record in records:
+        if 'keyframe' in record:
+            streams = index(record['keyframe'])
+        elif streams is not None:
+            streams = apply(streams, record)
+        else:
+            continue
+        yield record['time'], streams
+
+
+def log_path(datapath, target, when):
+    """
+        Return the path of the delta log of the target on the day of 'when'.
+    """
+
+    day = datetime.date.fromtimestamp(when).strftime("%Y%m%d")
+    return os.path.join(datapath, day, f"directory.{target}.jsonl")
+
+
+def read_log(path):
+    """
+        Return the records of a delta log, from its day archive if the day was
+        already rolled by maintenance.py. Empty if there isn't one.
+    """
+
+    try:
+        with open(path, 'r') as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        pass
+    except (IOError, ValueError):
+        print(f"Ignored: {path}")
+        return []
+
+    from maintenance import read_archived
+
+    daypath, name = os.path.split(path)
+    datapath, day = os.path.split(daypath)
+    return read_archived(datapath, day, name) or []
+
+
+def reconstruct(target, when=None, datapath=DATAPATH):
+    """
+        Return the directory snapshot of the target as it was at 'when' (the
+        last one scrapped before), rebuilt from the keyframe and deltas of that
+        day. None if there isn't one that day.
+    """
+
+    when = time.time() if when is None else when
+
+    found = None
+    for moment, streams in iter_snapshots(
+            read_log(log_path(datapath, target, when))):
+        if moment > when:
+            break
+        found = (moment, streams)
+
+    return rebuild(found[1], found[0]) if found else None
+
+
+class SnapshotLog:
+    """
+        Delta logs of the directory snapshots, one per target and day, keeping
+        the last snapshot of each target to diff against the next one.
+    """
+
+    def __init__(self, datapath=DATAPATH, keyframe=KEYFRAME):
+        """
+            A keyframe is saved after 'keyframe' deltas.
+        """
+
+        self.datapath = datapath
+        self.keyframe = keyframe
+        self.lock = threading.Lock()
+        self.last = {}  # {target: (path, streams, deltas since keyframe)}
+
+    def resume(self, path):
+        """
+            Return the (streams, deltas since keyframe) at the end of an
+            existing log, to keep diffing after a restart. (None, 0) if empty.
+        """
+
+        streams, deltas = None, 0
+        for record in read_log(path):
+            if 'keyframe' in record:
+                streams, deltas = index(record['keyframe']), 0
+            elif streams is not None:
+                streams, deltas = apply(streams, record), deltas + 1
+
+        return streams, deltas
+
+    def write(self, target, directory, when=None):
+        """
+            Append the directory snapshot of the target to its log, as a delta
+            against the previous one or as a keyframe. Return the delta, None
+            when a keyframe was saved.
+        """
+
+        when = time.time() if when is None else when
+        path = log_path(self.datapath, target, when)
+        current = index(directory)
+
+        with self.lock:
+            last = self.last.get(target)
+            if last is None or last[0] != path:
+                last = (path, *self.resume(path))
+
+            _, previous, deltas = last
+            if previous is None or deltas >= self.keyframe:
+                delta = None
+                record = {'time': when, 'keyframe': directory}
+                deltas = 0
+            else:
+                delta = diff(previous, current)
+                record = dict(delta, time=when)
+                deltas += 1
+
+            folder = os.path.dirname(path)
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            with open(path, 'a') as f:
+                f.write(json.dumps(record) + "\n")
+
+            self.last[target] = (path, current, deltas)
+
+        return delta
+
+
+if __name__ == "__main__":
+
+    PARSER = argparse.ArgumentParser(
+        description="Rebuild a past directory snapshot from the delta logs")
+    PARSER.add_argument("target", help="target name, e.g. overwatch-en")
+    PARSER.add_argument(
+        "--at",
+        help="'YYYY-MM-DD HH:MM' local time, now default",
+        type=str)
+    PARSER.add_argument(
+        "--deltas",
+        help="show the changes of each record that day instead",
+        action='store_true')
+    ARGS = PARSER.parse_args()
+
+    WHEN = time.time()
+    if ARGS.at:
+        WHEN = datetime.datetime.strptime(ARGS.at, "%Y-%m-%d %H:%M").timestamp()
+
+    if ARGS.deltas:
+        RECORDS = read_log(log_path(DATAPATH, ARGS.target, WHEN))
+        for RECORD in RECORDS:
+            MOMENT = datetime.datetime.fromtimestamp(RECORD['time'])
+            KIND = (f"keyframe {len(RECORD['keyframe'])} streams"
+                    if 'keyframe' in RECORD else changes(RECORD))
+            print(f"{MOMENT:%H:%M:%S} {KIND}")
+        sys.exit()
+
+    DIRECTORY = reconstruct(ARGS.target, WHEN)
+    if DIRECTORY is None:
+        print(f"No snapshots of '{ARGS.target}' that day before "
+              f"{datetime.datetime.fromtimestamp(WHEN):%Y-%m-%d %H:%M}")
+        sys.exit(1)
+
+    for RANK, ENTRY in enumerate(DIRECTORY, 1):
+        print(f"{RANK:>4} {ENTRY['user']:<24} {ENTRY.get('viewers', -1):>8} "
+              f"{ENTRY.get('status') or ''}")
@@ -0,0 +1,321 @@
+"""
+    Crash safe state for owbot, the promoted registry and the tweets queue on
+    SQLite (WAL mode) plus atomic json writes, the queue is handled by
+    qbotqueue.py
+
+    python statestore.py
+"""
+
+import json
+import os
+import sqlite3
+import time
+
+SCHEMA_VERSION = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS promoted (
+    target TEXT NOT NULL,
+    user TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    max_viewers INTEGER NOT NULL DEFAULT 0,
+    min_viewers INTEGER NOT NULL DEFAULT 0,
+    mean_viewers INTEGER NOT NULL DEFAULT 0,
+    found REAL NOT NULL,
+    last_promo REAL NOT NULL DEFAULT 0,
+    seen REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (target, user)
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    target TEXT NOT NULL DEFAULT '',
+    text TEXT NOT NULL,
+    image TEXT,
+    queued REAL NOT NULL,
+    exported INTEGER NOT NULL DEFAULT 0,
+    user TEXT
+);
+"""
+
+# Created after the upgrades, older tables don't have their columns
+INDEXES = """
+CREATE INDEX IF NOT EXISTS messages_state ON messages (target, exported);
+"""
+
+# Version 1 had one registry, without targets
+UPGRADE_V2 = """
+ALTER TABLE promoted RENAME TO promoted_v1;
+CREATE TABLE promoted (
+    target TEXT NOT NULL,
+    user TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    max_viewers INTEGER NOT NULL DEFAULT 0,
+    min_viewers INTEGER NOT NULL DEFAULT 0,
+    mean_viewers INTEGER NOT NULL DEFAULT 0,
+    found REAL NOT NULL,
+    last_promo REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (target, user)
+);
+INSERT INTO promoted SELECT :target, user, count, max_viewers, min_viewers,
+    mean_viewers, found, last_promo FROM promoted_v1;
+DROP TABLE promoted_v1;
+ALTER TABLE messages ADD COLUMN target TEXT NOT NULL DEFAULT '';
+UPDATE messages SET target = :target;
+"""
+
+# Version 2 messages didn't have the streamer, used to collapse repeated ones
+UPGRADE_V3 = """
+ALTER TABLE messages ADD COLUMN user TEXT;
+"""
+
+# Version 3 didn't know when a user was last seen, to forget the ones never
+# promoted
+UPGRADE_V4 = """
+ALTER TABLE promoted ADD COLUMN seen REAL NOT NULL DEFAULT 0;
+"""
+
+UPGRADES = {1: UPGRADE_V2, 2: UPGRADE_V3, 3: UPGRADE_V4}
+
+PROMOTED_FIELDS = [
+    'count', 'max_viewers', 'min_viewers', 'mean_viewers', 'found',
+    'last_promo'
+]
+
+
+def atomic_json_dump(data, path):
+    """
+        Write the data as json on the path without leaving a half written file
+        if the process dies, the old file is replaced only when the new one is
+        complete on disk.
+    """
+
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp, path)
+
+
+def load_json(path, default):
+    """
+        Return the json data from the path, or 'default' if the file doesn't
+        exist. A corrupted file is kept as '<path>.corrupt.<timestamp>' instead
+        of being overwritten, only for owbot files, check qbotqueue.load_qbot()
+        for the Qbot ones.
+    """
+
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except IOError:
+        return default
+    except ValueError:
+        corrupt = f"{path}.corrupt.{round(time.time())}"
+        os.replace(path, corrupt)
+        print(f"Corrupted '{path}', saved as '{corrupt}'")
+        return default
+
+
+def open_state(path):
+    """
+        Return the SQLite connection to the state database on the path, created
+        if it doesn't exist.
+    """
+
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")  # WAL is still crash safe
+    db.executescript(SCHEMA)
+
+    return db
+
+
+def schema_version(db):
+    """
+        Return the schema version of the database, 0 if it was just created.
+    """
+
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate_json(db, config, qbot, target):
+    """
+        Bring the database to the current schema. Databases just created import
+        the 'promoted' registry from the owbot config and the messages from the
+        Qbot json, older versions are upgraded. Both belong to 'target', the
+        only one before targets existed. The INDEXES are created last. Return
+        True if the json import happened.
+    """
+
+    version = schema_version(db)
+    if version >= SCHEMA_VERSION:
+        db.executescript(INDEXES)
+        return False
+
+    if version >= 1:
+        with db:
+            for step in range(version, SCHEMA_VERSION):
+                for statement in UPGRADES[step].split(";"):
+                    if statement.strip():
+                        db.execute(statement, {'target': target})
+            db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        db.executescript(INDEXES)
+        return False
+
+    with db:
+        for user, record in config.get('promoted', {}).items():
+            db.execute(
+                "INSERT OR IGNORE INTO promoted (target, user, count, "
+                "max_viewers, min_viewers, mean_viewers, found, last_promo) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [target, user] + [record.get(k, 0) for k in PROMOTED_FIELDS])
+
+        for message in qbot.get('messages', []):  # Already on the Qbot json
+            db.execute(
+                "INSERT INTO messages (target, text, image, queued, exported) "
+                "VALUES (?, ?, ?, ?, 1)",
+                (target, message['text'], message.get('image'), time.time()))
+
+        db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    db.executescript(INDEXES)
+
+    return True
+
+
+# Promoted registry, one per target
+
+
+def register_seen(db, target, users, found=None):
+    """
+        Add the users not registered yet on the target and update when all of
+        them were last seen, in one transaction.
+    """
+
+    found = found if found else time.time()
+    with db:
+        db.executemany(
+            "INSERT INTO promoted (target, user, found, seen) "
+            "VALUES (?, ?, ?, ?) ON CONFLICT (target, user) "
+            "DO UPDATE SET seen = excluded.seen",
+            [(target, user, found, found) for user in users])
+
+
+def forget_unseen(db, target, before):
+    """
+        Delete the registry records of the users on the target never promoted
+        and not seen since 'before'. Return how many.
+    """
+
+    with db:
+        cursor = db.execute(
+            "DELETE FROM promoted WHERE target = ? AND count = 0 AND "
+            "MAX(seen, found) < ?", (target, before))
+
+    return cursor.rowcount
+
+
+def get_promoted(db, target, user):
+    """
+        Return the registry record of the user on the target as a dictionary,
+        False if the user isn't registered.
+    """
+
+    row = db.execute(
+        "SELECT * FROM promoted WHERE target = ? AND user = ?",
+        (target, user)).fetchone()
+
+    return {k: row[k] for k in PROMOTED_FIELDS} if row else False
+
+
+def update_promoted(db, target, user, **fields):
+    """
+        Update only the given fields of the user registry record on the target.
+    """
+
+    fields = {k: v for k, v in fields.items() if k in PROMOTED_FIELDS}
+    sets = ", ".join([f"{k} = ?" for k in fields])
+
+    with db:
+        db.execute(
+            f"UPDATE promoted SET {sets} WHERE target = ? AND user = ?",
+            list(fields.values()) + [target, user])
+
+
+if __name__ == "__main__":
+
+    import argparse
+    import sys
+    import tempfile
+
+    PARSER = argparse.ArgumentParser(
+        description="Check that older owbot.db versions open and upgrade")
+    PARSER.parse_args()
+
+    # The schema of the first owbot.db, version 1
+    SCHEMA_V1 = """
+    CREATE TABLE promoted (
+        user TEXT PRIMARY KEY,
+        count INTEGER NOT NULL DEFAULT 0,
+        max_viewers INTEGER NOT NULL DEFAULT 0,
+        min_viewers INTEGER NOT NULL DEFAULT 0,
+        mean_viewers INTEGER NOT NULL DEFAULT 0,
+        found REAL NOT NULL,
+        last_promo REAL NOT NULL DEFAULT 0
+    );
+    CREATE TABLE messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        text TEXT NOT NULL,
+        image TEXT,
+        queued REAL NOT NULL,
+        exported INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT INTO promoted VALUES ('xqcow', 2, 30000, 20000, 25000, 1, 2);
+    INSERT INTO messages (text, queued) VALUES ('Tweet', 1);
+    PRAGMA user_version = 1;
+    """
+
+    FAILED = False
+    FOLDER = tempfile.mkdtemp(prefix="owbot-state-")
+
+    for VERSION in range(1, SCHEMA_VERSION):
+        PATH = os.path.join(FOLDER, f"owbot.v{VERSION}.db")
+
+        OLD = sqlite3.connect(PATH)
+        OLD.executescript(SCHEMA_V1)
+        for STEP in range(1, VERSION):
+            OLD.executescript(UPGRADES[STEP].replace(":target", "'overwatch'"))
+            OLD.execute(f"PRAGMA user_version = {STEP + 1}")
+        OLD.commit()
+        OLD.close()
+
+        try:
+            DB = open_state(PATH)
+            migrate_json(DB, {}, {}, 'overwatch')
+            RECORD = get_promoted(DB, 'overwatch', 'xqcow')
+            MESSAGES = DB.execute(
+                "SELECT COUNT(*) FROM messages WHERE target = ?",
+                ('overwatch', )).fetchone()[0]
+            INDEXED = DB.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND "
+                "name = 'messages_state'").fetchone()[0]
+            OK = (schema_version(DB) == SCHEMA_VERSION and RECORD and
+                  RECORD['count'] == 2 and MESSAGES == 1 and INDEXED == 1)
+            DB.close()
+        except sqlite3.Error as e:
+            OK = False
+            print(f"  {type(e).__name__}: {e}")
+
+        FAILED = FAILED or not OK
+        print(f"Version {VERSION} to {SCHEMA_VERSION}: "
+              f"{'ok' if OK else 'FAILED'}")
+
+    for FILE in os.listdir(FOLDER):
+        os.remove(os.path.join(FOLDER, FILE))
+    os.rmdir(FOLDER)
+
+    sys.exit(1 if FAILED else 0)
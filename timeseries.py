@@ -0,0 +1,309 @@
+"""
+    Indexed time series of the directory and user snapshots on SQLite, keyed by
+    (user, time), with a backfill from the daily json dumps on data/
+
+    python timeseries.py backfill
+    python timeseries.py history xqcow --days 30
+    python timeseries.py top --days 7 -n 10 --by viewers
+"""
+
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from snapshotdiff import iter_snapshots, rebuild
+
+HOME = os.path.normpath(  # The script directory + cxfreeze compatibility
+    os.path.dirname(
+        sys.executable if getattr(sys, 'frozen', False) else __file__))
+
+DATAPATH = os.path.join(HOME, "data")
+
+SNAPSHOTSDB = os.path.join(DATAPATH, "snapshots.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directory (
+    user TEXT NOT NULL,
+    time REAL NOT NULL,
+    rank INTEGER NOT NULL,
+    status TEXT,
+    image TEXT,
+    viewers INTEGER,
+    PRIMARY KEY (user, time)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS directory_time ON directory (time);
+
+CREATE TABLE IF NOT EXISTS users (
+    user TEXT NOT NULL,
+    time REAL NOT NULL,
+    status TEXT,
+    viewers INTEGER,
+    total_views INTEGER,
+    followers INTEGER,
+    following INTEGER,
+    videos_count INTEGER,
+    social TEXT,
+    PRIMARY KEY (user, time)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS users_time ON users (time);
+"""
+
+USER_COLUMNS = [
+    'status', 'viewers', 'total_views', 'followers', 'following',
+    'videos_count'
+]
+
+SOCIAL = ['twitter', 'instagram', 'facebook', 'youtube', 'discord', 'tags']
+
+
+def open_snapshots(path=SNAPSHOTSDB):
+    """
+        Return the SQLite connection to the snapshots database on the path,
+        created if it doesn't exist.
+    """
+
+    folder = os.path.dirname(path)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+
+    columns = [
+        row['name'] for row in db.execute("PRAGMA table_info(directory)")
+    ]
+    if 'viewers' not in columns:  # Before the directory had viewers
+        db.execute("ALTER TABLE directory ADD COLUMN viewers INTEGER")
+
+    return db
+
+
+def ingest_directory(db, directory, commit=True):
+    """
+        Save a get_directory_data snapshot, each stream with its rank on the
+        page. Snapshots already saved are ignored.
+    """
+
+    rows = [(entry['user'], entry['time'], rank, entry['status'],
+             entry['image'], entry.get('viewers'))
+            for rank, entry in enumerate(directory, 1) if entry.get('user')]
+
+    db.executemany(
+        "INSERT OR IGNORE INTO directory (user, time, rank, status, image, "
+        "viewers) VALUES (?, ?, ?, ?, ?, ?)", rows)
+    if commit:
+        db.commit()
+
+
+def ingest_user(db, userdata, commit=True):
+    """
+        Save a get_user_data snapshot, the social handlers and tags as json.
+        Snapshots already saved are ignored.
+    """
+
+    social = {k: userdata.get(k, []) for k in SOCIAL}
+
+    db.execute(
+        "INSERT OR IGNORE INTO users (user, time, status, viewers, "
+        "total_views, followers, following, videos_count, social) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [userdata['user'], userdata['time']] +
+        [userdata.get(k) for k in USER_COLUMNS] + [json.dumps(social)])
+    if commit:
+        db.commit()
+
+
+def user_history(db, user, start=0, end=None):
+    """
+        Return the list of user snapshots between the 'start' and 'end'
+        timestamps, oldest first.
+    """
+
+    end = end if end else time.time()
+
+    rows = db.execute(
+        "SELECT * FROM users WHERE user = ? AND time BETWEEN ? AND ? "
+        "ORDER BY time", (user, start, end))
+
+    history = []
+    for row in rows:
+        snapshot = {k: row[k] for k in ['user', 'time'] + USER_COLUMNS}
+        snapshot.update(json.loads(row['social']))
+        history.append(snapshot)
+
+    return history
+
+
+def latest_users(db, users):
+    """
+        Return a dictionary with the last snapshot of each user that has one,
+        {user: snapshot} like user_history.
+    """
+
+    latest = {}
+    for user in set(users):
+        row = db.execute(
+            "SELECT * FROM users WHERE user = ? ORDER BY time DESC LIMIT 1",
+            (user, )).fetchone()
+        if row:
+            latest[user] = {k: row[k] for k in ['user', 'time'] + USER_COLUMNS}
+            latest[user].update(json.loads(row['social']))
+
+    return latest
+
+
+def rank_history(db, user, start=0, end=None):
+    """
+        Return the list of (time, rank, viewers) of the user on the directory
+        snapshots between the 'start' and 'end' timestamps, oldest first.
+    """
+
+    end = end if end else time.time()
+
+    return [(row['time'], row['rank'], row['viewers']) for row in db.execute(
+        "SELECT time, rank, viewers FROM directory WHERE user = ? AND time "
+        "BETWEEN ? AND ? ORDER BY time", (user, start, end))]
+
+
+def top_users(db, start=0, end=None, n=10, by='viewers'):
+    """
+        Return the top 'n' users between the 'start' and 'end' timestamps as a
+        list of (user, value, snapshots):
+
+        by='viewers' highest viewers on the user snapshots
+        by='rank' best mean rank on the directory snapshots
+    """
+
+    end = end if end else time.time()
+
+    if by == 'rank':
+        query = ("SELECT user, AVG(rank) AS value, COUNT(*) AS count "
+                 "FROM directory WHERE time BETWEEN ? AND ? "
+                 "GROUP BY user ORDER BY value ASC, count DESC LIMIT ?")
+    else:
+        query = ("SELECT user, MAX(viewers) AS value, COUNT(*) AS count "
+                 "FROM users WHERE time BETWEEN ? AND ? "
+                 "GROUP BY user ORDER BY value DESC LIMIT ?")
+
+    return [(row['user'], row['value'], row['count'])
+            for row in db.execute(query, (start, end, n))]
+
+
+def day_dumps(day):
+    """
+        Yield (name, data) for each json dump and delta log of the day folder,
+        or of its archive when the day was rolled by maintenance.py.
+    """
+
+    if day.endswith('.jsonl.gz'):
+        from maintenance import iter_archive
+        yield from iter_archive(day)
+        return
+
+    dumps = glob.glob(os.path.join(day, "*.json"))
+    dumps += glob.glob(os.path.join(day, "*.jsonl"))
+
+    for dump in sorted(dumps):
+        try:
+            with open(dump, 'r') as f:
+                if dump.endswith('.jsonl'):
+                    data = [json.loads(line) for line in f if line.strip()]
+                else:
+                    data = json.load(f)
+        except (IOError, ValueError):
+            print(f"Ignored: {dump}")
+            continue
+
+        yield os.path.basename(dump), data
+
+
+def backfill(db, datapath=DATAPATH):
+    """
+        Ingest the json dumps from the daily folders and archives, one file at a
+        time and one transaction per day. Return the count of files ingested.
+    """
+
+    count = 0
+
+    days = glob.glob(os.path.join(datapath, "[0-9]" * 8))
+    days += glob.glob(os.path.join(datapath, "[0-9]" * 8 + ".jsonl.gz"))
+
+    for day in sorted(days):
+
+        for name, data in day_dumps(day):
+            if name.startswith('trace.'):
+                continue
+            if name.startswith('directory.') and name.endswith('.jsonl'):
+                for moment, streams in iter_snapshots(data):
+                    ingest_directory(db, rebuild(streams, moment), commit=False)
+            elif name.startswith('directory.'):
+                ingest_directory(db, data or [], commit=False)
+            elif data:
+                ingest_user(db, data, commit=False)
+            count += 1
+
+        db.commit()
+        print(f"Ingested: {day}")
+
+    return count
+
+
+if __name__ == "__main__":
+
+    # Command line args
+
+    PARSER = argparse.ArgumentParser(
+        description="Time series of the owbot directory and user snapshots")
+    COMMANDS = PARSER.add_subparsers(dest="command")
+
+    COMMANDS.add_parser(
+        "backfill", help="ingest the json dumps from the data folder")
+
+    HISTORY = COMMANDS.add_parser("history", help="snapshots of a user")
+    HISTORY.add_argument("user", type=str)
+    HISTORY.add_argument(
+        "--days", help="days back, 30 default", default=30, type=float)
+
+    TOP = COMMANDS.add_parser("top", help="top users on a time window")
+    TOP.add_argument(
+        "--days", help="days back, 7 default", default=7, type=float)
+    TOP.add_argument("-n", help="users, 10 default", default=10, type=int)
+    TOP.add_argument(
+        "--by",
+        help="'viewers' (max) or 'rank' (mean), 'viewers' default",
+        choices=['viewers', 'rank'],
+        default='viewers')
+
+    ARGS = PARSER.parse_args()
+
+    DB = open_snapshots()
+
+    if ARGS.command == "backfill":
+        DELTA = time.time()
+        COUNT = backfill(DB)
+        print(f"\nDone! {COUNT} files ({round(time.time() - DELTA)}s)")
+
+    elif ARGS.command == "history":
+        START = time.time() - ARGS.days * 86400
+        for snapshot in user_history(DB, ARGS.user.lower(), START):
+            when = time.strftime("%Y/%m/%d %H:%M",
+                                 time.localtime(snapshot['time']))
+            print(f"{when}  {snapshot['viewers']:>8} viewers  "
+                  f"{snapshot['followers']:>9} followers")
+
+    elif ARGS.command == "top":
+        START = time.time() - ARGS.days * 86400
+        for user, value, count in top_users(DB, START, n=ARGS.n, by=ARGS.by):
+            print(f"{user:<30} {value:>10.0f} {ARGS.by} ({count} snapshots)")
+
+    else:
+        PARSER.print_usage()
@@ -0,0 +1,264 @@
+"""
+    Twitch.tv data from the GraphQL API the web app loads, the same data as the
+    twitchscrapper Selenium pages without rendering them
+
+    Enable it with "source": "gql" on the 'config' of config-twitchscrapper.json
+"""
+
+import http.client
+import json
+import time
+from urllib.parse import unquote, urlparse
+
+from imagecache import connection, drop_connection
+from metrics import count
+from twitchscrapper import (CONFIG, get_social_handlers,
+                            increase_image_resolution, record_phase)
+
+GQL = {
+    'url': 'https://gql.twitch.tv/gql',
+    'client_id': 'kimne78kx3ncx6brgo4mv6wki5h1ko',  # The web app public id
+    'first': 30  # Streams per directory, like the first page load
+}
+
+DIRECTORY_QUERY = """
+query Directory($name: String!, $first: Int!, $after: Cursor,
+                $languages: [Language!]) {
+  game(name: $name) {
+    streams(first: $first, after: $after,
+            options: {sort: VIEWER_COUNT, broadcasterLanguages: $languages}) {
+      pageInfo { hasNextPage }
+      edges {
+        cursor
+        node {
+          title
+          viewersCount
+          previewImageURL(width: 320, height: 180)
+          broadcaster { login }
+        }
+      }
+    }
+  }
+}
+"""
+
+USER_QUERY = """
+query User($login: String!) {
+  user(login: $login) {
+    login
+    profileViewCount
+    followers { totalCount }
+    follows { totalCount }
+    videos { totalCount }
+    channel { socialMedias { name url } }
+    broadcastSettings { title }
+    stream {
+      title
+      viewersCount
+      freeformTags { name }
+    }
+  }
+}
+"""
+
+
+def gql_settings():
+    """
+        Return the GQL defaults updated with the 'gql' config.
+    """
+
+    return dict(GQL, **CONFIG.get('gql', {}))
+
+
+def gql_request(query, variables):
+    """
+        Return the 'data' of the GraphQL query answer, False if the request
+        failed or the answer has errors.
+    """
+
+    settings = gql_settings()
+    parsed = urlparse(settings['url'])
+
+    body = json.dumps({'query': query, 'variables': variables})
+    headers = {
+        'Client-ID': settings['client_id'],
+        'Content-Type': 'application/json',
+        'Connection': 'keep-alive'
+    }
+
+    delta = time.time()
+    try:
+        conn = connection(parsed.scheme, parsed.netloc)
+        conn.request("POST", parsed.path or "/", body=body, headers=headers)
+        response = conn.getresponse()
+        answer = response.read()  # Always read to reuse the connection
+    except (OSError, http.client.HTTPException) as e:
+        drop_connection(parsed.scheme, parsed.netloc)
+        print(f"Error with gql_request({settings['url']}):\n{e}".strip())
+        return False
+    finally:
+        record_phase('gql', time.time() - delta)
+
+    if response.status != 200:
+        print(f"Error {response.status} with gql_request({settings['url']})")
+        return False
+
+    try:
+        answer = json.loads(answer)
+    except ValueError:
+        print(f"Invalid json from gql_request({settings['url']})")
+        return False
+
+    if answer.get('errors'):
+        print(f"Errors from gql_request:\n{answer['errors']}")
+        return False
+
+    return answer.get('data') or False
+
+
+def directory_variables(url, language):
+    """
+        Return the 'Directory' query variables for the directory url.
+    """
+
+    game = unquote(urlparse(url).path.rstrip('/').split('/')[-1])
+
+    variables = {'name': game, 'first': gql_settings()['first']}
+    if language:
+        variables['languages'] = [language.upper()]
+
+    return variables
+
+
+def directory_data(url, language="en", increase_image=0):
+    """
+        Return a dictionary with the data for each stream in a Twitch.tv game
+        directory like https://www.twitch.tv/directory/game/Overwatch, the
+        same as twitchscrapper.get_directory_data.
+    """
+
+    data = gql_request(DIRECTORY_QUERY, directory_variables(url, language))
+    if not data or not data.get('game'):
+        print(f"Error with directory_data({url})")
+        count('owbot_pages_total', page='directory', result='error')
+        return False
+
+    count('owbot_pages_total', page='directory', result='ok')
+
+    return parse_directory_json(data, increase_image)
+
+
+def directory_pages(url, language="en", increase_image=0, cancel=None):
+    """
+        Yield the list of streams of each page of the Twitch.tv directory,
+        following the cursors until the last page or 'cancel' is set. The same
+        as twitchscrapper.selenium_directory_pages.
+    """
+
+    variables = directory_variables(url, language)
+
+    while not (cancel and cancel.is_set()):
+        data = gql_request(DIRECTORY_QUERY, variables)
+        if not data or not data.get('game'):
+            print(f"Error with directory_pages({url})")
+            return
+
+        yield parse_directory_json(data, increase_image)
+
+        streams = data['game']['streams']
+        if not streams['edges'] or not (streams.get('pageInfo') or
+                                        {}).get('hasNextPage'):
+            return
+
+        variables['after'] = streams['edges'][-1].get('cursor')
+
+
+def parse_directory_json(data, increase_image=0):
+    """
+        Return a dictionary with the data for each stream from the GraphQL
+        'Directory' query data.
+
+        'increase_image' will force the hardcoded image to increase that size.
+    """
+
+    streams = []
+    for edge in data['game']['streams']['edges']:
+        node = edge['node']
+
+        image = node.get('previewImageURL') or False
+        if image and increase_image:
+            image = increase_image_resolution(image, increase_image)
+
+        broadcaster = node.get('broadcaster') or {}
+
+        streams.append({
+            'user': broadcaster.get('login', False),
+            'image': image,
+            'status': node.get('title') or False,
+            'viewers': node.get('viewersCount', -1),
+            'time': time.time()
+        })
+
+    return streams
+
+
+def user_data(url, cancel=None):
+    """
+        Return a dictionary with the user data of a Twitch.tv streamer like
+        https://www.twitch.tv/chipshajen, the same as
+        twitchscrapper.get_user_data.
+    """
+
+    user = url.replace('/', ' ').strip().split(' ')[-1]
+
+    if cancel and cancel.is_set():
+        count('owbot_pages_total', page='user', result='cancelled')
+        return False
+
+    data = gql_request(USER_QUERY, {'login': user})
+    if not data or not data.get('user'):
+        print(f"Error with user_data({url})")
+        count('owbot_pages_total', page='user', result='error')
+        return False
+
+    count('owbot_pages_total', page='user', result='ok')
+
+    return parse_user_json(data, user)
+
+
+def total(field):
+    """
+        Return the 'totalCount' of the connection field, -1 if there isn't
+        one.
+    """
+
+    return field.get('totalCount', -1) if field else -1
+
+
+def parse_user_json(data, user):
+    """
+        Return a dictionary with the user data from the GraphQL 'User' query
+        data, an offline user has -1 viewers.
+    """
+
+    found = data['user']
+    stream = found.get('stream') or {}
+    channel = found.get('channel') or {}
+    settings = found.get('broadcastSettings') or {}
+
+    status = stream.get('title') or settings.get('title') or False
+    socials = [i['url'] for i in channel.get('socialMedias') or []]
+    tags = [i['name'] for i in stream.get('freeformTags') or []]
+
+    data = {'user': user, 'status': status}
+    data.update(get_social_handlers(socials))
+    data.update({
+        'viewers': stream.get('viewersCount', -1),
+        'total_views': found.get('profileViewCount', -1),
+        'followers': total(found.get('followers')),
+        'following': total(found.get('follows')),
+        'videos_count': total(found.get('videos'))
+    })
+    data.update({'tags': tags, 'time': time.time()})
+
+    return data
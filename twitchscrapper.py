@@ -10,17 +10,30 @@ import os
 import random
 import re
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 
 from bs4 import BeautifulSoup
 
+from metrics import count, gauge, merge_metrics, record, take_metrics, timed
+from scrapcache import cached
+from scrapworkers import DEFAULTS as WORKERS
+from scrapworkers import job_cancel, shutdown, supervisor
 from selenium import webdriver
-from selenium.common.exceptions import NoSuchElementException
+from selenium.common.exceptions import (NoSuchElementException,
+                                        TimeoutException, WebDriverException)
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as ec
 from selenium.webdriver.support.ui import WebDriverWait
 
+try:  # Faster BeautifulSoup parser when available
+    import lxml  # noqa
+    HTMLPARSER = 'lxml'
+except ImportError:
+    HTMLPARSER = 'html.parser'
+
 HOME = os.path.normpath(  # The script directory + cxfreeze compatibility
     os.path.dirname(
         sys.executable if getattr(sys, 'frozen', False) else __file__))
@@ -31,52 +44,517 @@ try:
     with open(CONFIGJSON, 'r') as f:
         CONFIG = json.load(f)
 except (IOError, ValueError):
-    CONFIG = {'config': {'chrome_driver_path': 'chromedriver.exe'}}
+    CONFIG = {
+        'config': {
+            'source': 'selenium',
+            'chrome_driver_path': 'chromedriver.exe',
+            'pool_size': 1,
+            'pool_max_loads': 20,
+            'max_workers': 4,
+            'wait_timeout': 10,
+            'scroll_timeout': 5,
+            'throttle': [0, 0],
+            'record_html': False,
+            'record_path': 'fixtures'
+        },
+        'cache': {
+            'ttl': 300,
+            'stale': 600,
+            'negative': 20,
+            'path': ''
+        },
+        'browser': {
+            'headless': False,
+            'load_images': True,
+            'load_media': True,
+            'block_ads': True,
+            'blocked_hosts': []
+        },
+        'gql': {
+            'url': 'https://gql.twitch.tv/gql',
+            'client_id': 'kimne78kx3ncx6brgo4mv6wki5h1ko',
+            'first': 30
+        },
+        'workers': dict(WORKERS)
+    }
     with open(CONFIGJSON, 'w') as f:
         json.dump(CONFIG, f)
 
+# Browser profile, hosts are blocked by resolving them to nothing
+
+BROWSER = {
+    'headless': False,  # Without window
+    'load_images': True,  # Images are on the html anyway as urls
+    'load_media': True,  # Video streams and autoplay
+    'block_ads': True,  # Ad and analytics hosts
+    'blocked_hosts': []  # Extra hosts, wildcards allowed like *.example.com
+}
+
+AD_HOSTS = [
+    "*.doubleclick.net", "*.googlesyndication.com", "*.googletagservices.com",
+    "*.google-analytics.com", "*.amazon-adsystem.com", "*.scorecardresearch.com",
+    "*.imasdk.googleapis.com", "*.quantserve.com", "*.comscore.com",
+    "spade.twitch.tv"
+]
+
+MEDIA_HOSTS = ["*.ttvnw.net"]  # Live video playlists and segments
+
+
+# Driver pool, warm Chrome instances reused between pages and cycles
+
+POOL = {
+    'idle': [],  # Drivers ready to be used
+    'loads': {},  # Pages loaded by each driver
+    'hits': 0,  # Driver taken from the pool
+    'misses': 0,  # Driver launched because the pool was empty
+    'recycled': 0,  # Driver quit after too many page loads
+    'crashed': 0  # Driver quit because it failed or stopped responding
+}
+POOLLOCK = threading.Lock()
+
+
+def browser_profile():
+    """
+        Return the 'browser' config with the BROWSER defaults for missing keys.
+    """
+
+    return dict(BROWSER, **CONFIG.get('browser', {}))
+
+
+def browser_options():
+    """
+        Return the Chrome options for the 'browser' config profile.
+    """
+
+    browser = browser_profile()
+    options = webdriver.ChromeOptions()
+
+    if browser['headless']:
+        options.add_argument("--headless")
+        options.add_argument("--disable-gpu")
+        options.add_argument("--window-size=1920,1080")
+
+    prefs = {}
+    if not browser['load_images']:
+        prefs['profile.managed_default_content_settings.images'] = 2
+    if prefs:
+        options.add_experimental_option("prefs", prefs)
+
+    blocked = list(browser['blocked_hosts'])
+    if browser['block_ads']:
+        blocked += AD_HOSTS
+    if not browser['load_media']:
+        blocked += MEDIA_HOSTS
+        options.add_argument("--autoplay-policy=user-gesture-required")
+        options.add_argument("--mute-audio")
+
+    if blocked:
+        rules = ", ".join([f"MAP {host} ~NOTFOUND" for host in blocked])
+        options.add_argument(f"--host-resolver-rules={rules}")
+
+    return options
+
 
-def get_twitch_html(url, language=None, closechat=False):
+def new_driver():
+    """
+        Return a new Chrome web driver with the 'browser' config profile.
+    """
+
+    with timed('owbot_chrome_start'):
+        driver = webdriver.Chrome(
+            os.path.join(HOME, CONFIG['config']['chrome_driver_path']),
+            options=browser_options())
+
+    if not browser_profile()['headless']:
+        driver.maximize_window()
+
+    return driver
+
+
+def quit_driver(driver):
+    """
+        Quit the driver ignoring errors, it could be already dead.
+    """
+
+    with POOLLOCK:
+        POOL['loads'].pop(driver, None)
+
+    try:
+        driver.quit()
+    except WebDriverException:
+        pass
+
+
+def driver_alive(driver):
+    """
+        Return True if the driver still answers to commands.
+    """
+
+    try:
+        driver.current_url  # Round trip to chromedriver
+        return True
+    except WebDriverException:
+        return False
+
+
+def acquire_driver():
+    """
+        Return a healthy driver from the pool, or a new one if the pool is
+        empty. It needs to be returned with 'release_driver'.
     """
-        Return the html source from the Twitch.tv url using Selenium and Chrome
-        web driver.
+
+    while True:
+        with POOLLOCK:
+            if not POOL['idle']:
+                POOL['misses'] += 1
+                break
+            driver = POOL['idle'].pop()
+
+        if driver_alive(driver):
+            with POOLLOCK:
+                POOL['hits'] += 1
+            return driver
+
+        with POOLLOCK:
+            POOL['crashed'] += 1
+        quit_driver(driver)
+
+    driver = new_driver()
+    with POOLLOCK:
+        POOL['loads'][driver] = 0
+
+    return driver
+
+
+def release_driver(driver, crashed=False):
+    """
+        Return the driver to the pool after one page load. The driver is quit
+        instead if it crashed, reached the 'pool_max_loads' config or the pool
+        already has 'pool_size' idle drivers.
+    """
+
+    size = CONFIG['config'].get('pool_size', 1)
+    maxloads = CONFIG['config'].get('pool_max_loads', 20)
+
+    if not crashed:
+        try:  # Forget the previous page settings (language, chat)
+            driver.delete_all_cookies()
+            driver.execute_script(
+                "window.localStorage.clear(); window.sessionStorage.clear();")
+            driver.get("about:blank")
+        except WebDriverException:
+            crashed = True
+
+    with POOLLOCK:
+        POOL['loads'][driver] = POOL['loads'].get(driver, 0) + 1
+
+        if crashed:
+            POOL['crashed'] += 1
+        elif POOL['loads'][driver] >= maxloads:
+            POOL['recycled'] += 1
+        elif len(POOL['idle']) < size:
+            POOL['idle'].append(driver)
+            return
+
+    quit_driver(driver)
+
+
+def warm_pool():
+    """
+        Launch drivers until the pool has 'pool_size' idle drivers, on each
+        worker process when it starts and before each cycle otherwise (check
+        warm_up()).
+    """
+
+    size = CONFIG['config'].get('pool_size', 1)
+    while len(POOL['idle']) < size:
+        driver = new_driver()
+        with POOLLOCK:
+            POOL['loads'][driver] = 0
+            POOL['idle'].append(driver)
+
+
+def close_pool():
+    """
+        Quit all the idle drivers, and stop the worker processes with theirs.
+    """
+
+    with POOLLOCK:
+        idle, POOL['idle'] = POOL['idle'], []
+
+    for driver in idle:
+        quit_driver(driver)
+
+    shutdown()
+
+
+def pool_stats():
+    """
+        Return a dictionary with the pool hits, misses, recycled and crashed
+        drivers counts, plus the hit rate.
+    """
+
+    with POOLLOCK:
+        stats = {
+            k: POOL[k]
+            for k in ['hits', 'misses', 'recycled', 'crashed']
+        }
+        stats['idle'] = len(POOL['idle'])
+
+    total = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / total, 2) if total else 0
+
+    return stats
+
+
+# Page readiness, the DOM markers each parser needs before reading the source
+
+DIRECTORY_READY = [(By.CSS_SELECTOR, "div.stream-thumbnail")]
+
+USER_READY = [(By.CSS_SELECTOR, "[data-a-target='stream-title']"),
+              (By.CSS_SELECTOR, "[data-a-target='channel-viewers-count']")]
+
+PHASES = {}  # Seconds spent on each page phase {phase: [count, total, max]}
+PHASESLOCK = threading.Lock()
+
+
+def record_phase(phase, seconds):
+    """
+        Add the seconds spent on a get_twitch_html phase to PHASES, and to the
+        'owbot_page_phase_seconds' histogram.
+    """
+
+    record('owbot_page_phase_seconds', seconds, phase=phase)
+
+    with PHASESLOCK:
+        count, total, highest = PHASES.get(phase, [0, 0, 0])
+        PHASES[phase] = [count + 1, total + seconds, max(highest, seconds)]
+
+
+def phase_stats():
+    """
+        Return a dictionary with the count, total, mean and max seconds spent on
+        each get_twitch_html phase.
+    """
+
+    with PHASESLOCK:
+        return {
+            phase: {
+                'count': count,
+                'total': round(total, 2),
+                'mean': round(total / count, 2),
+                'max': round(highest, 2)
+            }
+            for phase, (count, total, highest) in PHASES.items()
+        }
+
+
+PAGES = {'count': 0, 'load': 0, 'bytes': 0}  # Browser side page totals
+PAGESLOCK = threading.Lock()
+
+# Load time and bytes transferred of the current page, from the browser
+# Resource Timing, cross-origin resources without 'Timing-Allow-Origin' count
+# as 0 bytes, so it's a lower bound. Plus the JavaScript heap used (Chrome only)
+PAGE_METRICS_JS = """
+var nav = performance.getEntriesByType('navigation')[0];
+var bytes = nav ? nav.transferSize : 0;
+performance.getEntriesByType('resource').forEach(function (r) {
+    bytes += r.transferSize || 0;
+});
+var heap = performance.memory ? performance.memory.usedJSHeapSize : 0;
+return [nav ? nav.loadEventEnd - nav.startTime : 0, bytes, heap];
+"""
+
+
+def record_page(driver):
+    """
+        Add the browser load time and bytes transferred of the current page to
+        PAGES, the JavaScript heap goes to the 'owbot_browser_js_heap_bytes'
+        gauge.
+    """
+
+    try:
+        load, transferred, heap = driver.execute_script(PAGE_METRICS_JS)
+    except WebDriverException:
+        return
+
+    gauge('owbot_browser_js_heap_bytes', heap)
+
+    with PAGESLOCK:
+        PAGES['count'] += 1
+        PAGES['load'] += max(load, 0) / 1000
+        PAGES['bytes'] += transferred
+
+
+def page_stats():
+    """
+        Return a dictionary with the pages count, mean browser load seconds, and
+        total and mean KB transferred.
+    """
+
+    with PAGESLOCK:
+        count = PAGES['count']
+        return {
+            'count': count,
+            'mean_load': round(PAGES['load'] / count, 2) if count else 0,
+            'total_kb': round(PAGES['bytes'] / 1024),
+            'mean_kb': round(PAGES['bytes'] / 1024 / count) if count else 0
+        }
+
+
+def markers_present(markers):
+    """
+        Return a WebDriverWait condition that is True when there is at least one
+        element for each (By, selector) in 'markers'.
+    """
+
+    def condition(driver):
+        return all(driver.find_elements(*m) for m in markers)
+
+    return condition
+
+
+def throttle():
+    """
+        Sleep a random politeness delay between the 'throttle' config [min, max]
+        seconds, [0, 0] disables it.
+    """
+
+    low, high = CONFIG['config'].get('throttle', [0, 0])
+    if high > 0:
+        time.sleep(random.uniform(low, high))
+
+
+def record_html(htmlsource, name):
+    """
+        Save the html source as '<name>.<timestamp>.html' on the 'record_path'
+        (config) folder, to replay it offline with benchscrapper.py.
+    """
+
+    recordpath = os.path.join(HOME,
+                              CONFIG['config'].get('record_path', 'fixtures'))
+    if not os.path.exists(recordpath):
+        os.makedirs(recordpath)
+
+    recordfile = os.path.join(recordpath, f"{name}.{round(time.time())}.html")
+    with open(recordfile, 'w', encoding='utf-8') as f:
+        f.write(htmlsource)
+
+
+def select_language(driver, wait, language):
+    """
+        Click the directory language menu and the 'language' checkbox, then
+        wait until the directory is rendered again.
+    """
+
+    delta = time.time()
+
+    langmenu = "//div[contains(@class, 'language-select-menu')]"
+    wait.until(ec.element_to_be_clickable((By.XPATH, langmenu))).click()
+
+    cards = driver.find_elements(*DIRECTORY_READY[0])
+
+    langcheck = f"//div[contains(@class, 'tw-checkbox') and contains(@data-language-code, '{language}')]/label"
+    wait.until(ec.presence_of_element_located((By.XPATH, langcheck))).click()
+
+    try:  # The directory is rendered again with the new language
+        if cards:
+            wait.until(ec.staleness_of(cards[0]))
+    except TimeoutException:
+        pass
+
+    record_phase('language', time.time() - delta)
+
+
+def get_twitch_html(url,
+                    language=None,
+                    closechat=False,
+                    ready=None,
+                    cancel=None,
+                    record=None):
+    """
+        Return the html source from the Twitch.tv url using Selenium and a
+        Chrome web driver from the pool.
 
         If language is specified (es, en, fr, etc) it will click on the language
         menu and change it (works only on directory pages).
 
         If close chat is true, it will click the close chat toggle.
+
+        'ready' is a list of (By, selector) markers to wait for before reading
+        the source, after 'wait_timeout' (config) seconds the source is
+        returned anyway.
+
+        If 'cancel' (a threading.Event) is set before or while the page is
+        loading, False is returned as soon as possible.
+
+        If 'record_html' (config) is true the source is saved with the 'record'
+        name, check record_html().
     """
 
-    driver = webdriver.Chrome(
-        os.path.join(HOME, CONFIG['config']['chrome_driver_path']))
+    if cancel and cancel.is_set():
+        return False
+
+    timeout = CONFIG['config'].get('wait_timeout', 10)
 
-    driver.maximize_window()
-    driver.get(url)
-    time.sleep(random.uniform(1, 4))
+    delta = time.time()
+    throttle()
+    record_phase('throttle', time.time() - delta)
+
+    driver = acquire_driver()
 
     try:
-        if language:  # 'Click' the menu
-            langmenu = "//div[contains(@class, 'language-select-menu')]"
-            driver.find_element_by_xpath(langmenu).click()
-            time.sleep(random.uniform(1, 4))
+        delta = time.time()
+        driver.get(url)
+        record_phase('load', time.time() - delta)
+
+        if cancel and cancel.is_set():
+            release_driver(driver)
+            return False
 
-            langcheck = f"//div[contains(@class, 'tw-checkbox') and contains(@data-language-code, '{language}')]/label"
-            WebDriverWait(driver, 10).until(
-                ec.presence_of_element_located((By.XPATH, langcheck))).click()
-            time.sleep(random.uniform(1, 4))
+        wait = WebDriverWait(driver, timeout)
+
+        if language:  # 'Click' the menu
+            select_language(driver, wait, language)
 
         if closechat:  # Click the collapse chat button
+            delta = time.time()
+
             togglecol = "//button[contains(@data-a-target, 'right-column__toggle-collapse-btn')]"
-            driver.find_element_by_xpath(togglecol).click()
-            time.sleep(random.uniform(1, 4))
+            wait.until(ec.element_to_be_clickable((By.XPATH,
+                                                   togglecol))).click()
 
-    except NoSuchElementException:
+            record_phase('chat', time.time() - delta)
+
+    except (NoSuchElementException, TimeoutException):
         print(f"Clicking doesn't work on '{url}'")
-        driver.quit()
+        release_driver(driver)
         return False
 
-    html = driver.page_source
-    driver.quit()
+    except Exception:
+        release_driver(driver, crashed=True)
+        raise
+
+    try:
+        if ready:
+            delta = time.time()
+            try:
+                wait.until(markers_present(ready))
+            except TimeoutException:
+                print(f"Not ready after {timeout}s '{url}'")
+            record_phase('ready', time.time() - delta)
+
+        html = driver.page_source
+        record_page(driver)
+
+    except Exception:
+        release_driver(driver, crashed=True)
+        raise
+
+    release_driver(driver)
+
+    if record and CONFIG['config'].get('record_html', False):
+        record_html(html, record)
 
     return html
 
@@ -93,11 +571,27 @@ def uniquelist(l):
     return unique
 
 
+def href_handler(href, fullhref=False):
+    """
+        Return the social handler from the url, assuming that it's the first
+        keyword after the domain, or the complete url if 'fullhref' is True.
+        False if there isn't one.
+
+        https://twitter.com/lolirotve -> lolirotve
+    """
+
+    if fullhref:
+        return href.lower()
+
+    path = urlparse(href).path.replace('/', ' ').split()
+    return path[0].lower() if path else False
+
+
 def get_href_handler(htmlsource, href, fullhref=False):
     """
         Return a list of the social handlers from all urls in the 'htmlsource'
-        that contains 'href' in them, assuming that the social handler is the
-        first keyword after the domain.
+        (html or an already parsed BeautifulSoup) that contains 'href' in them,
+        assuming that the social handler is the first keyword after the domain.
 
         https://twitter.com/lolirotve -> lolirotve
         https://www.youtube.com/JJoNaKLove -> JJoNaKLove
@@ -105,21 +599,46 @@ def get_href_handler(htmlsource, href, fullhref=False):
         If 'fullhref' is True, the complete url will be returned instead.
     """
 
-    soup = BeautifulSoup(htmlsource, 'html.parser')
+    soup = htmlsource if isinstance(
+        htmlsource, BeautifulSoup) else BeautifulSoup(htmlsource, HTMLPARSER)
 
     found = []
     for a in soup.find_all('a', href=True):
         if href in a['href']:
-            if fullhref:
-                handler = a['href']
-            else:
-                url = urlparse(a['href'])
-                handler = url.path.replace('/', ' ').strip().split()[0]
-            found.append(handler.lower())
+            handler = href_handler(a['href'], fullhref)
+            if handler:
+                found.append(handler)
 
     return uniquelist(found)
 
 
+# Social networks found on the user page (name, href, fullhref)
+
+SOCIAL = [('twitter', "twitter.com/", False),
+          ('instagram', "instagram.com/", False),
+          ('facebook', "facebook.com/", False),
+          ('youtube', "youtube.com/", True),
+          ('discord', "discord.gg/", False)]
+
+
+def get_social_handlers(hrefs):
+    """
+        Return a dictionary with the list of handlers for each SOCIAL network,
+        classifying all the 'hrefs' urls in one pass.
+    """
+
+    found = {name: [] for name, _, _ in SOCIAL}
+
+    for url in hrefs:
+        for name, href, fullhref in SOCIAL:
+            if href in url:
+                handler = href_handler(url, fullhref)
+                if handler and handler not in found[name]:
+                    found[name].append(handler)
+
+    return found
+
+
 def increase_image_resolution(url, sizeinc=200):
     """
         Return the same url with the hardcoded resolution increased.
@@ -136,6 +655,45 @@ def increase_image_resolution(url, sizeinc=200):
     return url.replace(resolution, f"{w}x{h}")
 
 
+def cache_settings():
+    """
+        Return the 'cache' config for scrapcache, the 'path' relative to the
+        script directory.
+    """
+
+    settings = dict(CONFIG.get('cache', {}))
+    if settings.get('path'):
+        settings['path'] = os.path.join(HOME, settings['path'])
+
+    return settings
+
+
+def data_source(source=None):
+    """
+        Return the (directory, user, directory pages) data functions of the
+        'source' backend, the 'source' config by default. Both return the same
+        data.
+
+        'selenium' renders the pages with Chrome and parses the html.
+        'gql' reads the GraphQL API the pages load, without a browser.
+    """
+
+    source = source or CONFIG['config'].get('source', 'selenium')
+
+    if source == 'gql':
+        import twitchgql  # Here, it imports this module
+        return (twitchgql.directory_data, twitchgql.user_data,
+                twitchgql.directory_pages)
+
+    if workers_settings()['processes'] > 0:
+        return (worker_directory_data, worker_user_data,
+                worker_directory_pages)
+
+    return (selenium_directory_data, selenium_user_data,
+            selenium_directory_pages)
+
+
+@cached(cache_settings)
 def get_directory_data(url, language="en", increase_image=0):
     """
         Return a dictionary with the data for each stream in a Twitch.tv game
@@ -144,12 +702,65 @@ def get_directory_data(url, language="en", increase_image=0):
         'increase_image' will force the hardcoded image to increase that size.
     """
 
-    htmlsource = get_twitch_html(url, language=language)
+    directory_data = data_source()[0]
+    return directory_data(url, language, increase_image)
+
+
+def selenium_directory_data(url, language="en", increase_image=0):
+    """
+        get_directory_data rendering the page with Selenium.
+    """
+
+    game = url.replace('/', ' ').strip().split(' ')[-1].lower()
+
+    htmlsource = get_twitch_html(
+        url,
+        language=language,
+        ready=DIRECTORY_READY,
+        record=f"directory.{game}-{language}")
     if not htmlsource:
-        print(f"Error with get_directory_data({url})")
+        print(f"Error with selenium_directory_data({url})")
+        count('owbot_pages_total', page='directory', result='error')
         return False
 
-    soup = BeautifulSoup(htmlsource, 'html.parser')
+    delta = time.time()
+    data = parse_directory_html(htmlsource, increase_image)
+    record_phase('parse', time.time() - delta)
+    count('owbot_pages_total', page='directory', result='ok')
+
+    return data
+
+
+def viewers_count(text):
+    """
+        Return the viewers number in the text, -1 if there isn't one.
+
+        "1,234 viewers" -> 1234
+        "12.5K viewers" -> 12500
+    """
+
+    found = re.search(r"([\d.,]+)\s*([kKmM]?)\s*viewers", text)
+    if not found:
+        return -1
+
+    number, unit = found.groups()
+    if unit:
+        number = float(number.replace(',', ''))
+        return round(number * (1000 if unit.lower() == 'k' else 1000000))
+
+    digits = "".join([c for c in number if c.isdigit()])
+    return int(digits) if digits else -1
+
+
+def parse_directory_html(htmlsource, increase_image=0):
+    """
+        Return a dictionary with the data for each stream from the html source
+        of a Twitch.tv game directory page.
+
+        'increase_image' will force the hardcoded image to increase that size.
+    """
+
+    soup = BeautifulSoup(htmlsource, HTMLPARSER)
     data = []
 
     try:
@@ -167,10 +778,14 @@ def get_directory_data(url, language="en", increase_image=0):
             user = user['href'].replace(
                 '/', ' ').strip().split(' ')[0] if user else False
 
+            viewers = html.find(attrs={'data-a-target': 'stream-viewer-count'})
+            viewers = viewers_count(viewers.text if viewers else html.text)
+
             data.append({
                 'user': user,
                 'image': image,
                 'status': status,
+                'viewers': viewers,
                 'time': time.time()
             })
 
@@ -180,115 +795,533 @@ def get_directory_data(url, language="en", increase_image=0):
     return data
 
 
-def get_user_data(url):
+def iter_directory_data(url,
+                        language="en",
+                        increase_image=0,
+                        limit=None,
+                        min_viewers=0,
+                        cancel=None):
+    """
+        Yield the data of each stream on a Twitch.tv game directory, like
+        get_directory_data, loading more of the directory (scrolling down the
+        page) only when the streams already loaded are consumed. Streams
+        already yielded are skipped.
+
+        It stops after 'limit' streams, on the first stream with less than
+        'min_viewers' (the directory is sorted by viewers), at the end of the
+        directory or when 'cancel' is set.
+    """
+
+    directory_pages = data_source()[2]
+    pages = directory_pages(url, language, increase_image, cancel)
+
+    try:
+        yield from take_streams(pages, limit, min_viewers)
+    finally:
+        pages.close()  # Returns the driver as soon as the consumer stops
+
+
+def take_streams(pages, limit=None, min_viewers=0):
+    """
+        Yield the streams of each list of directory entries in 'pages', without
+        the users already yielded, until 'limit' streams or the first one with
+        less than 'min_viewers' (unknown viewers, -1, don't stop).
+    """
+
+    seen = set()
+    for page in pages:
+        for entry in page:
+            if not entry['user'] or entry['user'] in seen:
+                continue
+            if 0 <= entry['viewers'] < min_viewers:
+                return
+
+            seen.add(entry['user'])
+            yield entry
+
+            if limit and len(seen) >= limit:
+                return
+
+
+# Html of the directory cards after the first 'arguments[0]', and the last
+# card scrolled into view to load more, in one round trip
+NEW_CARDS_JS = """
+var cards = document.querySelectorAll('div.stream-thumbnail');
+var html = [];
+for (var i = arguments[0]; i < cards.length; i++) {
+    html.push(cards[i].outerHTML);
+}
+if (cards.length) {
+    cards[cards.length - 1].scrollIntoView();
+}
+return [cards.length, html.join('')];
+"""
+
+
+def more_cards(count):
+    """
+        Return a WebDriverWait condition that is True when the directory has
+        more than 'count' cards.
+    """
+
+    def condition(driver):
+        return len(driver.find_elements(*DIRECTORY_READY[0])) > count
+
+    return condition
+
+
+def selenium_directory_pages(url,
+                             language="en",
+                             increase_image=0,
+                             cancel=None):
+    """
+        Yield the list of new streams on the Twitch.tv directory page after
+        each scroll down, until there are no more after 'scroll_timeout'
+        (config) seconds or 'cancel' is set. Only the new cards are parsed.
+    """
+
+    timeout = CONFIG['config'].get('wait_timeout', 10)
+    scrolltimeout = CONFIG['config'].get('scroll_timeout', 5)
+
+    throttle()
+    driver = acquire_driver()
+    crashed = False
+
+    try:
+        delta = time.time()
+        driver.get(url)
+        record_phase('load', time.time() - delta)
+
+        wait = WebDriverWait(driver, timeout)
+        if language:
+            select_language(driver, wait, language)
+
+        try:
+            wait.until(markers_present(DIRECTORY_READY))
+        except TimeoutException:
+            print(f"Not ready after {timeout}s '{url}'")
+            return
+
+        parsed = 0
+        while not (cancel and cancel.is_set()):
+            parsed, html = driver.execute_script(NEW_CARDS_JS, parsed)
+
+            delta = time.time()
+            page = parse_directory_html(html, increase_image)
+            record_phase('parse', time.time() - delta)
+
+            yield page
+
+            delta = time.time()
+            try:
+                WebDriverWait(driver, scrolltimeout).until(more_cards(parsed))
+            except TimeoutException:
+                return  # The end of the directory
+            finally:
+                record_phase('scroll', time.time() - delta)
+
+    except (NoSuchElementException, TimeoutException):
+        print(f"Clicking doesn't work on '{url}'")
+
+    except Exception:
+        crashed = True
+        raise
+
+    finally:
+        if not crashed:
+            record_page(driver)
+        release_driver(driver, crashed)
+
+
+@cached(cache_settings)
+def get_user_data(url, cancel=None):
     """
         Return a dictionary with the user data on a Twitch.tv streamer page like
         https://www.twitch.tv/chipshajen
     """
 
-    htmlsource = get_twitch_html(url, closechat=True)
+    user_data = data_source()[1]
+    return user_data(url, cancel)
+
+
+def selenium_user_data(url, cancel=None):
+    """
+        get_user_data rendering the page with Selenium.
+    """
+
+    user = url.replace('/', ' ').strip().split(' ')[-1]
+
+    htmlsource = get_twitch_html(
+        url,
+        closechat=True,
+        ready=USER_READY,
+        cancel=cancel,
+        record=f"user.{user}")
+    if cancel and cancel.is_set():
+        count('owbot_pages_total', page='user', result='cancelled')
+        return False
+
     if not htmlsource:
-        print(f"Error with get_user_data({url})")
+        print(f"Error with selenium_user_data({url})")
+        count('owbot_pages_total', page='user', result='error')
         return False
 
-    soup = BeautifulSoup(htmlsource, 'html.parser')
-    data = {}
+    delta = time.time()
+    data = parse_user_html(htmlsource, user)
+    record_phase('parse', time.time() - delta)
+    count('owbot_pages_total', page='user', result='ok')
 
-    user = url.replace('/', ' ').strip().split(' ')[-1]
+    return data
 
-    status = soup.find('span', {
-        'data-a-target': 'stream-title',
-        'title': True
-    })
-    status = status['title'] if status else False
 
-    try:
-        viewers = soup.find('div', {
-            'class': 'tw-stat',
-            'data-a-target': 'channel-viewers-count'
-        }).find('span', {'data-a-target': 'tw-stat-value'})
-        viewers = viewers.text if viewers else False
-        viewers = "".join([c for c in viewers if c.isdigit()])
-    except AttributeError:
-        viewers = -1
+# Selectors for the user page stats, the 'data-a-target' of the stat element
+# followed by the find() arguments to reach the number inside it
+
+USER_STATS = {
+    'viewers': ('channel-viewers-count', [('span', {
+        'data-a-target': 'tw-stat-value'
+    })]),
+    'total_views': ('total-views-count', [('span', {
+        'data-a-target': 'tw-stat-value'
+    })]),
+    'followers': ('followers-channel-header-item', [('div', {
+        'class': 'channel-header__item-count'
+    }), ('span', {})]),
+    'following': ('following-channel-header-item', [('div', {
+        'class': 'channel-header__item-count'
+    }), ('span', {})]),
+    'videos_count': ('videos-channel-header-item', [('div', {
+        'class': 'channel-header__item-count'
+    }), ('span', {})])
+}
+
+
+def stat_value(targets, selector):
+    """
+        Return the number found with the USER_STATS 'selector' from the
+        'targets' index {data-a-target: element}, -1 if there isn't one.
 
-    try:
-        total_views = soup.find('div', {
-            'class': 'tw-stat',
-            'data-a-target': 'total-views-count'
-        }).find('span', {'data-a-target': 'tw-stat-value'})
-        total_views = total_views.text if total_views else False
-        total_views = "".join([c for c in total_views if c.isdigit()])
-    except AttributeError:
-        total_views = -1
-
-    twitter = get_href_handler(htmlsource, "twitter.com/")
-    instagram = get_href_handler(htmlsource, "instagram.com/")
-    facebook = get_href_handler(htmlsource, "facebook.com/")
-    youtube = get_href_handler(htmlsource, "youtube.com/", fullhref=True)
-    discord = get_href_handler(htmlsource, "discord.gg/")
+        "1,523,774" -> 1523774
+    """
+
+    target, finds = selector
+
+    stat = targets.get(target)
+    for name, attrs in finds:
+        stat = stat.find(name, attrs) if stat else None
+
+    digits = "".join([c for c in stat.text if c.isdigit()]) if stat else ""
+
+    return int(digits) if digits else -1
+
+
+def parse_user_html(htmlsource, user):
+    """
+        Return a dictionary with the user data from the html source of a
+        Twitch.tv streamer page, parsed and traversed only once.
+    """
+
+    soup = BeautifulSoup(htmlsource, HTMLPARSER)
+
+    hrefs = []
+    targets = {}  # The first element for each 'data-a-target'
+    cardbody = None
+
+    for tag in soup.find_all(True):
+
+        if tag.name == 'a' and tag.has_attr('href'):
+            hrefs.append(tag['href'])
+
+        target = tag.get('data-a-target')
+        if target and target not in targets:
+            targets[target] = tag
+
+        if not cardbody and tag.name == 'div' and 'tw-card-body' in tag.get(
+                'class', []):
+            cardbody = tag
+
+    status = targets.get('stream-title')
+    status = status.get('title', False) if status else False
+
+    tags = cardbody.find('div', {'class': 'tw-flex'}) if cardbody else None
+    tags = [i.text for i in tags.find_all("p")] if tags else []
 
+    data = {'user': user, 'status': status}
+    data.update(get_social_handlers(hrefs))
+    data.update({k: stat_value(targets, v) for k, v in USER_STATS.items()})
+    data.update({'tags': tags, 'time': time.time()})
+
+    return data
+
+
+# Worker processes, Selenium runs on supervised processes so a hung or leaking
+# Chrome is killed with its whole process tree, check scrapworkers.py
+
+
+def workers_settings():
+    """
+        Return the 'workers' config with the scrapworkers DEFAULTS for missing
+        keys.
+    """
+
+    return dict(WORKERS, **CONFIG.get('workers', {}))
+
+
+def take_stats():
+    """
+        Return and forget the page phases, pages and pool counters recorded so
+        far, to merge_stats() them on another process.
+    """
+
+    with PHASESLOCK:
+        phases = dict(PHASES)
+        PHASES.clear()
+
+    with PAGESLOCK:
+        pages = dict(PAGES)
+        PAGES.update({'count': 0, 'load': 0, 'bytes': 0})
+
+    with POOLLOCK:
+        pool = {k: POOL[k] for k in ['hits', 'misses', 'recycled', 'crashed']}
+        POOL.update({k: 0 for k in pool})
+
+    return {'phases': phases, 'pages': pages, 'pool': pool}
+
+
+def merge_stats(stats):
+    """
+        Add the stats from take_stats() to the ones of this process.
+    """
+
+    with PHASESLOCK:
+        for phase, (n, total, highest) in stats['phases'].items():
+            count, mine, maximum = PHASES.get(phase, [0, 0, 0])
+            PHASES[phase] = [count + n, mine + total, max(maximum, highest)]
+
+    with PAGESLOCK:
+        for k, v in stats['pages'].items():
+            PAGES[k] += v
+
+    with POOLLOCK:
+        for k, v in stats['pool'].items():
+            POOL[k] += v
+
+
+def worker_job(name, args, config, cancellable=False):
+    """
+        Run the scrapper function 'name' on a worker process with the config of
+        owbot, 'cancellable' functions get the job_cancel() event as 'cancel'.
+        Return its result with the stats and metrics recorded meanwhile.
+    """
+
+    CONFIG.clear()
+    CONFIG.update(config)
+
+    if cancellable:
+        result = globals()[name](*args, cancel=job_cancel())
+    else:
+        result = globals()[name](*args)
+
+    return result, take_stats(), take_metrics()
+
+
+def worker_pages_job(name, args, config):
+    """
+        Yield each page of the scrapper generator 'name' run on a worker process
+        with the config of owbot and the job_cancel() event, with the stats and
+        metrics recorded meanwhile. What is recorded after the last page goes
+        with the next job of the worker.
+    """
+
+    CONFIG.clear()
+    CONFIG.update(config)
+
+    pages = globals()[name](*args, cancel=job_cancel())
     try:
-        followers = soup.find('a', {
-            'data-a-target': 'followers-channel-header-item'
-        }).find('div', {
-            'class': 'channel-header__item-count'
-        }).find('span')
-        followers = followers.text if followers else False
-        followers = "".join([c for c in followers if c.isdigit()])
-    except AttributeError:
-        followers = -1
+        for page in pages:
+            yield page, take_stats(), take_metrics()
+    finally:
+        pages.close()
+
+
+def workers():
+    """
+        Return the supervisor of the worker processes, started the first time.
+        Each worker fills its driver pool when it starts, again after a restart.
+    """
+
+    return supervisor(workers_settings(), ('twitchscrapper', 'close_pool'),
+                      ('twitchscrapper', 'warm_pool'))
+
+
+def warm_up():
+    """
+        Launch the Chrome drivers ahead of the first pages of a cycle, on the
+        driver pool of this process, or by starting the worker processes that
+        fill their own. Nothing for the GraphQL source.
+    """
 
+    directory_data = data_source()[0]
     try:
-        following = soup.find('a', {
-            'data-a-target': 'following-channel-header-item'
-        }).find('div', {
-            'class': 'channel-header__item-count'
-        }).find('span')
-        following = following.text if following else False
-        following = "".join([c for c in following if c.isdigit()])
-    except AttributeError:
-        following = -1
+        if directory_data is selenium_directory_data:
+            warm_pool()
+        elif directory_data is worker_directory_data:
+            workers()
+    except Exception as e:  # The pages will fail and be retried on their own
+        print(f"Warm up failed: {type(e).__name__}: {e}")
 
+
+def on_worker(name, *args, cancel=None):
+    """
+        Return the result of the scrapper function 'name' run on a worker
+        process, merging back its stats and metrics. False if the job timed out
+        or the worker died. The 'cancel' event is passed on to the function.
+    """
+
+    done = workers().run(
+        'twitchscrapper',
+        'worker_job',
+        name,
+        args,
+        CONFIG,
+        cancel is not None,
+        cancel=cancel)
+    if done is False:
+        return False
+
+    result, stats, metrics = done
+    merge_stats(stats)
+    merge_metrics(metrics)
+
+    return result
+
+
+def worker_directory_data(url, language="en", increase_image=0):
+    """
+        selenium_directory_data on a worker process.
+    """
+
+    return on_worker('selenium_directory_data', url, language, increase_image)
+
+
+def worker_user_data(url, cancel=None):
+    """
+        selenium_user_data on a worker process, 'cancel' stops the page on the
+        worker too.
+    """
+
+    if cancel and cancel.is_set():
+        return False
+
+    return on_worker('selenium_user_data', url, cancel=cancel)
+
+
+def worker_directory_pages(url, language="en", increase_image=0, cancel=None):
+    """
+        selenium_directory_pages on a worker process, each list of new streams
+        is yielded as soon as the worker parses it. Closing the generator or
+        setting 'cancel' stops the scroll on the worker.
+    """
+
+    jobs = workers().stream(
+        'twitchscrapper',
+        'worker_pages_job',
+        'selenium_directory_pages', (url, language, increase_image),
+        CONFIG,
+        cancel=cancel)
     try:
-        videos = soup.find('a', {
-            'data-a-target': 'videos-channel-header-item'
-        }).find('div', {
-            'class': 'channel-header__item-count'
-        }).find('span')
-        videos = videos.text if videos else False
-        videos = "".join([c for c in videos if c.isdigit()])
-    except AttributeError:
-        videos = -1
+        for page, stats, metrics in jobs:
+            merge_stats(stats)
+            merge_metrics(metrics)
+            yield page
+    finally:
+        jobs.close()
+
+
+def get_directories_data(pages, increase_image=0, limit=None, min_viewers=0):
+    """
+        Return the list of get_directory_data for each (url, language) in
+        'pages', scrapped at the same time with up to 'max_workers' (config)
+        threads. False for the pages that failed.
+
+        With 'limit' or 'min_viewers' each directory is scrolled down with
+        iter_directory_data to collect more than the first render.
+    """
+
+    workers = max(1, min(len(pages), CONFIG['config'].get('max_workers', 4)))
+
+    def directory(page):
+        url, language = page
+        try:
+            if limit or min_viewers:
+                return list(
+                    iter_directory_data(url, language, increase_image, limit,
+                                        min_viewers)) or False
+            return get_directory_data(url, language, increase_image)
+        except Exception as e:
+            print(f"Error with get_directory_data({url}):\n{e}".strip())
+            return False
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(directory, pages))
+
+
+def get_users_data(urls, top=1, cache=None):
+    """
+        Yield (url, data) for each url in 'urls' in the same order, scrapping
+        the next 'top' user pages at the same time with up to 'max_workers'
+        (config) threads. 'urls' is consumed lazily, so it can be a generator.
+
+        Closing the generator (e.g. a break on the first valid result) cancels
+        the pending pages, the ones already loading stop as soon as possible.
+
+        If 'cache' is a dictionary the urls in it aren't scrapped again and the
+        new results are saved on it, e.g. to share the pages of one cycle.
+    """
+
+    top = max(1, top)
+    workers = max(1, min(top, CONFIG['config'].get('max_workers', 4)))
+
+    cancel = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    urls = iter(urls)
+    pending = []
 
     try:
-        tags = soup.find('div', {
-            'class': 'tw-card-body'
-        }).find('div', {
-            'class': 'tw-flex'
-        }).find_all("p")
-        tags = [i.text for i in tags]
-    except AttributeError:
-        tags = []
-
-    data = {
-        'user': user,
-        'status': status,
-        'twitter': twitter,
-        'instagram': instagram,
-        'facebook': facebook,
-        'youtube': youtube,
-        'discord': discord,
-        'viewers': int(viewers),
-        'total_views': int(total_views),
-        'followers': int(followers),
-        'following': int(following),
-        'videos_count': int(videos),
-        'tags': tags,
-        'time': time.time()
-    }
+        while True:
+            for url in urls:  # Fill the window
+                if cache is not None and url in cache:
+                    pending.append((url, None))
+                else:
+                    pending.append(
+                        (url, executor.submit(get_user_data, url, cancel)))
+                if len(pending) >= top:
+                    break
+
+            if not pending:
+                break
+
+            url, future = pending.pop(0)
+            if future is None:
+                data = cache[url]
+            else:
+                try:
+                    data = future.result()
+                except Exception as e:
+                    print(f"Error with get_user_data({url}):\n{e}".strip())
+                    data = False
 
-    return data
+                if cache is not None:
+                    cache[url] = data
+
+            yield url, data
+
+    finally:
+        cancel.set()
+        for _, future in pending:
+            if future:
+                future.cancel()
+        executor.shutdown(wait=False)
 
 
 if __name__ == "__main__":
@@ -314,4 +1347,9 @@ if __name__ == "__main__":
     with open(os.path.join(HOME, "sample-user.json"), "w") as f:
         json.dump(get_user_data("https://www.twitch.tv/xqcow"), f)
 
+    close_pool()
+    print(f"Pool: {pool_stats()}")
+    print(f"Phases: {phase_stats()}")
+    print(f"Pages: {page_stats()}")
+
     print(f"\nDone! ({round(time.time() - DELTA)}s)")
@@ -0,0 +1,257 @@
+"""
+    Streaming viewer statistics per streamer, O(1) memory per user: running
+    mean and variance (Welford), approximate percentiles (P-square) and a time
+    decayed recent average
+
+    python viewerstats.py
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import time
+
+HOME = os.path.normpath(  # The script directory + cxfreeze compatibility
+    os.path.dirname(
+        sys.executable if getattr(sys, 'frozen', False) else __file__))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS viewer_stats (
+    user TEXT PRIMARY KEY,
+    stats TEXT NOT NULL
+);
+"""
+
+QUANTILES = [0.5, 0.9]
+
+HALFLIFE = 86400  # Seconds for an old sample to weight half on the recent mean
+
+MIN_INTERVAL = 60  # Samples closer than this are the same snapshot
+
+
+def new_stats():
+    """
+        Return the empty statistics of a streamer.
+    """
+
+    return {
+        'n': 0,
+        'mean': 0,
+        'm2': 0,  # Sum of squared differences from the mean
+        'min': 0,
+        'max': 0,
+        'recent': 0,  # Decayed mean
+        'last': 0,  # Time of the last sample
+        'p2': {str(q): p2_new(q) for q in QUANTILES}
+    }
+
+
+def update(stats, viewers, when=None, halflife=HALFLIFE):
+    """
+        Add the viewers sample to the statistics, ignored if it's closer than
+        MIN_INTERVAL to the last one. Return True if it was added.
+    """
+
+    when = time.time() if when is None else when
+    if stats['n'] and when - stats['last'] < MIN_INTERVAL:
+        return False
+
+    # Welford
+
+    stats['n'] += 1
+    delta = viewers - stats['mean']
+    stats['mean'] += delta / stats['n']
+    stats['m2'] += delta * (viewers - stats['mean'])
+
+    stats['min'] = min(stats['min'], viewers) if stats['n'] > 1 else viewers
+    stats['max'] = max(stats['max'], viewers)
+
+    # Exponential decay by elapsed time
+
+    if stats['n'] == 1:
+        stats['recent'] = viewers
+    else:
+        alpha = 1 - 0.5**((when - stats['last']) / halflife)
+        stats['recent'] += alpha * (viewers - stats['recent'])
+    stats['last'] = when
+
+    for marker in stats['p2'].values():
+        p2_update(marker, viewers)
+
+    return True
+
+
+def variance(stats):
+    """
+        Return the sample variance.
+    """
+
+    return stats['m2'] / (stats['n'] - 1) if stats['n'] > 1 else 0
+
+
+def summary(stats):
+    """
+        Return a dictionary with the statistics rounded to be shown.
+    """
+
+    data = {
+        'n': stats['n'],
+        'mean': round(stats['mean']),
+        'std': round(variance(stats)**0.5),
+        'min': stats['min'],
+        'max': stats['max'],
+        'recent': round(stats['recent'])
+    }
+    for q, marker in stats['p2'].items():
+        data[f"p{round(float(q) * 100)}"] = round(p2_value(marker))
+
+    return data
+
+
+# P-square algorithm (Jain & Chlamtac 1985), one quantile estimated with five
+# markers without keeping the samples
+
+
+def p2_new(p):
+    """
+        Return the markers to estimate the 'p' quantile.
+    """
+
+    return {
+        'p': p,
+        'q': [],  # Heights
+        'n': [0, 1, 2, 3, 4],  # Positions
+        'np': [0, 2 * p, 4 * p, 2 + 2 * p, 4],  # Desired positions
+        'dn': [0, p / 2, p, (1 + p) / 2, 1]  # Desired positions increment
+    }
+
+
+def p2_update(marker, x):
+    """
+        Add the sample 'x' to the markers.
+    """
+
+    q, n, np, dn = marker['q'], marker['n'], marker['np'], marker['dn']
+
+    if len(q) < 5:
+        q.append(x)
+        q.sort()
+        return
+
+    if x < q[0]:
+        q[0] = x
+        k = 0
+    elif x >= q[4]:
+        q[4] = x
+        k = 3
+    else:
+        k = max([i for i in range(4) if q[i] <= x])
+
+    for i in range(k + 1, 5):
+        n[i] += 1
+    for i in range(5):
+        np[i] += dn[i]
+
+    for i in (1, 2, 3):
+        d = np[i] - n[i]
+        if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1
+                                                 and n[i - 1] - n[i] < -1):
+            d = 1 if d > 0 else -1
+
+            qp = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) /
+                (n[i + 1] - n[i]) + (n[i + 1] - n[i] - d) *
+                (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+            if not q[i - 1] < qp < q[i + 1]:  # Linear instead
+                qp = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+
+            q[i] = qp
+            n[i] += d
+
+
+def p2_value(marker):
+    """
+        Return the estimated quantile, exact with less than five samples.
+    """
+
+    q = marker['q']
+    if len(q) < 5:
+        return q[round(marker['p'] * (len(q) - 1))] if q else 0
+
+    return q[2]
+
+
+# Persistence on the owbot state database, one json row per user
+
+
+def open_stats(db):
+    """
+        Create the statistics table on the SQLite connection if needed.
+    """
+
+    db.executescript(SCHEMA)
+
+
+def load_stats(db, users):
+    """
+        Return a dictionary with the statistics of each user, new ones for users
+        without them.
+    """
+
+    users = list(users)
+    stats = {user: new_stats() for user in users}
+
+    for i in range(0, len(users), 500):  # SQLite variables limit
+        chunk = users[i:i + 500]
+        marks = ", ".join(["?"] * len(chunk))
+        for user, data in db.execute(
+                f"SELECT user, stats FROM viewer_stats WHERE user IN ({marks})",
+                chunk):
+            stats[user] = json.loads(data)
+
+    return stats
+
+
+def observe(db, samples, halflife=HALFLIFE):
+    """
+        Update the statistics of each (user, viewers, time) sample in one
+        transaction. Samples with unknown viewers (< 0) are ignored. Return the
+        count of samples added.
+    """
+
+    samples = [i for i in samples if i[0] and i[1] is not None and i[1] >= 0]
+    stats = load_stats(db, [i[0] for i in samples])
+
+    added = [user for user, viewers, when in samples
+             if update(stats[user], viewers, when, halflife)]
+
+    with db:
+        db.executemany(
+            "INSERT OR REPLACE INTO viewer_stats (user, stats) VALUES (?, ?)",
+            [(user, json.dumps(stats[user])) for user in set(added)])
+
+    return len(added)
+
+
+def ranking(db, n=10, by='recent'):
+    """
+        Return the top 'n' users as a list of (user, summary) ordered by a
+        summary field, the decayed 'recent' mean by default.
+    """
+
+    rows = db.execute("SELECT user, stats FROM viewer_stats")
+    top = [(user, summary(json.loads(data))) for user, data in rows]
+    top.sort(key=lambda i: i[1][by], reverse=True)
+
+    return top[:n]
+
+
+if __name__ == "__main__":
+
+    DB = sqlite3.connect(os.path.join(HOME, "owbot.db"))
+    open_stats(DB)
+
+    for USER, SUMMARY in ranking(DB, 20):
+        print(f"{USER:<30} {SUMMARY}")